@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class AnalysisCache:
+    """
+    Persistent cache of analyze_document results.
+
+    Results are stored as JSON in SQLite under a key derived from everything
+    that determines them (document content hash, prompt texts, model settings).
+    Entries older than ttl seconds are treated as missing, and the least
+    recently used ones are evicted once more than max_entries are stored.
+    """
+
+    def __init__(self, cache_path, ttl=7 * 24 * 3600, max_entries=1000):
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS analyses (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_analyses_last_access ON analyses (last_access)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(*parts):
+        """Stable key from any JSON-serialisable parts"""
+        payload = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return (result, created_at) for a fresh entry, or None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result, created_at FROM analyses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._conn.execute("DELETE FROM analyses WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE analyses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return json.loads(row[0]), row[1]
+
+    def put(self, key, result):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analyses (key, result, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(result), now, now)
+            )
+            self._conn.execute("DELETE FROM analyses WHERE created_at < ?", (now - self.ttl,))
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM analyses").fetchone()
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM analyses WHERE key IN "
+                    "(SELECT key FROM analyses ORDER BY last_access LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM analyses").fetchone()
+            return {
+                'entries': entries,
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses
+            }
@@ -0,0 +1,223 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Years, amounts and other figures ("2014-15", "1,200", "4.5")
+_FIGURE = re.compile(r'\d+(?:[.,/:-]\d+)*')
+
+
+class _DocumentAnswers:
+    """
+    Cached questions of one document: unit question vectors as rows and their
+    answers, plus answers to questions that were never embedded, keyed by their text
+    """
+
+    def __init__(self, version, dim):
+        self.version = version
+        self.vectors = np.empty((0, dim or 0), dtype=np.float32)
+        self.questions = []
+        self.figures = []
+        self.answers = []
+        self.created_at = np.empty(0)
+        self.last_access = np.empty(0)
+        # normalized question -> (question, answer, created_at), least recently used first
+        self.exact = OrderedDict()
+
+    def __len__(self):
+        return len(self.questions)
+
+    def drop(self, keep):
+        """Keep only the rows where the boolean mask keep is set"""
+        self.vectors = self.vectors[keep]
+        self.questions = [q for q, k in zip(self.questions, keep) if k]
+        self.figures = [f for f, k in zip(self.figures, keep) if k]
+        self.answers = [a for a, k in zip(self.answers, keep) if k]
+        self.created_at = self.created_at[keep]
+        self.last_access = self.last_access[keep]
+
+
+class SemanticAnswerCache:
+    """
+    In-memory cache of answers per document, matched by question similarity.
+
+    Each document holds the embeddings of past standalone questions with their
+    answers. A lookup returns the answer of the most similar cached question
+    when its cosine similarity reaches threshold and both questions name the
+    same figures, since "budget 2014-15" and "budget 2015-16" embed almost
+    alike. Questions answered without an embedding (identifier lookups
+    served from the keyword index) only match the same question text.
+    Entries expire after ttl seconds and the least recently used ones are
+    evicted beyond max_entries per document; the least recently used
+    documents are dropped beyond max_documents. A document's entries are
+    discarded as soon as it is looked up or stored with a different index
+    version.
+    """
+
+    def __init__(self, threshold=0.95, ttl=24 * 3600, max_entries=200, max_documents=1000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_documents = max_documents
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def _figures(question):
+        return frozenset(_FIGURE.findall(question or ''))
+
+    def _same_figures(self, entries, question):
+        figures = self._figures(question)
+        return np.array([f == figures for f in entries.figures], dtype=bool)
+
+    @staticmethod
+    def _text_key(question):
+        return ' '.join(question.lower().split())
+
+    def _document(self, doc_id, version, dim=None, create=False):
+        """Entries of doc_id at version, dropping them when the version or embedding size changed"""
+        entries = self._documents.get(doc_id)
+        if entries is not None and dim is not None and entries.vectors.shape[1] != dim:
+            if len(entries):
+                entries = None
+            else:
+                # Only text-keyed answers so far, the first embedding sets the size
+                entries.vectors = np.empty((0, dim), dtype=np.float32)
+        if entries is not None and entries.version != version:
+            entries = None
+        if entries is None and doc_id in self._documents:
+            del self._documents[doc_id]
+            self.invalidations += 1
+        if entries is None and create:
+            entries = self._documents[doc_id] = _DocumentAnswers(version, dim)
+            while len(self._documents) > self.max_documents:
+                self._documents.popitem(last=False)
+        if entries is not None:
+            self._documents.move_to_end(doc_id)
+        return entries
+
+    def _expire(self, entries, now):
+        fresh = now - entries.created_at <= self.ttl
+        if not fresh.all():
+            entries.drop(fresh)
+        for key in [key for key, (_, _, created_at) in entries.exact.items() if now - created_at > self.ttl]:
+            del entries.exact[key]
+
+    def lookup(self, doc_id, version, vector, question=None):
+        """
+        Cached answer for a question and its embedding: dict with question, answer, similarity, created_at; or None.
+        Without an embedding (vector None) only an earlier answer to the same question text matches.
+        """
+        if vector is None:
+            return self._lookup_exact(doc_id, version, question)
+        vector = self._unit(vector)
+        now = time.time()
+        with self._lock:
+            entries = self._document(doc_id, version, len(vector))
+            if entries is not None:
+                self._expire(entries, now)
+            if not entries:
+                self.misses += 1
+                return None
+
+            similarities = entries.vectors @ vector
+            # Rows naming other figures never match, however similar
+            similarities[~self._same_figures(entries, question)] = -1.0
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            entries.last_access[best] = now
+            self.hits += 1
+            return {
+                'question': entries.questions[best],
+                'answer': entries.answers[best],
+                'similarity': round(float(similarities[best]), 4),
+                'created_at': float(entries.created_at[best])
+            }
+
+    def _lookup_exact(self, doc_id, version, question):
+        key = self._text_key(question)
+        now = time.time()
+        with self._lock:
+            entries = self._document(doc_id, version)
+            if entries is not None:
+                self._expire(entries, now)
+            if entries is None or key not in entries.exact:
+                self.misses += 1
+                return None
+            entries.exact.move_to_end(key)
+            cached_question, answer, created_at = entries.exact[key]
+            self.hits += 1
+            return {'question': cached_question, 'answer': answer, 'similarity': 1.0, 'created_at': created_at}
+
+    def _store_exact(self, doc_id, version, question, answer):
+        key = self._text_key(question)
+        with self._lock:
+            entries = self._document(doc_id, version, create=True)
+            entries.exact[key] = (question, answer, time.time())
+            entries.exact.move_to_end(key)
+            while len(entries.exact) > self.max_entries:
+                entries.exact.popitem(last=False)
+
+    def store(self, doc_id, version, question, vector, answer):
+        if vector is None:
+            self._store_exact(doc_id, version, question, answer)
+            return
+        vector = self._unit(vector)
+        now = time.time()
+        with self._lock:
+            entries = self._document(doc_id, version, len(vector), create=True)
+            self._expire(entries, now)
+            if len(entries):
+                # A near-duplicate answered concurrently is replaced, not added twice
+                keep = (entries.vectors @ vector < self.threshold) | ~self._same_figures(entries, question)
+                if not keep.all():
+                    entries.drop(keep)
+            while len(entries) >= self.max_entries:
+                keep = np.ones(len(entries), dtype=bool)
+                keep[int(np.argmin(entries.last_access))] = False
+                entries.drop(keep)
+
+            entries.vectors = np.vstack([entries.vectors, vector[None, :]])
+            entries.questions.append(question)
+            entries.figures.append(self._figures(question))
+            entries.answers.append(answer)
+            entries.created_at = np.append(entries.created_at, now)
+            entries.last_access = np.append(entries.last_access, now)
+
+    def invalidate(self, doc_id=None):
+        """Forget the answers of one document, or of all documents"""
+        with self._lock:
+            if doc_id is None:
+                self.invalidations += len(self._documents)
+                self._documents.clear()
+            elif self._documents.pop(doc_id, None) is not None:
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'documents': len(self._documents),
+                'entries': sum(len(entries) + len(entries.exact) for entries in self._documents.values()),
+                'threshold': self.threshold,
+                'ttl': self.ttl,
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
@@ -1,37 +1,172 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 import os
-from langchain_groq import ChatGroq
-from langchain_community.document_loaders.pdf import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain_core.prompts import MessagesPlaceholder, ChatPromptTemplate
-from langchain_core.messages import AIMessage, HumanMessage
+import re
+import shutil
+import hashlib
+import threading
+import json
+import time
+import uuid
+from json import JSONDecodeError
+from urllib.parse import urlencode
+import importlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from langchain_core.messages import HumanMessage
 from dotenv import load_dotenv
 from datetime import datetime
-from langchain_community.embeddings import OllamaEmbeddings
+from analysis_cache import AnalysisCache
+from answer_cache import SemanticAnswerCache
+from rag_state import DocumentCache, LoadedDocument, SessionRegistry
+from chat_memory import ConversationMemory
+from jobs import IngestJob, BatchJob, WarmupJob, JobManager
+from ingest_pipeline import prefetch, ordered_map, iter_split_batches
+from uploads import (PARTIAL_PREFIX, PARTIAL_SUFFIX, FileHashes, clean_filename, hash_file, link_file,
+                     remove_partial_uploads, upload_request_class)
+from document_registry import DocumentRegistry
+from index_segments import TRASH_PREFIX, SegmentedManifest, publish_directory, remove_incomplete, staging_directory
+from cfr_tables import CfrTableExtractor, EXTRACTOR_VERSION, load_tables, save_tables
+from scoring import SECTION_WEIGHTS, RATING_THRESHOLDS, SCORE_TABLE_PATH, ScoreTable, ranking
+from metrics import (metrics, span, record_stage, chain_config, StageTimings,
+                     start_request_timings, end_request_timings, current_timings)
 
 load_dotenv()
 
 app = Flask(__name__)
-CORS(app)
+# The PDF viewer needs these to fetch byte ranges and revalidate cross-origin
+CORS(app, expose_headers=['Accept-Ranges', 'Content-Range', 'Content-Length', 'ETag', 'Last-Modified',
+                          'X-Next-Cursor', 'Link'])
 
 UPLOAD_FOLDER = 'uploads'
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
-
-llm = ChatGroq(
-    api_key=os.getenv("GROQ_API_KEY"),
-    model="llama3-70b-8192",
-    temperature=0,
+# Uploads are kept here under their content hash, which is what ingest
+# reads; the client's file name in UPLOAD_FOLDER is a link to the same
+# content and may be replaced by a later upload of the same name
+UPLOAD_CONTENT_FOLDER = os.path.join(UPLOAD_FOLDER, 'by-hash')
+os.makedirs(UPLOAD_CONTENT_FOLDER, exist_ok=True)
+remove_partial_uploads(UPLOAD_FOLDER)
+remove_partial_uploads(UPLOAD_CONTENT_FOLDER)
+
+# Uploaded files are streamed to disk and hashed while they arrive, larger
+# uploads are rejected with 413
+MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "100"))
+app.request_class = upload_request_class(UPLOAD_FOLDER, MAX_UPLOAD_MB * 1024 * 1024)
+# Leaves room for the multipart framing around the file
+app.config['MAX_CONTENT_LENGTH'] = (MAX_UPLOAD_MB + 1) * 1024 * 1024
+# Seconds browsers may reuse a served PDF before revalidating it (ETag, 304)
+UPLOAD_CACHE_MAX_AGE = int(os.getenv("UPLOAD_CACHE_MAX_AGE", "0"))
+upload_hashes = FileHashes()
+
+# LangChain integrations, the PDF stack and FAISS take seconds to import, so
+# they are imported on first use (or by the background warm-up) and the
+# server answers health checks right after start.
+HEAVY_MODULES = (
+    'langchain_groq',
+    'langchain_community.document_loaders.pdf',
+    'langchain_text_splitters',
+    'langchain.chains',
+    'langchain.chains.combine_documents',
+    'index_backends',
+    'embedding_cache',
+    'embedding_client',
+    'hybrid_retrieval'
 )
 
-embeddings = OllamaEmbeddings(
-    model="nomic-embed-text",
-    base_url="http://localhost:11434"
-)
+# Clients and settings created on first use by get_llm(), get_embeddings()
+# and get_index_config(). Assigning them directly (e.g. stubs) skips creation.
+llm = None
+embeddings = None
+index_config = None
+prompts = None
+_lazy_locks = {name: threading.Lock() for name in ('llm', 'embeddings', 'index_config', 'prompts')}
+
+def lazy(name, factory):
+    """Return the module global name, creating it once with factory() if it is unset"""
+    value = globals()[name]
+    if value is not None:
+        return value
+    with _lazy_locks[name]:
+        if globals()[name] is None:
+            start = time.perf_counter()
+            value = factory()
+            record_stage(f"startup.{name}", time.perf_counter() - start)
+            # Keep a client assigned while this one was being created
+            if globals()[name] is None:
+                globals()[name] = value
+    return globals()[name]
+
+def create_llm():
+    from langchain_groq import ChatGroq
+    return ChatGroq(
+        api_key=os.getenv("GROQ_API_KEY"),
+        model="llama3-70b-8192",
+        temperature=0,
+    )
+
+def create_embeddings():
+    from embedding_cache import CachedEmbeddings
+    from embedding_client import OllamaEmbeddingClient
+    # Chunk embeddings are cached on disk so boilerplate shared between documents
+    # (and unchanged parts of revised editions) is only embedded once.
+    return CachedEmbeddings(
+        OllamaEmbeddingClient.from_env(model="nomic-embed-text"),
+        cache_path=os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache/embeddings.sqlite3"),
+        max_entries=int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+    )
+
+def create_index_config():
+    from index_backends import IndexConfig
+    # Search index type (flat, ivf, ivfpq, hnsw) and memory-mapped loading, see index_backends
+    return IndexConfig.from_env()
+
+def get_llm():
+    return lazy('llm', create_llm)
+
+def get_embeddings():
+    return lazy('embeddings', create_embeddings)
+
+def get_index_config():
+    return lazy('index_config', create_index_config)
+
+# Embedders of the other Ollama endpoint, for indexes that were built with it
+space_embeddings = {}
+space_embeddings_lock = threading.Lock()
+
+def embeddings_for_space(space):
+    """
+    Embedder whose vectors live in an index's embedding space, None if there is none.
+
+    Vectors of the two Ollama endpoints are not comparable, so an index built
+    with the other endpoint is searched with a client of that endpoint.
+    """
+    embedder = get_embeddings()
+    if space is None or space == embedder.model:
+        return embedder
+    from embedding_cache import CachedEmbeddings
+    from embedding_client import OllamaEmbeddingClient, parse_embedding_space
+    client = getattr(embedder, 'embeddings', None)
+    model, api = parse_embedding_space(space)
+    if not isinstance(client, OllamaEmbeddingClient) or model != client.model:
+        return None
+    with space_embeddings_lock:
+        if space not in space_embeddings:
+            space_embeddings[space] = CachedEmbeddings(
+                client.with_api(api), cache_path=embedder.cache_path, max_entries=embedder.max_entries
+            )
+        return space_embeddings[space]
+
+def index_embedding_space(doc_id, folder):
+    """Embedding space a document's index was built in, None if it is the current one"""
+    space = (index_manifest.get(doc_id) or {}).get('embedding')
+    if space:
+        return space
+    from embedding_client import OllamaEmbeddingClient, embedding_space
+    from index_backends import vectors_normalized
+    client = getattr(get_embeddings(), 'embeddings', None)
+    if not isinstance(client, OllamaEmbeddingClient):
+        return None
+    # Indexed before the space was recorded: /api/embed returns unit vectors,
+    # /api/embeddings (used by every index before batching) does not
+    return embedding_space(client.model, 'embed' if vectors_normalized(folder) else 'embeddings')
 
 system_prompt = """
 Answer the questions based ONLY on the provided context below.
@@ -50,85 +185,231 @@ contextualize_q_system_prompt = (
     "Do NOT answer the question, just reformulate it if needed."
 )
 
-qa_prompt = ChatPromptTemplate.from_messages(
-    [
-        ("system", system_prompt),
-        MessagesPlaceholder("chat_history"),
-        ("human", "{input}"),
-    ]
-)
+def create_prompts():
+    # langchain_core.prompts pulls in most of LangChain, so templates are built on first use
+    from langchain_core.prompts import MessagesPlaceholder, ChatPromptTemplate
+
+    qa_prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", system_prompt),
+            MessagesPlaceholder("chat_history"),
+            ("human", "{input}"),
+        ]
+    )
+
+    contextualize_q_prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", contextualize_q_system_prompt),
+            MessagesPlaceholder("chat_history"),
+            ("human", "{input}"),
+        ]
+    )
+
+    summarize_history_prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system",
+             "You maintain a running summary of a conversation about a document. "
+             "Extend the current summary with the new conversation turns. "
+             "Keep facts, figures and names the user may refer back to. "
+             "Answer with the updated summary only, in at most 150 words."),
+            ("human", "Current summary:\n{summary}\n\nNew conversation turns:\n{turns}"),
+        ]
+    )
+
+    return {
+        'qa': qa_prompt,
+        'contextualize_q': contextualize_q_prompt,
+        'summarize_history': summarize_history_prompt
+    }
 
-contextualize_q_prompt = ChatPromptTemplate.from_messages(
-    [
-        ("system", contextualize_q_system_prompt),
-        MessagesPlaceholder("chat_history"),
-        ("human", "{input}"),
-    ]
-)
+def get_prompt(name):
+    """Chat prompt template by name ('qa', 'contextualize_q', 'summarize_history')"""
+    return lazy('prompts', create_prompts)[name]
+
+# What the LLM judges in each CFR section, in SECTION_WEIGHTS order
+EVALUATION_CRITERIA = {
+    'vision': 'Vision (Section 1A - 5%): Is it clear, forward-looking, inspiring? Does it focus on "what" not "how"?',
+    'mission': 'Mission (Section 1B - 5%): Is it aligned with vision, focused on "how", and clearly articulated?',
+    'objectives': 'Objectives (Section 1C - 5%): Are they aligned with mission, results-driven, appropriate in number (ideally 8-10), and non-duplicative?',
+    'inter_se_priorities': 'Inter se priorities (Section 2 - 40%): Do actions capture objectives, success indicators capture actions, are indicators outcome-oriented, is weight distribution appropriate, and are targets high quality?',
+    'trend_values': 'Trend values (Section 3 - 15%): Is data provided for previous years and projections?',
+    'success_indicators_description': 'Description of Success Indicators (Section 4 - 5%): Are all acronyms explained, are necessary explanations given, and is the quality of explanations good?',
+    'other_department_requirements': 'Performance requirements from other departments (Section 5 - 5%): Are dependencies appropriately claimed and requirements specific?',
+    'outcome_impact': 'Outcome/Impact of activities (Section 6 - 20%): What percentage of objectives are covered, are outcome statements results-driven, and are success indicators results-driven?'
+}
 
-evaluation_prompt = """
+def build_evaluation_prompt(sections=tuple(SECTION_WEIGHTS)):
+    """CFR evaluation prompt asking for a score of each of the given sections"""
+    criteria = "\n".join(
+        f"{number}. {EVALUATION_CRITERIA[section]}" for number, section in enumerate(sections, start=1)
+    )
+    structure = ",\n".join(
+        f'    "{section}": {{"score": X, "justification": "..."}}' for section in sections
+    )
+    return f"""
 Evaluate the quality of this Indian government manifesto based on the Commitment for Results (CFR) framework.
-Focus on these 8 key areas and provide a score for each (from 60-100):
+Focus on these {len(sections)} key areas and provide a score for each (from 60-100):
 
-1. Vision (Section 1A - 5%): Is it clear, forward-looking, inspiring? Does it focus on "what" not "how"?
-2. Mission (Section 1B - 5%): Is it aligned with vision, focused on "how", and clearly articulated?
-3. Objectives (Section 1C - 5%): Are they aligned with mission, results-driven, appropriate in number (ideally 8-10), and non-duplicative?
-4. Inter se priorities (Section 2 - 40%): Do actions capture objectives, success indicators capture actions, are indicators outcome-oriented, is weight distribution appropriate, and are targets high quality?
-5. Trend values (Section 3 - 15%): Is data provided for previous years and projections?
-6. Description of Success Indicators (Section 4 - 5%): Are all acronyms explained, are necessary explanations given, and is the quality of explanations good?
-7. Performance requirements from other departments (Section 5 - 5%): Are dependencies appropriately claimed and requirements specific?
-8. Outcome/Impact of activities (Section 6 - 20%): What percentage of objectives are covered, are outcome statements results-driven, and are success indicators results-driven?
+{criteria}
 
 For each area, provide:
 1. A score between 60-100
 2. A 1-2 sentence justification for the score
 
 Format your response as JSON with this structure:
-{
-  "sections": {
-    "vision": {"score": X, "justification": "..."},
-    "mission": {"score": X, "justification": "..."},
-    "objectives": {"score": X, "justification": "..."},
-    "inter_se_priorities": {"score": X, "justification": "..."},
-    "trend_values": {"score": X, "justification": "..."},
-    "success_indicators_description": {"score": X, "justification": "..."},
-    "other_department_requirements": {"score": X, "justification": "..."},
-    "outcome_impact": {"score": X, "justification": "..."}
-  }
-}
+{{
+  "sections": {{
+{structure}
+  }}
+}}
 """
 
-vectorstore = None
-retriever = None
-rag_chain = None
-chat_history = []
-index_path = "./faiss_index"
-current_document_info = {
-    "filename": None,
-    "document_type": None
-}
-uploaded_files = []
-
-# CFR Evaluation Constants
-SECTION_WEIGHTS = {
-    'vision': 0.05,  # 5%
-    'mission': 0.05,  # 5%
-    'objectives': 0.05,  # 5%
-    'inter_se_priorities': 0.40,  # 40%
-    'trend_values': 0.15,  # 15%
-    'success_indicators_description': 0.05,  # 5%
-    'other_department_requirements': 0.05,  # 5%
-    'outcome_impact': 0.20   # 20%
-}
+evaluation_prompt = build_evaluation_prompt()
+
+heading_question = """Analyze this Indian government manifesto and identify the most relevant ministry or department.
+        Format the heading as: "Ministry of <Department Name> Department".
+        Choose the department based on dominant themes and context in the content.
+        Be precise and specific in identifying the ministry."""
+
+summary_question = """Provide a concise summary (4-6 sentences) of this Indian government manifesto that captures:
+        1. Main themes and goals
+        2. Key policy initiatives
+        3. Significant commitments or plans
+        4. Overall vision for the department
+        Use formal, factual language suitable for government documentation.
+        Focus on clarity and ease of understanding."""
+
+suggestions_question = """Based on the manifesto content, provide 3-5 constructive suggestions focusing on:
+        1. Policy gaps or areas needing clarification
+        2. Potential improvements in governance approach
+        3. Areas where public welfare could be enhanced
+        4. Implementation considerations specific to Indian context
+        Ensure suggestions are:
+        - Actionable and practical
+        - Grounded in Indian governance context
+        - Focused on public welfare
+        - Based on policy analysis"""
 
-RATING_THRESHOLDS = {
-    'excellent': 100,
-    'very_good': 90,
-    'good': 80,
-    'fair': 70,
-    'poor': 60
+# The four analysis passes are independent of each other (each runs with an
+# empty chat history), so they can be sent to the LLM in parallel.
+ANALYSIS_PASSES = {
+    'heading': heading_question,
+    'summary': summary_question,
+    'suggestions': suggestions_question,
+    'evaluation': evaluation_prompt
 }
+# 'structured' retrieves one shared context and asks for the whole analysis
+# in a single JSON generation instead of four separate passes
+ANALYSIS_MODES = ('concurrent', 'sequential', 'structured')
+
+def build_structured_question(sections=tuple(SECTION_WEIGHTS)):
+    """Single-generation analysis question, scoring only the given CFR sections"""
+    count = ('no', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight')[len(sections)]
+    return f"""Analyze this Indian government manifesto and answer with a single JSON object containing the four parts below.
+
+1. "heading" (string): {heading_question}
+
+2. "summary" (string): {summary_question}
+
+3. "suggestions" (list of strings, one suggestion per item): {suggestions_question}
+
+4. "sections": {build_evaluation_prompt(sections)}
+
+Respond with JSON only, using this structure:
+{{
+  "heading": "...",
+  "summary": "...",
+  "suggestions": ["...", "..."],
+  "sections": {{ ...the {count} sections described above... }}
+}}
+"""
+
+structured_analysis_question = build_structured_question()
+
+def analysis_passes(sections=tuple(SECTION_WEIGHTS)):
+    """ANALYSIS_PASSES with an evaluation pass scoring only the given CFR sections"""
+    return {**ANALYSIS_PASSES, 'evaluation': build_evaluation_prompt(sections)}
+
+# 'hybrid' fuses BM25 keyword search with FAISS MMR search and answers
+# identifier-only queries (acronyms, codes, fiscal years) from BM25 alone;
+# 'vector' uses MMR search only
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+
+# Chunks of shared context sent to the single structured generation
+STRUCTURED_CONTEXT_MAX_CHUNKS = int(os.getenv("STRUCTURED_CONTEXT_MAX_CHUNKS", "12"))
+
+# Changes whenever any prompt that shapes the analysis is edited, so cached
+# analyses produced with older prompts are not served.
+ANALYSIS_PROMPT_VERSION = hashlib.sha256(
+    json.dumps([system_prompt, ANALYSIS_PASSES], sort_keys=True).encode('utf-8')
+).hexdigest()[:16]
+STRUCTURED_PROMPT_VERSION = hashlib.sha256(
+    json.dumps([system_prompt, structured_analysis_question]).encode('utf-8')
+).hexdigest()[:16]
+
+analysis_cache = AnalysisCache(
+    cache_path=os.getenv("ANALYSIS_CACHE_PATH", "./analysis_cache/analysis.sqlite3"),
+    ttl=int(os.getenv("ANALYSIS_CACHE_TTL", str(7 * 24 * 3600))),
+    max_entries=int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "1000"))
+)
+
+# Answers to past questions per document, served again for questions whose
+# embedding is at least ANSWER_CACHE_THRESHOLD cosine-similar
+answer_cache = SemanticAnswerCache(
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+    ttl=int(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600))),
+    max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "200"))
+)
 
+# Upper bound on analysis LLM calls in flight across all requests
+ANALYSIS_MAX_CONCURRENCY = int(os.getenv("ANALYSIS_MAX_CONCURRENCY", "4"))
+analysis_executor = ThreadPoolExecutor(
+    max_workers=ANALYSIS_MAX_CONCURRENCY,
+    thread_name_prefix="analysis"
+)
+
+index_path = "./faiss_index"
+# Maps the SHA-256 of every indexed PDF to its chunk IDs; each document's
+# vectors live in their own sub-directory of index_path named after the hash.
+# Each change is written as a small manifest segment, folded into
+# manifest.json in the background once INDEX_COMPACT_AFTER have piled up.
+INDEX_COMPACT_AFTER = int(os.getenv("INDEX_COMPACT_AFTER", "64"))
+remove_incomplete(index_path)
+index_manifest = SegmentedManifest(index_path, compact_after=INDEX_COMPACT_AFTER)
+manifest_lock = threading.Lock()
+
+# Processed documents listed by /files, persisted across restarts
+document_registry = DocumentRegistry(os.getenv("DOCUMENT_REGISTRY_PATH", "./document_registry/documents.sqlite3"))
+FILES_PAGE_SIZE = int(os.getenv("FILES_PAGE_SIZE", "100"))
+FILES_MAX_PAGE_SIZE = 1000
+
+# Clients that do not send a session ID share this session, which keeps the
+# single-user behaviour of the dashboard unchanged.
+DEFAULT_SESSION_ID = "default"
+MAX_RESIDENT_INDEXES = int(os.getenv("MAX_RESIDENT_INDEXES", "16"))
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "1000"))
+# Approximate tokens of chat history sent with a question; older turns are
+# folded into a rolling summary
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "2000"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# Chunks embedded per call; as large as the largest embedding request by default,
+# so the adaptive request size can grow up to EMBED_MAX_BATCH_SIZE
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", os.getenv("EMBED_MAX_BATCH_SIZE", "256")))
+# Batches buffered between the parse, embed and index stages of an ingest
+INGEST_QUEUE_SIZE = 2
+# Batches of one ingest being embedded at once; the embedding client caps the
+# requests sent to Ollama across all ingests (EMBED_CONCURRENCY)
+INGEST_EMBED_IN_FLIGHT = int(os.getenv("INGEST_EMBED_IN_FLIGHT", "4"))
+# /batch_analyze reads PDFs below BATCH_ROOT and writes one JSON result per
+# file below BATCH_RESULTS_FOLDER
+BATCH_ROOT = os.getenv("BATCH_ROOT", UPLOAD_FOLDER)
+BATCH_RESULTS_FOLDER = os.getenv("BATCH_RESULTS_FOLDER", "batch_results")
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+# Raw section scores of every analyzed document, for re-scoring without the LLM
+score_table = ScoreTable(SCORE_TABLE_PATH)
+
+# CFR Evaluation (SECTION_WEIGHTS and RATING_THRESHOLDS are shared with scoring.py)
 def validate_score(score):
     """Validate that score is between 60 and 100"""
     return max(60, min(100, score))
@@ -188,6 +469,84 @@ def validate_trend_values(data_points):
     percentage_populated = (populated_points / total_points) * 100
     return validate_score(percentage_populated)
 
+def validate_target_quality(targets):
+    """Validate that the five targets are numeric and ordered from Excellent to Poor"""
+    if len(targets) != 5:
+        return 60
+    if not all(isinstance(target, (int, float)) for target in targets):
+        # Dates and other text targets cannot be compared, count them as Good
+        return 80
+    pairs = list(zip(targets, targets[1:]))
+    if all(a > b for a, b in pairs) or all(a < b for a, b in pairs):
+        return 100  # Strictly graded, higher or lower is better
+    if all(a >= b for a, b in pairs) or all(a <= b for a, b in pairs):
+        return 80   # Graded with repeated targets
+    return 60
+
+def validate_weight_distribution(objectives, indicators):
+    """Validate that every objective's success indicator weights add up to its weight"""
+    weighted = [objective for objective in objectives if objective.get('weight')]
+    if not weighted:
+        return None
+    matching = sum(
+        1 for objective in weighted
+        if abs(sum(si['weight'] or 0 for si in indicators if si['objective_id'] == objective['id'])
+               - objective['weight']) <= 0.5
+    )
+    return validate_score(100 * matching / len(weighted))
+
+def score_extracted_sections(tables, min_rows=2):
+    """
+    Score the CFR sections that can be computed from the extracted tables.
+
+    Objectives (1C) are scored on their count, inter se priorities (2) on the
+    outcome orientation of the success indicators, the weight distribution and
+    the grading of the targets, and trend values (3) on how many cells are
+    populated. A section is only scored when its table yielded at least
+    min_rows rows; the others are left to the LLM.
+
+    Returns:
+        dict: {section: {'score', 'justification'}} for the scored sections
+    """
+    sections = {}
+    indicators = tables.get('indicators') or []
+    if len(indicators) >= min_rows:
+        objectives = tables.get('objectives') or []
+        sections['objectives'] = {
+            'score': validate_objectives_count(len(objectives)),
+            'justification': f"{len(objectives)} objectives found in the Section 2 table (8-10 expected)."
+        }
+
+        total_weight = sum(si['weight'] or 0 for si in indicators)
+        if total_weight > 0:
+            orientation = sum(
+                validate_outcome_orientation(si['measurement']) * (si['weight'] or 0) for si in indicators
+            ) / total_weight
+        else:
+            orientation = sum(validate_outcome_orientation(si['measurement']) for si in indicators) / len(indicators)
+        targets = sum(validate_target_quality(si['targets']) for si in indicators) / len(indicators)
+        distribution = validate_weight_distribution(objectives, indicators)
+        parts = [orientation, targets] + ([distribution] if distribution is not None else [])
+        outcomes = sum(1 for si in indicators if si['measurement'] in ('outcome', 'external_output'))
+        sections['inter_se_priorities'] = {
+            'score': round(validate_score(sum(parts) / len(parts))),
+            'justification': (
+                f"{outcomes} of {len(indicators)} success indicators measure outcomes or external outputs; "
+                f"target grading scores {round(targets)}"
+                + (f" and weight distribution {round(distribution)}." if distribution is not None else ".")
+            )
+        }
+
+    trend_rows = tables.get('trend_values') or []
+    if len(trend_rows) >= min_rows:
+        cells = [value for row in trend_rows for value in row['values']]
+        populated = sum(1 for value in cells if value is not None)
+        sections['trend_values'] = {
+            'score': round(validate_trend_values(cells)),
+            'justification': f"{populated} of {len(cells)} trend value cells populated for {len(trend_rows)} success indicators."
+        }
+    return sections
+
 def get_rating_label(score):
     """Get rating label based on score"""
     if score >= RATING_THRESHOLDS['excellent']:
@@ -263,64 +622,406 @@ def adjust_scores_by_suggestions(section_scores, suggestion_factor):
     
     return adjusted_scores
 
-@app.route('/upload', methods=['POST'])
-def upload_file():
-    global vectorstore, retriever, rag_chain, current_document_info, uploaded_files
+def qa_inputs(question, history=None):
+    """Input of a document's QA chain for one question"""
+    return {
+        "input": question,
+        "chat_history": history or []
+    }
 
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file provided'}), 400
+def analysis_pass_result(name, response, start, request_timings=None):
+    """(answer, seconds) of an analysis pass started at start, recorded as a stage"""
+    elapsed = time.perf_counter() - start
+    record_stage(f"analysis.{name}", elapsed, request_timings)
+    return response["answer"], round(elapsed, 3)
+
+def collect_pass_results(passes, results):
+    """Split the (answer, seconds) results of the passes into (answers, timings) dicts keyed by pass name"""
+    answers = {name: answer for name, (answer, _) in zip(passes, results)}
+    timings = {name: elapsed for name, (_, elapsed) in zip(passes, results)}
+    return answers, timings
+
+def run_analysis_pass(chain, name, question, request_timings=None):
+    """Run a single analysis question through the chain and time it"""
+    start = time.perf_counter()
+    response = chain.invoke(qa_inputs(question), config=chain_config(f"analysis.{name}", request_timings))
+    return analysis_pass_result(name, response, start, request_timings)
+
+def run_analysis_passes(chain, concurrent=True, passes=None):
+    """
+    Run every analysis pass against the chain.
 
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'No file selected'}), 400
+    Args:
+        chain: The retrieval chain of the current document
+        concurrent (bool): Submit the passes to the shared analysis pool instead
+            of running them one after another
+        passes (dict): Questions by pass name, ANALYSIS_PASSES by default
+
+    Returns:
+        tuple: (answers, timings) dicts keyed by pass name, timings in seconds
+    """
+    passes = passes or ANALYSIS_PASSES
+    # Passes on the pool cannot see the request's timings, hand them over
+    request_timings = current_timings()
+
+    if concurrent:
+        futures = [
+            analysis_executor.submit(run_analysis_pass, chain, name, question, request_timings)
+            for name, question in passes.items()
+        ]
+        results = [future.result() for future in futures]
+    else:
+        results = [run_analysis_pass(chain, name, question, request_timings) for name, question in passes.items()]
 
-    file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-    file.save(file_path)
+    return collect_pass_results(passes, results)
 
+def build_evaluation_details(evaluation_answer, suggestion_factor, extracted=None):
+    """
+    Turn the raw CFR evaluation answer into scored and rated sections.
+
+    Sections in extracted (from score_extracted_sections) replace whatever the
+    LLM answered for them.
+    """
+    extracted = extracted or {}
     try:
-        loader = PyPDFLoader(file_path=file_path)
-        data = loader.load()
+        answer_text = evaluation_answer.strip()
+        try:
+            evaluation_data = json.loads(answer_text)
+        except JSONDecodeError:
+            json_match = re.search(r'({[\s\S]*})', answer_text)
+            if json_match:
+                evaluation_data = json.loads(json_match.group(1))
+            else:
+                evaluation_data = {"sections": {
+                    section: {"score": 70, "justification": "Default evaluation"}
+                    for section in SECTION_WEIGHTS.keys()
+                }}
+        
+        # Process section scores (before adjustment)
+        base_sections = {}
+        for section, data in evaluation_data.get("sections", {}).items():
+            score = validate_score(data.get("score", 70))
+            base_sections[section] = {
+                "score": score,
+                "justification": data.get("justification", "No justification provided")
+            }
+        base_sections.update(extracted)
+        
+        # Apply suggestion factor to adjust scores
+        adjusted_sections = adjust_scores_by_suggestions(base_sections, suggestion_factor)
+        
+        # Calculate overall score based on adjusted sections
+        overall_score = calculate_overall_score(adjusted_sections)
+        
+        # Prepare evaluation details with both original and adjusted scores
+        return {
+            "overall_score": overall_score,
+            "overall_rating": get_rating_label(overall_score),
+            "suggestion_impact_factor": round(suggestion_factor, 2),
+            "section_scores": adjusted_sections,
+            "original_scores": {
+                section: data["score"] for section, data in base_sections.items()
+            },
+            "extracted_sections": sorted(extracted)
+        }
+        
+    except Exception as e:
+        print(f"Error processing evaluation: {str(e)}")
+        return {
+            "overall_score": 70,
+            "overall_rating": "Fair",
+            "suggestion_impact_factor": 1.0,
+            "section_scores": {
+                section: {
+                    "score": 70,
+                    "rating": "Fair",
+                    "justification": "Automatic evaluation"
+                }
+                for section in SECTION_WEIGHTS.keys()
+            },
+            "extracted_sections": []
+        }
 
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=250,
-            separators=["\n\n", "\n", " ", ""],
-            length_function=len
-        )
-        splits = text_splitter.split_documents(data)
-        batch_size = 100
-        all_splits = []
+def retrieve_shared_context(retriever, passes=None, max_chunks=STRUCTURED_CONTEXT_MAX_CHUNKS):
+    """
+    Retrieve context for all analysis questions once, without duplicates.
 
-        if os.path.exists(index_path) and os.path.isdir(index_path) and len(os.listdir(index_path)) > 0:
-            try:
-                # Loading local FAISS index
-                vectorstore = FAISS.load_local(
-                    index_path,
-                    embeddings
-                )
-            except Exception as e:
-                print(f"Error loading FAISS index: {str(e)}")
-                # If loading fails, create a new vectorstore
-                vectorstore = FAISS.from_documents(documents=splits[:min(batch_size, len(splits))], embedding=embeddings)
-                all_splits.extend(splits[:min(batch_size, len(splits))])
-        else:
-            os.makedirs(index_path, exist_ok=True)
-            first_batch = splits[:min(batch_size, len(splits))]
-            vectorstore = FAISS.from_documents(documents=first_batch, embedding=embeddings)
-            all_splits.extend(first_batch)
-            for i in range(batch_size, len(splits), batch_size):
-                batch = splits[i:i + batch_size]
-                vectorstore.add_documents(documents=batch)
-                all_splits.extend(batch)
+    Each pass question is still used as a retrieval query so the context covers
+    every part of the analysis, but chunks returned for several questions are
+    only kept once. Chunks are interleaved across questions before truncating.
+    """
+    results = [
+        retriever.invoke(question, config=chain_config("analysis.structured"))
+        for question in (passes or ANALYSIS_PASSES).values()
+    ]
+    return merge_contexts(results, max_chunks)
+
+def merge_contexts(results, max_chunks=STRUCTURED_CONTEXT_MAX_CHUNKS):
+    """Interleave the retrieval results of several questions, dropping repeated chunks"""
+    context = []
+    seen = set()
+    for rank in range(max((len(docs) for docs in results), default=0)):
+        for docs in results:
+            if rank >= len(docs):
+                continue
+            doc = docs[rank]
+            key = doc.id or doc.page_content
+            if key not in seen:
+                seen.add(key)
+                context.append(doc)
+    return context[:max_chunks]
+
+def validate_structured_analysis(data, sections=tuple(SECTION_WEIGHTS)):
+    """
+    Check a structured analysis against the shape the scoring functions expect.
+
+    Returns:
+        dict: heading, summary, suggestions (list) and the given sections
+
+    Raises:
+        ValueError: If a part is missing or a section has no numeric score
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Structured analysis is not a JSON object')
+
+    heading = data.get('heading')
+    if not isinstance(heading, str) or not heading.strip():
+        raise ValueError('Missing heading')
+
+    summary = data.get('summary')
+    if isinstance(summary, list):
+        summary = ' '.join(str(s) for s in summary)
+    if not isinstance(summary, str) or not summary.strip():
+        raise ValueError('Missing summary')
+
+    suggestions = data.get('suggestions')
+    if isinstance(suggestions, str):
+        suggestions = suggestions.split('\n')
+    if not isinstance(suggestions, list) or not all(isinstance(s, str) for s in suggestions):
+        raise ValueError('Suggestions must be a list of strings')
+
+    answered = data.get('sections')
+    if not isinstance(answered, dict):
+        raise ValueError('Missing sections')
+    for section in sections:
+        entry = answered.get(section)
+        if not isinstance(entry, dict) or not isinstance(entry.get('score'), (int, float)):
+            raise ValueError(f"Missing or invalid score for section '{section}'")
+
+    return {
+        'heading': heading,
+        'summary': summary,
+        'suggestions': suggestions,
+        'sections': {section: answered[section] for section in sections}
+    }
+
+def structured_analysis_chain():
+    """Chain answering the structured analysis question over an already retrieved context"""
+    from langchain.chains.combine_documents import create_stuff_documents_chain
+
+    return create_stuff_documents_chain(get_llm(), get_prompt('qa'))
 
+def structured_analysis_inputs(context, sections=tuple(SECTION_WEIGHTS)):
+    """Input of structured_analysis_chain() asking for the given sections"""
+    return {
+        "input": build_structured_question(sections),
+        "context": context,
+        "chat_history": []
+    }
+
+def structured_analysis_result(answer_text, context, start, retrieved, sections=tuple(SECTION_WEIGHTS)):
+    """(answers, timings, context_chunks) of a structured generation that finished now; start and retrieved are perf_counter() times"""
+    generated = time.perf_counter()
+    timings = {
+        'retrieval': round(retrieved - start, 3),
+        'generation': round(generated - retrieved, 3)
+    }
+    return parse_structured_answer(answer_text.strip(), sections), timings, len(context)
+
+def run_structured_analysis(document, sections=tuple(SECTION_WEIGHTS)):
+    """
+    Produce every part of the analysis with one retrieval and one LLM call.
+
+    Only the given CFR sections are scored by the LLM.
+
+    Returns:
+        tuple: (answers, timings, context_chunks), answers shaped like the
+            output of run_analysis_passes so the same post-processing applies
+    """
+    start = time.perf_counter()
+    context = retrieve_shared_context(document.retriever, analysis_passes(sections))
+    retrieved = time.perf_counter()
+
+    answer_text = structured_analysis_chain().invoke(
+        structured_analysis_inputs(context, sections), config=chain_config("analysis.structured")
+    )
+    return structured_analysis_result(answer_text, context, start, retrieved, sections)
+
+def parse_structured_answer(answer_text, sections=tuple(SECTION_WEIGHTS)):
+    """
+    Validated answers of a structured generation, shaped like the output of run_analysis_passes.
+
+    Raises:
+        ValueError: If the answer holds no JSON or fails validate_structured_analysis
+    """
+    try:
+        data = json.loads(answer_text)
+    except JSONDecodeError:
+        json_match = re.search(r'({[\s\S]*})', answer_text)
+        if not json_match:
+            raise ValueError('Structured analysis did not return JSON')
+        data = json.loads(json_match.group(1))
+    analysis = validate_structured_analysis(data, sections)
+
+    return {
+        'heading': analysis['heading'],
+        'summary': analysis['summary'],
+        'suggestions': '\n'.join(analysis['suggestions']),
+        'evaluation': json.dumps({'sections': analysis['sections']})
+    }
+
+def analysis_cache_key(doc_id, mode='concurrent', extracted=None):
+    """Cache key of a document's analysis under the current prompts, model settings and extracted scores"""
+    model = get_llm()
+    model_name = getattr(model, 'model_name', type(model).__name__)
+    parts = [doc_id, ANALYSIS_PROMPT_VERSION, model_name, getattr(model, 'temperature', None)]
+    if mode == 'structured':
+        # Concurrent and sequential results are identical and share entries
+        parts.append(['structured', STRUCTURED_PROMPT_VERSION])
+    if extracted:
+        parts.append(['cfr_tables', EXTRACTOR_VERSION, extracted])
+    return AnalysisCache.make_key(*parts)
+
+def extracted_section_scores(doc_id):
+    """Section scores computed from the CFR tables saved at ingest, empty when there are none"""
+    tables = load_tables(document_index_path(doc_id))
+    return score_extracted_sections(tables) if tables else {}
+
+def get_document_analysis(doc_id, mode='concurrent', bypass_cache=False):
+    """
+    Analyze a processed document, serving the result from the analysis cache when possible.
+
+    Args:
+        doc_id (str): Content hash of the document
+        mode (str): One of ANALYSIS_MODES
+        bypass_cache (bool): Ignore any cached result (the fresh one is still stored)
+
+    Returns:
+        dict: The analysis response, including 'cached' and 'timings'
+    """
+    start = time.perf_counter()
+    cache_key, extracted = analysis_plan(doc_id, mode)
+    cached = None if bypass_cache else cached_analysis(doc_id, cache_key, start)
+    if cached is not None:
+        return cached
+
+    document = documents.get(doc_id)
+    sections = sections_to_ask(extracted)
+    passes = analysis_passes(sections)
+    context_chunks = None
+    structured_error = None
+    if mode == 'structured':
         try:
-            # Saving FAISS index
-            vectorstore.save_local(index_path)
-        except Exception as e:
-            print(f"Error saving FAISS index: {str(e)}")
-            return jsonify({'error': 'Failed to save document index'}), 500
+            answers, timings, context_chunks = run_structured_analysis(document, sections)
+        except ValueError as e:
+            structured_error = structured_analysis_failed(e)
+            answers, timings = run_analysis_passes(document.qa_chain, concurrent=True, passes=passes)
+    else:
+        answers, timings = run_analysis_passes(document.qa_chain, concurrent=(mode == 'concurrent'), passes=passes)
+    timings['total'] = round(time.perf_counter() - start, 3)
+
+    return finish_analysis(doc_id, mode, cache_key, extracted, answers, timings, context_chunks, structured_error)
+
+def sections_to_ask(extracted):
+    """CFR sections the LLM has to score: those not scored from the extracted tables"""
+    return tuple(section for section in SECTION_WEIGHTS if section not in extracted)
+
+def structured_analysis_failed(error):
+    """Log invalid structured output, which falls back to the multi-pass analysis; returns the reason"""
+    print(f"Structured analysis failed, running passes instead: {str(error)}")
+    return str(error)
+
+def analysis_plan(doc_id, mode):
+    """(cache key, section scores from the extracted CFR tables) of a document's analysis"""
+    extracted = extracted_section_scores(doc_id)
+    return analysis_cache_key(doc_id, mode, extracted), extracted
+
+def cached_analysis(doc_id, cache_key, start):
+    """The cached analysis response under cache_key, or None"""
+    cached = analysis_cache.get(cache_key)
+    if cached is None:
+        return None
+    result, cached_at = cached
+    result['cached'] = True
+    result['cached_at'] = datetime.fromtimestamp(cached_at).isoformat()
+    result['timings'] = {'total': round(time.perf_counter() - start, 3)}
+    if doc_id not in score_table:
+        record_scores(doc_id, result)
+        document_registry.record_analysis(doc_id)
+    return result
+
+def finish_analysis(doc_id, mode, cache_key, extracted, answers, timings, context_chunks=None, structured_error=None):
+    """Build the analysis response from the raw answers, cache it and record its scores"""
+    result = build_analysis_result(answers, extracted)
+    result['analysis_mode'] = mode
+    if mode == 'structured':
+        result['context_chunks'] = context_chunks
+        result['structured_fallback'] = structured_error
+    if structured_error is None:
+        analysis_cache.put(cache_key, result)
+    record_scores(doc_id, result)
+    document_registry.record_analysis(doc_id)
+
+    result['cached'] = False
+    result['timings'] = timings
+    return result
+
+def record_scores(doc_id, result):
+    """Keep the raw scores of an analysis in the score table"""
+    try:
+        filename = index_manifest.get(doc_id, {}).get('filename')
+        score_table.record(doc_id, filename, result)
+    except Exception as e:
+        print(f"Error recording scores: {str(e)}")
+
+def build_analysis_result(answers, extracted=None):
+    """Combine the raw answers of the analysis passes and the extracted section scores into the analysis response"""
+    heading = answers['heading'].strip()
+    summary = answers['summary'].strip().split('\   n')
+    suggestions = answers['suggestions'].strip().split('\n')
+
+    # The suggestions drive the adjustment factor applied to the CFR scores
+    suggestion_factor = analyze_enhancement_suggestions(suggestions)
+    evaluation_details = build_evaluation_details(answers['evaluation'], suggestion_factor, extracted)
+
+    return {
+        'heading': heading,
+        'summary': summary,
+        'enhancement_suggestions': suggestions,
+        'evaluation': evaluation_details
+    }
+
+def document_index_path(doc_hash):
+    """Directory holding the FAISS index of a single document"""
+    return os.path.join(index_path, doc_hash)
+
+def build_rag_chain(store, lexical=None):
+    """
+    Build the retriever and the QA chain over a vector store.
+
+    With a BM25 index of the same chunks the retriever fuses keyword and MMR
+    vector results. Follow-up questions are rewritten into standalone ones with
+    standalone_question() before they reach the chain, so retrieval and the
+    answer cache see the same question.
+    """
+    from langchain.chains import create_retrieval_chain
+    from langchain.chains.combine_documents import create_stuff_documents_chain
+    from hybrid_retrieval import HybridRetriever
 
-        retriever = vectorstore.as_retriever(
+    if lexical is not None:
+        store_retriever = HybridRetriever(store=store, lexical=lexical, k=6, fetch_k=10)
+    else:
+        store_retriever = store.as_retriever(
             search_kwargs={
                 "k": 6,
                 "fetch_k": 10,
@@ -329,126 +1030,973 @@ def upload_file():
             search_type="mmr"
         )
 
-        history_aware_retriever = create_history_aware_retriever(llm, retriever, contextualize_q_prompt)
-        question_answer_chain = create_stuff_documents_chain(llm, qa_prompt)
-        rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
-        chat_history.clear()
-
-        file_stat = os.stat(file_path)
-        file_info = {
-            '_id': str(hash(file.filename + str(file_stat.st_mtime))),
-            'filename': file.filename,
-            'filePath': f'/uploads/{file.filename}',
-            'uploadDate': datetime.fromtimestamp(file_stat.st_mtime).isoformat(),
-            'size': file_stat.st_size
-        }
+    question_answer_chain = create_stuff_documents_chain(get_llm(), get_prompt('qa'))
+    return store_retriever, create_retrieval_chain(store_retriever, question_answer_chain)
 
-        if not any(f['filename'] == file.filename for f in uploaded_files):
-            uploaded_files.append(file_info)
+def summarize_history(summary, messages):
+    """Fold chat messages into the rolling conversation summary"""
+    from langchain_core.output_parsers import StrOutputParser
 
-        current_document_info = {
-            "filename": file.filename,
-            "document_type": None
-        }
+    turns = "\n".join(
+        f"{'User' if isinstance(message, HumanMessage) else 'Assistant'}: {message.content}"
+        for message in messages
+    )
+    chain = get_prompt('summarize_history') | get_llm() | StrOutputParser()
+    return chain.invoke({"summary": summary or "(none)", "turns": turns}, config=chain_config("history_summary"))
 
-        return jsonify({
-            'message': 'File processed successfully',
-            'filename': file.filename,
-            'chunks': len(all_splits)
-        })
+def question_rewriter():
+    """Chain rewriting a follow-up into a standalone question, as the history-aware retriever does"""
+    from langchain_core.output_parsers import StrOutputParser
+
+    return get_prompt('contextualize_q') | get_llm() | StrOutputParser()
+
+def standalone_question(question, history, config=None):
+    """The question rewritten to be understood without the chat history"""
+    if not history:
+        return question
+    return question_rewriter().invoke({"input": question, "chat_history": history}, config=config)
+
+def needs_query_embedding(document, question):
+    """
+    Whether answering question embeds it: not when the document's retriever
+    answers it from the keyword index alone.
+    """
+    answers_lexically = getattr(document.retriever, 'answers_lexically', None)
+    return answers_lexically is None or not answers_lexically(question)
+
+def cached_answer(document, question, vector, bypass_cache=False):
+    """Cached answer to a standalone question about document, or None"""
+    if bypass_cache:
+        return None
+    return answer_cache.lookup(document.doc_id, document.version, vector, question)
+
+def lookup_answer(document, question, operation, timings=None, bypass_cache=False):
+    """
+    Cached answer to a standalone question about document (or None) and the question's embedding.
+
+    The question is embedded with the document's own embedder, whose query
+    memo hands the same vector to the retrieval that follows. Questions
+    retrieved from the keyword index alone are not embedded at all (the
+    embedding is None) and only match cached answers by their text.
+    """
+    with span(f"{operation}.cache_lookup", timings):
+        vector = None
+        if needs_query_embedding(document, question):
+            vector = document.store.embedding_function.embed_query(question)
+        return cached_answer(document, question, vector, bypass_cache), vector
+
+def record_answer(session, document, history, question, standalone, vector, answer, cached=None):
+    """
+    Add a turn to the session's history and cache its answer, unless it came
+    from the cache or was generated with chat history (which other sessions
+    asking the same standalone question do not share).
+    """
+    if cached is None and not history:
+        answer_cache.store(document.doc_id, document.version, standalone, vector, answer)
+    session.memory.add_turn(question, answer)
+
+def answer_response(question, answer, cached=None):
+    """Body of a /query response"""
+    response = {
+        'question': question,
+        'answer': answer,
+        'cached': cached is not None
+    }
+    if cached is not None:
+        response['cached_question'] = cached['question']
+        response['similarity'] = cached['similarity']
+    return response
+
+def query_request(data):
+    """(question, bypass_cache) of a /query request body, raises ValueError without a question"""
+    if not data or 'question' not in data:
+        raise ValueError('No question provided')
+    return data['question'], bool(data.get('bypass_cache', False))
+
+# Summaries are produced off the request path
+history_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history")
+
+def new_conversation_memory():
+    return ConversationMemory(
+        token_budget=CHAT_HISTORY_TOKEN_BUDGET,
+        summarize=summarize_history,
+        executor=history_executor
+    )
+
+def load_document(doc_id):
+    """Load a document's saved index from disk and build its chain"""
+    from index_backends import load_store
+    from hybrid_retrieval import load_or_build_lexical_index
+
+    folder = document_index_path(doc_id)
+    space = index_embedding_space(doc_id, folder)
+    embedder = embeddings_for_space(space)
+    if embedder is None:
+        raise ValueError(f"Document {doc_id} was indexed with '{space}' embeddings, which cannot be "
+                         "produced by the configured embedder. Upload it again to re-embed it.")
+    store = load_store(folder, embedder, get_index_config())
+    # Indexes saved before keyword search existed get their BM25 index here
+    lexical = load_or_build_lexical_index(folder, store) if RETRIEVAL_MODE == 'hybrid' else None
+    version = index_manifest.get(doc_id, {}).get('indexedAt')
+    return LoadedDocument(doc_id, store, *build_rag_chain(store, lexical), version=version)
+
+documents = DocumentCache(load_document, max_resident=MAX_RESIDENT_INDEXES)
+sessions = SessionRegistry(new_conversation_memory, max_sessions=MAX_SESSIONS)
+ingest_jobs = JobManager(max_workers=INGEST_WORKERS)
+batch_jobs = JobManager(max_workers=2, name="batch")
+
+# Warm-up imports the heavy modules, creates the clients and loads the most
+# recently indexed documents in the background once the server has started
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "1") == "1"
+WARMUP_PRELOAD_INDEXES = int(os.getenv("WARMUP_PRELOAD_INDEXES", str(MAX_RESIDENT_INDEXES)))
+warmup_jobs = JobManager(max_workers=1, max_jobs=10, name="warmup")
+warmup_job = None
+
+def get_session():
+    """Resolve the session of the current request (header, JSON body or form field)"""
+    data = request.get_json(silent=True) or {}
+    session_id = (
+        request.headers.get('X-Session-ID')
+        or data.get('session_id')
+        or request.form.get('session_id')
+        or DEFAULT_SESSION_ID
+    )
+    return sessions.get(str(session_id))
+
+def ingest_document(job, file_path):
+    """
+    Stream one PDF through parsing, splitting, embedding and indexing.
+
+    Pages are parsed and split on one thread, up to INGEST_EMBED_IN_FLIGHT
+    chunk batches are embedded concurrently and inserted into FAISS here in
+    order, with bounded queues in between, so the stages overlap and only a
+    few batches are in memory at once.
+    Progress is reported on the job.
+    """
+    from langchain_community.document_loaders.pdf import PyPDFLoader
+    from langchain_community.vectorstores import FAISS
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    from index_backends import build_serving_index
+    from hybrid_retrieval import BM25Index
+
+    doc_hash = job.doc_id
+    record_stage('ingest.queue_wait', time.time() - job.created_at, job.timings)
+    embeddings = get_embeddings()
+    index_config = get_index_config()
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=1000,
+        chunk_overlap=250,
+        separators=["\n\n", "\n", " ", ""],
+        length_function=len
+    )
+
+    def on_page(pages):
+        job.update(pages_parsed=pages)
+        metrics.inc('pages_total')
+
+    def on_page_text(page):
+        with span('ingest.cfr_tables', job.timings):
+            cfr_tables.add_page(page.page_content, page.metadata.get('page'))
+
+    def split_batches():
+        loader = PyPDFLoader(file_path=file_path)
+        produced = 0
+        for batch in iter_split_batches(loader, text_splitter, INGEST_BATCH_SIZE,
+                                        on_page=on_page,
+                                        page_sink=on_page_text,
+                                        timed=lambda stage: span(f"ingest.{stage}", job.timings)):
+            for i, split in enumerate(batch):
+                split.metadata['doc_id'] = doc_hash
+                split.id = f"{doc_hash}-{produced + i}"
+            produced += len(batch)
+            metrics.inc('chunks_total', len(batch))
+            job.update(chunks_total=produced)
+            yield batch
+
+    def embed_batch(batch):
+        job.update(stage='embedding')
+        with span('ingest.embed', job.timings):
+            vectors = embeddings.embed_documents([split.page_content for split in batch])
+        return batch, vectors
+
+    job.update(stage='parsing')
+    # Sections 2 and 3 are picked out of the pages as they are parsed
+    cfr_tables = CfrTableExtractor()
+    vectorstore = None
+    chunk_ids = []
+    chunk_texts = []
+    batches = prefetch(split_batches(), maxsize=INGEST_QUEUE_SIZE, name="ingest-parse")
+    for batch, vectors in ordered_map(embed_batch, batches, max_in_flight=INGEST_EMBED_IN_FLIGHT, name="ingest-embed"):
+        text_embeddings = [(split.page_content, vector) for split, vector in zip(batch, vectors)]
+        metadatas = [split.metadata for split in batch]
+        ids = [split.id for split in batch]
+        with span('ingest.index_add', job.timings):
+            if vectorstore is None:
+                vectorstore = FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, ids=ids)
+            else:
+                vectorstore.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        chunk_ids.extend(ids)
+        chunk_texts.extend(split.page_content for split in batch)
+        job.update(chunks_embedded=len(chunk_ids))
+
+    if vectorstore is None:
+        raise ValueError('No text could be extracted from the PDF')
+
+    job.update(stage='saving')
+    # Every file of the document is written to a staging directory that is
+    # renamed into place once complete, so a crash never leaves a torn index
+    os.makedirs(index_path, exist_ok=True)
+    staging_path = staging_directory(index_path, doc_hash)
+    try:
+        try:
+            # Saving FAISS index of this document
+            with span('ingest.save', job.timings):
+                vectorstore.save_local(staging_path)
+        except Exception as e:
+            print(f"Error saving FAISS index: {str(e)}")
+            raise RuntimeError('Failed to save document index')
+
+        # Built whatever RETRIEVAL_MODE is, so switching modes needs no re-ingest
+        with span('ingest.lexical', job.timings):
+            lexical = BM25Index.build(chunk_ids, chunk_texts)
+            lexical.save(staging_path)
+
+        with span('ingest.cfr_tables', job.timings):
+            tables = cfr_tables.result()
+            save_tables(staging_path, tables)
+
+        if index_config.index_type != 'flat':
+            job.update(stage='indexing')
+            with span('ingest.ann_build', job.timings):
+                vectors = vectorstore.index.reconstruct_n(0, vectorstore.index.ntotal)
+                serving_index, _ = build_serving_index(staging_path, index_config, vectors)
+            vectorstore.index = serving_index
+
+        indexed_at = datetime.now().isoformat()
+        with manifest_lock:
+            with span('ingest.publish', job.timings):
+                # A copy loaded from an older index must not outlive its files
+                documents.evict(doc_hash)
+                publish_directory(staging_path, document_index_path(doc_hash))
+                index_manifest.put(doc_hash, {
+                    'filename': job.filename,
+                    'chunk_ids': chunk_ids,
+                    'chunks': len(chunk_ids),
+                    'indexedAt': indexed_at,
+                    'embedding': embeddings.model
+                })
+    finally:
+        shutil.rmtree(staging_path, ignore_errors=True)
+    answer_cache.invalidate(doc_hash)
+    documents.put(doc_hash, LoadedDocument(
+        doc_hash, vectorstore, *build_rag_chain(vectorstore, lexical if RETRIEVAL_MODE == 'hybrid' else None),
+        version=indexed_at
+    ))
+
+    register_uploaded_file(doc_hash, job.filename, file_path, len(chunk_ids))
+    return {
+        'chunks': len(chunk_ids),
+        'deduplicated': False,
+        'cfr_tables': {'indicators': len(tables['indicators']), 'trend_values': len(tables['trend_values'])}
+    }
+
+def accept_upload(upload, client_filename, session):
+    """
+    Move a received upload into place and start its ingest, or reuse its index.
+
+    Args:
+        upload (HashingUploadFile): The upload, hashed while it streamed in
+        client_filename (str): File name sent by the client
+        session: Session that switches to the document
+
+    Returns:
+        tuple: (response body, HTTP status)
+    """
+    # The upload was hashed while it streamed to a temporary file; moving it
+    # into place is all that is left. Ingest reads the content-addressed
+    # copy, which a later upload under the same name cannot replace.
+    doc_hash = upload.hexdigest()
+    filename = clean_filename(client_filename, f"{doc_hash}.pdf")
+    content_path = stored_upload_path(doc_hash)
+    upload.commit(content_path)
+    file_path = os.path.join(UPLOAD_FOLDER, filename)
+    link_file(content_path, file_path)
+    upload_hashes.remember(file_path, doc_hash)
+    document_registry.add_file(doc_hash, filename)
+
+    job = IngestJob(filename, doc_hash, session.session_id)
+    entry = index_manifest.get(doc_hash)
+    if (entry is not None and os.path.isdir(document_index_path(doc_hash))
+            and embeddings_for_space(entry.get('embedding')) is not None):
+        # Byte-identical upload: reuse the stored index, no parsing or embedding
+        documents.get(doc_hash)
+        register_uploaded_file(doc_hash, filename, content_path, entry['chunks'])
+        job.update(chunks_total=entry['chunks'], chunks_embedded=entry['chunks'])
+        ingest_jobs.add_finished(job, {'chunks': entry['chunks'], 'deduplicated': True})
+        message = 'File already processed'
+        status = 200
+    else:
+        job = ingest_jobs.submit(job, lambda queued: ingest_document(queued, content_path))
+        message = 'File queued for processing'
+        status = 202
+
+    # The session switches to the new document right away; queries answer
+    # 409 until its index is ready, 422 if its ingest failed.
+    session.bind_document(doc_hash, filename, job.job_id)
+
+    return {
+        'message': message,
+        'filename': filename,
+        'doc_id': doc_hash,
+        'session_id': session.session_id,
+        'job_id': job.job_id,
+        'status_url': f'/jobs/{job.job_id}',
+        'job': job.to_dict()
+    }, status
+
+def stored_upload_path(doc_hash):
+    """Content-addressed copy of an uploaded PDF"""
+    return os.path.join(UPLOAD_CONTENT_FOLDER, f"{doc_hash}.pdf")
+
+def register_uploaded_file(doc_hash, filename, file_path, chunks):
+    """Add a processed document to the document registry"""
+    document_registry.register(doc_hash, filename, os.path.getsize(file_path), chunks)
+
+def backfill_document_registry():
+    """Register documents indexed before the registry existed, from the manifest"""
+    entries = []
+    for doc_id, entry in index_manifest.items():
+        filename = entry.get('filename') or f"{doc_id}.pdf"
+        file_path = os.path.join(UPLOAD_FOLDER, filename)
+        size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+        try:
+            uploaded_at = datetime.fromisoformat(entry['indexedAt']).timestamp()
+        except (KeyError, TypeError, ValueError):
+            uploaded_at = time.time()
+        entries.append((doc_id, filename, size, entry.get('chunks', 0), uploaded_at))
+    try:
+        added = document_registry.backfill(entries)
+    except Exception as e:
+        print(f"Error backfilling document registry: {str(e)}")
+        return 0
+    if added:
+        print(f"Registered {added} previously indexed documents")
+    return added
+
+def files_page_url(path, args, cursor):
+    """URL of the next /files page, keeping the sort, order, limit and status of this one"""
+    params = {key: value for key, value in args.items() if key != 'cursor'}
+    params['cursor'] = cursor
+    return f"{path}?{urlencode(params)}"
+
+def list_files(args):
+    """
+    One page of /files from its query parameters.
+
+    Returns:
+        tuple: (documents, next_cursor); raises ValueError on invalid parameters
+    """
+    try:
+        limit = int(args.get('limit', FILES_PAGE_SIZE))
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if not 1 <= limit <= FILES_MAX_PAGE_SIZE:
+        raise ValueError(f'limit must be between 1 and {FILES_MAX_PAGE_SIZE}')
+    return document_registry.list(
+        sort=args.get('sort', 'uploadDate'),
+        order=args.get('order', 'desc'),
+        limit=limit,
+        cursor=args.get('cursor') or None,
+        analysis_status=args.get('status') or None
+    )
+
+def document_unavailable(session):
+    """(error message, status) when the session has no processed document to work on, else None"""
+    doc_id, job_id = session.doc_id, session.ingest_job_id
+    if not doc_id:
+        return 'Please upload a document first.', 400
+    if documents.is_resident(doc_id) or os.path.isdir(document_index_path(doc_id)):
+        return None
+    if ingest_jobs.active(doc_id) is not None:
+        return 'Document is still being processed. Check the upload job status.', 409
+    # The job may have published the index since it was last checked
+    if os.path.isdir(document_index_path(doc_id)):
+        return None
+
+    # The ingest ended without an index: detach the document so the client
+    # sees the failure once and can upload again
+    session.unbind_document(doc_id)
+    job = ingest_jobs.get(job_id) if job_id else None
+    reason = job.error if job is not None and job.error else 'its index is missing'
+    return f'Processing the document failed: {reason}. Please upload it again.', 422
+
+def require_document(session):
+    """Error response when the session has no processed document to work on, else None"""
+    unavailable = document_unavailable(session)
+    if unavailable:
+        message, status = unavailable
+        return jsonify({'error': message}), status
+    return None
+
+def resolve_within(root, relative_path):
+    """Resolve a client supplied path below root, None if it points outside of it"""
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, relative_path))
+    if path != root and not path.startswith(root + os.sep):
+        return None
+    return path
+
+def batch_result_path(output_dir, filename):
+    """Where the analysis of one batch file is written, named like test.py's output"""
+    return os.path.join(output_dir, f"{os.path.splitext(filename)[0]}_analysis.json")
+
+def ensure_document_indexed(file_path):
+    """Ingest a PDF on the ingest pool unless its content is already indexed, returns its doc_id"""
+    filename = os.path.basename(file_path)
+    # Hash a link to the file rather than the path, so the content that is
+    # hashed is the content that gets indexed even if the file is replaced
+    link_path = os.path.join(UPLOAD_CONTENT_FOLDER, f"{PARTIAL_PREFIX}batch-{uuid.uuid4().hex}{PARTIAL_SUFFIX}")
+    link_file(file_path, link_path)
+    try:
+        doc_hash = hash_file(link_path)
+        content_path = stored_upload_path(doc_hash)
+        os.replace(link_path, content_path)
+    finally:
+        if os.path.exists(link_path):
+            os.unlink(link_path)
+
+    entry = index_manifest.get(doc_hash)
+    if (entry is None or not os.path.isdir(document_index_path(doc_hash))
+            or embeddings_for_space(entry.get('embedding')) is None):
+        job = ingest_jobs.submit(
+            IngestJob(filename, doc_hash, None),
+            lambda queued: ingest_document(queued, content_path)
+        )
+        ingest_jobs.wait(job)
+        if job.stage != 'done':
+            raise RuntimeError(job.error or f'Failed to process {filename}')
+    return doc_hash
+
+def analyze_batch_file(file_path, output_path, mode):
+    """Index and analyze one PDF and write its result atomically"""
+    doc_id = ensure_document_indexed(file_path)
+    result = get_document_analysis(doc_id, mode)
+    result['filename'] = os.path.basename(file_path)
+    result['doc_id'] = doc_id
+
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(result, f, indent=2)
+    os.replace(tmp_path, output_path)
+
+def run_batch(job, concurrency, mode):
+    """
+    Analyze every PDF of the job's directory, concurrency files at a time.
+
+    Files that already have a result in the output directory are skipped, so
+    an interrupted batch can simply be started again. Failed files get no
+    result and are retried by the next run.
+    """
+    os.makedirs(job.output_dir, exist_ok=True)
+    filenames = sorted(f for f in os.listdir(job.directory) if f.lower().endswith('.pdf'))
+    job.update(stage='analyzing', files_total=len(filenames))
+
+    start = time.perf_counter()
+    failures = {}
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch-file") as pool:
+        futures = {}
+        for filename in filenames:
+            output_path = batch_result_path(job.output_dir, filename)
+            if os.path.exists(output_path):
+                job.record('skipped')
+                continue
+            file_path = os.path.join(job.directory, filename)
+            futures[pool.submit(analyze_batch_file, file_path, output_path, mode)] = filename
+
+        for future in as_completed(futures):
+            filename = futures[future]
+            try:
+                future.result()
+                job.record('done')
+            except Exception as e:
+                print(f"Error analyzing {filename}: {str(e)}")
+                failures[filename] = str(e)
+                job.record('failed')
+
+    elapsed = time.perf_counter() - start
+    analyzed = len(futures) - len(failures)
+    return {
+        'analyzed': analyzed,
+        'skipped': len(filenames) - len(futures),
+        'failed': failures,
+        'elapsed': round(elapsed, 3),
+        'docs_per_minute': round(analyzed / elapsed * 60, 2) if elapsed > 0 else 0.0
+    }
+
+def wants_timings():
+    """Whether the client asked for a per-request stage timing breakdown"""
+    return request.args.get('timings') == '1' or request.headers.get('X-Timings') == '1'
+
+def collect_cache_metrics():
+    """Gauge samples of the embedding and analysis caches for /metrics"""
+    samples = []
+    caches = [('analysis', analysis_cache.stats()), ('answer', answer_cache.stats())]
+    # Do not create the embedding client just for a scrape
+    if embeddings is not None:
+        caches.append(('embedding', embeddings.stats()))
+    for cache, stats in caches:
+        samples.append(('cache_entries', 'Entries stored in a cache', {'cache': cache}, stats['entries']))
+        samples.append(('cache_hits', 'Cache hits since start', {'cache': cache}, stats['hits']))
+        samples.append(('cache_misses', 'Cache misses since start', {'cache': cache}, stats['misses']))
+    return samples
+
+metrics.add_collector(collect_cache_metrics)
+
+def collect_index_metrics():
+    """Gauge samples of the segmented index manifest for /metrics"""
+    stats = index_manifest.stats()
+    return [
+        ('index_documents', 'Documents in the index manifest', {}, stats['entries']),
+        ('index_manifest_segments', 'Manifest segments waiting for compaction', {}, stats['segments']),
+        ('index_manifest_compactions', 'Manifest compactions since start', {}, stats['compactions'])
+    ]
+
+metrics.add_collector(collect_index_metrics)
+
+def collect_embedding_client_metrics():
+    """Gauge samples of the Ollama embedding client for /metrics"""
+    client = getattr(embeddings, 'embeddings', None)
+    if not hasattr(client, 'stats'):
+        return []
+    stats = client.stats()
+    return [
+        ('embedding_batch_size', 'Current adaptive embedding batch size', {}, stats['batch_size']),
+        ('embedding_requests_in_flight', 'Embedding requests currently sent to Ollama', {}, stats['in_flight'])
+    ]
+
+metrics.add_collector(collect_embedding_client_metrics)
+
+@app.before_request
+def start_request_metrics():
+    request.environ['metrics.start'] = time.perf_counter()
+    if wants_timings():
+        request.environ['metrics.timings_token'] = start_request_timings()
+
+@app.after_request
+def finish_request_metrics(response):
+    start = request.environ.get('metrics.start')
+    if start is not None:
+        rule = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - start,
+                        endpoint=rule, method=request.method, status=response.status_code)
+
+    timings = current_timings()
+    if timings is not None and not response.is_streamed:
+        response.headers['Server-Timing'] = timings.server_timing()
+        if response.is_json:
+            data = response.get_json()
+            if isinstance(data, dict):
+                data['stage_timings'] = timings.to_dict()
+                response.set_data(json.dumps(data))
+    return response
+
+@app.teardown_request
+def end_request_metrics(exc):
+    token = request.environ.pop('metrics.timings_token', None)
+    if token is not None:
+        end_request_timings(token)
+
+def warm_up(job):
+    """Do the slow first-use work ahead of the first requests"""
+    steps = [
+        ('imports', lambda: [importlib.import_module(name) for name in HEAVY_MODULES]),
+        ('llm', get_llm),
+        ('embeddings', get_embeddings),
+        ('index_config', get_index_config),
+        ('prompts', lambda: get_prompt('qa'))
+    ]
+    for name, step in steps:
+        job.update(stage=name)
+        start = time.perf_counter()
+        step()
+        job.update(steps={**job.steps, name: round(time.perf_counter() - start, 3)})
+
+    job.update(stage='preloading')
+    start = time.perf_counter()
+    entries = sorted(index_manifest.items(), key=lambda item: item[1].get('indexedAt', ''), reverse=True)
+    doc_ids = [doc_id for doc_id, _ in entries if os.path.isdir(document_index_path(doc_id))]
+    doc_ids = doc_ids[:WARMUP_PRELOAD_INDEXES]
+    job.update(indexes_total=len(doc_ids))
+    for doc_id in doc_ids:
+        try:
+            documents.get(doc_id)
+        except Exception as e:
+            print(f"Error preloading index {doc_id}: {str(e)}")
+            continue
+        job.update(indexes_loaded=job.indexes_loaded + 1)
+    job.update(steps={**job.steps, 'preloading': round(time.perf_counter() - start, 3)})
+    return {'indexes_loaded': job.indexes_loaded}
+
+def start_warmup():
+    """Start the background warm-up once per process"""
+    global warmup_job
+    if warmup_job is None:
+        warmup_job = warmup_jobs.submit(WarmupJob(), warm_up)
+    return warmup_job
+
+@app.route('/health', methods=['GET'])
+def health():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """
+    Readiness: 200 once the warm-up has finished (or when it is disabled), 503 before.
+    A failed warm-up does not block traffic, whatever it could not create is
+    retried on first use; its error is reported in the response.
+    """
+    if warmup_job is None:
+        return jsonify({'ready': True, 'warmup': None})
+    job = warmup_job.to_dict()
+    if warmup_job.finished:
+        return jsonify({'ready': True, 'warmup': job})
+    return jsonify({'ready': False, 'warmup': job}), 503
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    return jsonify({'error': f'File too large, the limit is {MAX_UPLOAD_MB} MB'}), 413
+
+@app.route('/upload', methods=['POST'])
+def upload_file():
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file provided'}), 400
+
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+
+    try:
+        body, status = accept_upload(file.stream, file.filename, get_session())
+        return jsonify(body), status
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/query', methods=['POST'])
-def query():
-    global chat_history, rag_chain
+@app.route('/batch_analyze', methods=['POST'])
+def batch_analyze():
+    data = request.get_json(silent=True) or {}
+    directory = resolve_within(BATCH_ROOT, data.get('directory', '.'))
+    if directory is None or not os.path.isdir(directory):
+        return jsonify({'error': 'Directory not found'}), 404
 
-    if not rag_chain:
-        return jsonify({'error': 'Please upload a document first.'}), 400
+    output_dir = resolve_within(BATCH_RESULTS_FOLDER, data.get('output_dir', data.get('directory', '.')))
+    if output_dir is None:
+        return jsonify({'error': 'Invalid output directory'}), 400
 
-    data = request.json
-    if not data or 'question' not in data:
-        return jsonify({'error': 'No question provided'}), 400
+    mode = data.get('mode', 'concurrent')
+    if mode not in ANALYSIS_MODES:
+        return jsonify({'error': f"Unknown analysis mode '{mode}'. Use one of: {', '.join(ANALYSIS_MODES)}"}), 400
 
-    question = data['question']
+    try:
+        concurrency = max(1, int(data.get('concurrency', BATCH_CONCURRENCY)))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'concurrency must be an integer'}), 400
+
+    job = batch_jobs.submit(
+        BatchJob(directory, output_dir),
+        lambda queued: run_batch(queued, concurrency, mode)
+    )
+    return jsonify({
+        'message': 'Batch analysis started',
+        'job_id': job.job_id,
+        'status_url': f'/jobs/{job.job_id}',
+        'job': job.to_dict()
+    }), 202
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = ingest_jobs.get(job_id) or batch_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/query', methods=['POST'])
+def query():
+    session = get_session()
+    error = require_document(session)
+    if error:
+        return error
 
     try:
-        ai_response = rag_chain.invoke({
-            "input": question,
-            "chat_history": chat_history
-        })
+        question, bypass_cache = query_request(request.json)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-        chat_history.extend([
-            HumanMessage(content=question),
-            AIMessage(content=ai_response["answer"])
-        ])
+    try:
+        document = documents.get(session.doc_id)
+        history = session.memory.history()
+        config = chain_config("query")
+        # Follow-ups are rewritten first, so the cache and retrieval see the same question
+        standalone = standalone_question(question, history, config)
+
+        cached, vector = lookup_answer(document, standalone, "query", bypass_cache=bypass_cache)
+        if cached is not None:
+            answer = cached['answer']
+        else:
+            answer = document.qa_chain.invoke(qa_inputs(standalone, history), config=config)["answer"]
+        record_answer(session, document, history, question, standalone, vector, answer, cached)
 
-        return jsonify({
-            'question': question,
-            'answer': ai_response["answer"]
-        })
+        return jsonify(answer_response(question, answer, cached))
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+def sse_event(event, data):
+    """Format one Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class AnswerStream:
+    """
+    Server-Sent Events of one streamed answer: a 'token' event per chunk and a
+    closing 'done' event with the full answer and the time to first token.
+    """
+
+    def __init__(self, question, timings=None):
+        self.question = question
+        self.timings = timings
+        self.start = time.perf_counter()
+        self.first_token = None
+        self.tokens = []
+
+    @property
+    def answer(self):
+        return ''.join(self.tokens)
+
+    def token(self, token, cached=False):
+        """'token' event of one answer chunk"""
+        if self.first_token is None:
+            self.first_token = time.perf_counter() - self.start
+            if not cached:
+                record_stage('query_stream.first_token', self.first_token, self.timings)
+        self.tokens.append(token)
+        return sse_event('token', {'token': token})
+
+    def done(self, cached=None):
+        done = {
+            'question': self.question,
+            'answer': self.answer,
+            'cached': cached is not None,
+            'time_to_first_token': round(self.first_token, 3) if self.first_token is not None else None,
+            'total_time': round(time.perf_counter() - self.start, 3)
+        }
+        if self.timings is not None:
+            done['stage_timings'] = self.timings.to_dict()
+        return sse_event('done', done)
+
+
+# Headers of a Server-Sent Events response
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    # Stop reverse proxies from buffering the stream
+    'X-Accel-Buffering': 'no'
+}
+
+
+@app.route('/query/stream', methods=['POST'])
+def query_stream():
+    """
+    Streaming variant of /query over Server-Sent Events.
+
+    Emits a 'token' event per answer chunk as the LLM produces it, then a
+    'done' event with the full answer and the time to first token, or an
+    'error' event. The session's chat history is updated once the answer is
+    complete.
+    """
+    session = get_session()
+    error = require_document(session)
+    if error:
+        return error
+
+    try:
+        question, bypass_cache = query_request(request.json)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    # The stream outlives the request context, so its timings are collected explicitly
+    stream_timings = StageTimings() if wants_timings() else None
+
+    def generate():
+        stream = AnswerStream(question, stream_timings)
+        try:
+            document = documents.get(session.doc_id)
+            history = session.memory.history()
+            config = chain_config("query_stream", stream_timings)
+            standalone = standalone_question(question, history, config)
+
+            cached, vector = lookup_answer(document, standalone, "query_stream", stream_timings, bypass_cache)
+            if cached is not None:
+                # A cached answer is sent as a single token
+                yield stream.token(cached['answer'], cached=True)
+            else:
+                for chunk in document.qa_chain.stream(qa_inputs(standalone, history), config=config):
+                    if chunk.get("answer"):
+                        yield stream.token(chunk["answer"])
+
+            record_answer(session, document, history, question, standalone, vector, stream.answer, cached)
+            yield stream.done(cached)
+
+        except Exception as e:
+            yield sse_event('error', {'error': str(e)})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+
 @app.route('/clear', methods=['POST'])
 def clear_history():
-    global chat_history
-    chat_history = []
+    get_session().clear_history()
     return jsonify({'message': 'Chat history cleared successfully'})
 
 
 @app.route('/reset', methods=['POST'])
 def reset_db():
-    global vectorstore, retriever, rag_chain, chat_history, current_document_info, uploaded_files
-
     try:
-        if os.path.exists(index_path):
-            for file in os.listdir(index_path):
-                file_path = os.path.join(index_path, file)
-                if os.path.isfile(file_path):
-                    os.unlink(file_path)
-
-        vectorstore = None
-        retriever = None
-        rag_chain = None
-        chat_history = []
-        current_document_info = {
-            "filename": None,
-            "document_type": None
-        }
-        uploaded_files = []
+        with manifest_lock:
+            index_manifest.clear()
+            if os.path.exists(index_path):
+                # One rename empties the index; the old tree is deleted after
+                trash_path = f"{index_path}{TRASH_PREFIX}{uuid.uuid4().hex[:8]}"
+                os.replace(index_path, trash_path)
+                shutil.rmtree(trash_path, ignore_errors=True)
+
+        documents.clear()
+        sessions.clear()
+        score_table.clear()
+        answer_cache.invalidate()
+        document_registry.clear()
 
         return jsonify({'message': 'Database reset successfully'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/detect_type', methods=['POST'])
-def detect_document_type():
-    global chat_history, rag_chain, current_document_info
+def delete_document(doc_id):
+    """
+    Remove one document's vectors, docstore and manifest entry.
 
-    if not rag_chain:
-        return jsonify({'error': 'Please upload a document first.'}), 400
+    Other documents live in their own index directories and are not touched,
+    so the cost only depends on the size of the deleted document.
+
+    Returns:
+        int: Number of chunks removed, None if the document is unknown
+    """
+    with manifest_lock:
+        entry = index_manifest.get(doc_id)
+        doc_path = document_index_path(doc_id)
+        if entry is None and not os.path.isdir(doc_path):
+            return None
+
+        documents.evict(doc_id)
+        sessions.release_document(doc_id)
+        if os.path.isdir(doc_path):
+            # Rename first so a crash never leaves a half-deleted index behind
+            trash_path = os.path.join(index_path, f"{TRASH_PREFIX}{doc_id}-{uuid.uuid4().hex[:8]}")
+            os.replace(doc_path, trash_path)
+            shutil.rmtree(trash_path, ignore_errors=True)
+        index_manifest.remove(doc_id)
+    score_table.remove(doc_id)
+    answer_cache.invalidate(doc_id)
+
+    content_path = stored_upload_path(doc_id)
+    if os.path.exists(content_path):
+        os.unlink(content_path)
+    # Every name the document was uploaded under links to it
+    filenames = set(document_registry.files(doc_id))
+    file_info = document_registry.get(doc_id)
+    if file_info is not None:
+        filenames.add(file_info['filename'])
+    for filename in filenames:
+        file_path = os.path.join(UPLOAD_FOLDER, filename)
+        # The same filename may have been reused by a newer upload
+        if os.path.exists(file_path) and upload_hashes.get(file_path) == doc_id:
+            os.unlink(file_path)
+    document_registry.remove(doc_id)
+
+    return entry['chunks'] if entry else 0
+
+
+@app.route('/files', methods=['GET'])
+def get_files():
+    """
+    Processed documents, one page at a time. The body stays a plain list;
+    the cursor of the next page is sent in the X-Next-Cursor and Link headers.
+    """
+    try:
+        files, next_cursor = list_files(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    response = jsonify(files)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{files_page_url(request.path, request.args, next_cursor)}>; rel="next"'
+    return response
+
+
+@app.route('/delete/<doc_id>', methods=['DELETE'])
+def delete_file(doc_id):
+    if ingest_jobs.active(doc_id) is not None:
+        return jsonify({'success': False, 'error': 'Document is still being processed'}), 409
 
     try:
-        old_chat_history = chat_history.copy()
-        chat_history = []
+        chunks_removed = delete_document(doc_id)
+        if chunks_removed is None:
+            return jsonify({'success': False, 'error': 'File not found'}), 404
 
-        detection_question = "What type of document is this? Is it a resume, CV, research paper, report, brochure, technical manual, or something else?"
-        ai_response = rag_chain.invoke({
-            "input": detection_question,
-            "chat_history": []
+        return jsonify({
+            'success': True,
+            'message': 'File deleted successfully',
+            'doc_id': doc_id,
+            'chunks_removed': chunks_removed
         })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+DETECTION_QUESTION = "What type of document is this? Is it a resume, CV, research paper, report, brochure, technical manual, or something else?"
+
+
+def record_document_type(session, answer):
+    """Keep the detected type of the session's document, returns it"""
+    document_type = answer.strip()
+    with session.lock:
+        session.document_info["document_type"] = document_type
+    document_registry.set_document_type(session.doc_id, document_type)
+    return document_type
 
-        document_type = ai_response["answer"].strip()
-        current_document_info["document_type"] = document_type
-        chat_history = old_chat_history
 
-        return jsonify({'document_type': document_type})
+@app.route('/detect_type', methods=['POST'])
+def detect_document_type():
+    session = get_session()
+    error = require_document(session)
+    if error:
+        return error
+
+    try:
+        qa_chain = documents.get(session.doc_id).qa_chain
+        ai_response = qa_chain.invoke(qa_inputs(DETECTION_QUESTION), config=chain_config("detect_type"))
+
+        return jsonify({'document_type': record_document_type(session, ai_response["answer"])})
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -456,150 +2004,119 @@ def detect_document_type():
 
 @app.route('/analyze_document', methods=['POST'])
 def analyze_document():
-    global rag_chain, current_document_info
-    
-    if not rag_chain:
-        return jsonify({'error': 'Please upload a document first.'}), 400
+    session = get_session()
+    error = require_document(session)
+    if error:
+        return error
+
+    data = request.get_json(silent=True) or {}
+    mode = data.get('mode', 'concurrent')
+    if mode not in ANALYSIS_MODES:
+        return jsonify({'error': f"Unknown analysis mode '{mode}'. Use one of: {', '.join(ANALYSIS_MODES)}"}), 400
+    bypass_cache = bool(data.get('bypass_cache', False))
 
     try:
-        # Get document heading
-        heading_question = """Analyze this Indian government manifesto and identify the most relevant ministry or department.
-        Format the heading as: "Ministry of <Department Name> Department".
-        Choose the department based on dominant themes and context in the content.
-        Be precise and specific in identifying the ministry."""
-        heading_response = rag_chain.invoke({
-            "input": heading_question,
-            "chat_history": []
-        })
-        heading = heading_response["answer"].strip()
+        return jsonify(get_document_analysis(session.doc_id, mode, bypass_cache))
 
-        # Get document summary
-        summary_question = """Provide a concise summary (4-6 sentences) of this Indian government manifesto that captures:
-        1. Main themes and goals
-        2. Key policy initiatives
-        3. Significant commitments or plans
-        4. Overall vision for the department
-        Use formal, factual language suitable for government documentation.
-        Focus on clarity and ease of understanding."""
-        summary_response = rag_chain.invoke({
-            "input": summary_question,
-            "chat_history": []
-        })
-        summary = summary_response["answer"].strip().split('\   n')
+    except Exception as e:
+        document_registry.record_analysis(session.doc_id, succeeded=False)
+        return jsonify({'error': str(e)}), 500
 
-        # Get enhancement suggestions FIRST - important for calculating the adjustment factor
-        suggestions_question = """Based on the manifesto content, provide 3-5 constructive suggestions focusing on:
-        1. Policy gaps or areas needing clarification
-        2. Potential improvements in governance approach
-        3. Areas where public welfare could be enhanced
-        4. Implementation considerations specific to Indian context
-        Ensure suggestions are:
-        - Actionable and practical
-        - Grounded in Indian governance context
-        - Focused on public welfare
-        - Based on policy analysis"""
-        suggestions_response = rag_chain.invoke({
-            "input": suggestions_question,
-            "chat_history": []
-        })
-        suggestions = suggestions_response["answer"].strip().split('\n')
-        
-        # Calculate the suggestion impact factor
-        suggestion_factor = analyze_enhancement_suggestions(suggestions)
 
-        # Evaluate document based on CFR criteria
-        evaluation_response = rag_chain.invoke({
-            "input": evaluation_prompt,
-            "chat_history": []
-        })
-        
-        try:
-            # Parse evaluation response
-            import json
-            from json import JSONDecodeError
-            
-            answer_text = evaluation_response["answer"].strip()
-            try:
-                evaluation_data = json.loads(answer_text)
-            except JSONDecodeError:
-                import re
-                json_match = re.search(r'({[\s\S]*})', answer_text)
-                if json_match:
-                    evaluation_data = json.loads(json_match.group(1))
-                else:
-                    evaluation_data = {"sections": {
-                        section: {"score": 70, "justification": "Default evaluation"}
-                        for section in SECTION_WEIGHTS.keys()
-                    }}
-            
-            # Process section scores (before adjustment)
-            base_sections = {}
-            for section, data in evaluation_data.get("sections", {}).items():
-                score = validate_score(data.get("score", 70))
-                base_sections[section] = {
-                    "score": score,
-                    "justification": data.get("justification", "No justification provided")
-                }
-            
-            # Apply suggestion factor to adjust scores
-            adjusted_sections = adjust_scores_by_suggestions(base_sections, suggestion_factor)
-            
-            # Calculate overall score based on adjusted sections
-            overall_score = calculate_overall_score(adjusted_sections)
-            
-            # Prepare evaluation details with both original and adjusted scores
-            evaluation_details = {
-                "overall_score": overall_score,
-                "overall_rating": get_rating_label(overall_score),
-                "suggestion_impact_factor": round(suggestion_factor, 2),
-                "section_scores": adjusted_sections,
-                "original_scores": {
-                    section: data["score"] for section, data in base_sections.items()
-                }
-            }
-            
-        except Exception as e:
-            print(f"Error processing evaluation: {str(e)}")
-            evaluation_details = {
-                "overall_score": 70,
-                "overall_rating": "Fair",
-                "suggestion_impact_factor": 1.0,
-                "section_scores": {
-                    section: {
-                        "score": 70,
-                        "rating": "Fair",
-                        "justification": "Automatic evaluation"
-                    }
-                    for section in SECTION_WEIGHTS.keys()
-                }
-            }
+@app.route('/embedding_cache', methods=['GET'])
+def embedding_cache_stats():
+    embedder = get_embeddings()
+    stats = embedder.stats()
+    client = getattr(embedder, 'embeddings', None)
+    if hasattr(client, 'stats'):
+        stats['client'] = client.stats()
+    return jsonify(stats)
+
+
+@app.route('/analysis_cache', methods=['GET'])
+def analysis_cache_stats():
+    return jsonify(analysis_cache.stats())
 
-        return jsonify({
-            'heading': heading,
-            'summary': summary,
-            'enhancement_suggestions': suggestions,
-            'evaluation': evaluation_details
-        })
 
+@app.route('/answer_cache', methods=['GET'])
+def answer_cache_stats():
+    return jsonify(answer_cache.stats())
+
+
+@app.route('/rescore', methods=['POST'])
+def rescore_documents():
+    """
+    What-if scoring of every analyzed document without calling the LLM.
+
+    The stored raw section scores are re-weighted, adjusted by the suggestion
+    factor, labelled and ranked in one vectorized pass. Each entry also
+    carries its score and rank under the current settings.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        weights = {**SECTION_WEIGHTS, **{k: float(v) for k, v in (data.get('weights') or {}).items()}}
+        params = {k: float(v) for k, v in (data.get('suggestion_params') or {}).items()}
+        thresholds = {k: float(v) for k, v in (data.get('thresholds') or {}).items()}
+        top = data.get('top')
+        top = int(top) if top is not None else None
+    except (TypeError, ValueError, AttributeError):
+        return jsonify({'error': 'weights, suggestion_params and thresholds must map names to numbers'}), 400
+
+    if data.get('normalize'):
+        total = sum(weights.values())
+        if total <= 0:
+            return jsonify({'error': 'Weights must sum to a positive number'}), 400
+        weights = {section: weight / total for section, weight in weights.items()}
+
+    try:
+        ranked = ranking(score_table, weights, params, thresholds, top)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+    return jsonify({
+        'documents': len(score_table),
+        'weights': weights,
+        'ranking': ranked
+    })
+
 
 @app.route('/uploads/<filename>')
 def serve_uploaded_file(filename):
+    """
+    Serve an uploaded PDF with byte range support and validators.
+
+    The ETag is the SHA-256 of the content, so If-None-Match answers 304 and
+    a viewer only fetches the ranges it displays (206) until the file changes.
+    """
     try:
-        # Ensure the filename is safe and exists
-        if not os.path.exists(os.path.join(UPLOAD_FOLDER, filename)):
+        # Only names PDFs were uploaded under; never in-flight .part files or the by-hash store
+        if filename.startswith(PARTIAL_PREFIX) or document_registry.file_document(filename) is None:
             return jsonify({'error': 'File not found'}), 404
-        
-        # Set the correct MIME type for PDF
-        response = send_from_directory(UPLOAD_FOLDER, filename)
-        response.headers['Content-Type'] = 'application/pdf'
+        file_path = resolve_within(UPLOAD_FOLDER, filename)
+        if file_path is None or not os.path.isfile(file_path):
+            return jsonify({'error': 'File not found'}), 404
+
+        response = send_file(
+            os.path.abspath(file_path),
+            mimetype='application/pdf',
+            conditional=True,
+            etag=upload_hashes.get(file_path),
+            max_age=UPLOAD_CACHE_MAX_AGE
+        )
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.cache_control.private = True
         return response
     except Exception as e:
         print(f"Error serving file {filename}: {str(e)}")
         return jsonify({'error': 'Failed to serve file'}), 500
 
 
+backfill_document_registry()
+
+if WARMUP_ON_START:
+    start_warmup()
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,430 @@
+import asyncio
+import os
+import time
+import weakref
+
+from a2wsgi import WSGIMiddleware
+from python_multipart import MultipartParser
+from python_multipart.multipart import parse_options_header
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.exceptions import RequestEntityTooLarge
+
+import app as backend
+from metrics import (metrics, span, chain_config, StageTimings,
+                     start_request_timings, end_request_timings, current_timings)
+from uploads import HashingUploadFile
+
+# Threads serving the routes that are left to the Flask app
+ASGI_WSGI_WORKERS = int(os.getenv("ASGI_WSGI_WORKERS", "10"))
+# Form fields other than the file are small (session_id); larger ones are refused
+MAX_FORM_FIELD_BYTES = 64 * 1024
+
+_analysis_slots = weakref.WeakKeyDictionary()
+# Routes served on the event loop, collected by @endpoint
+routes = []
+
+
+def analysis_slots():
+    """Semaphore of the running event loop bounding analysis LLM calls, like the Flask analysis pool"""
+    loop = asyncio.get_running_loop()
+    slots = _analysis_slots.get(loop)
+    if slots is None:
+        slots = _analysis_slots[loop] = asyncio.Semaphore(backend.ANALYSIS_MAX_CONCURRENCY)
+    return slots
+
+
+def wants_timings(request):
+    """Whether the client asked for a per-request stage timing breakdown"""
+    return request.query_params.get('timings') == '1' or request.headers.get('X-Timings') == '1'
+
+
+async def json_body(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def session_for(request, data=None, form=None):
+    """Resolve the session of a request (header, JSON body or form field)"""
+    session_id = (
+        request.headers.get('X-Session-ID')
+        or (data or {}).get('session_id')
+        or (form or {}).get('session_id')
+        or backend.DEFAULT_SESSION_ID
+    )
+    return backend.sessions.get(str(session_id))
+
+
+async def get_document(doc_id):
+    # Loading an index that is not resident reads it from disk
+    return await run_in_threadpool(backend.documents.get, doc_id)
+
+
+def endpoint(path, methods=('POST',)):
+    """
+    Serve an async handler at path, with the conventions of the Flask app.
+
+    Handlers return a dict (200), a (dict, status) tuple or a Response. Request
+    duration is recorded per route and, when the client asks for it, the
+    stage timings are added to JSON bodies and the Server-Timing header.
+    """
+    def decorator(handler):
+        async def serve(request):
+            start = time.perf_counter()
+            token = start_request_timings() if wants_timings(request) else None
+            try:
+                result = await handler(request)
+                if isinstance(result, Response):
+                    response = result
+                else:
+                    data, status = result if isinstance(result, tuple) else (result, 200)
+                    timings = current_timings()
+                    headers = None
+                    if timings is not None and isinstance(data, dict):
+                        data['stage_timings'] = timings.to_dict()
+                        headers = {'Server-Timing': timings.server_timing()}
+                    response = JSONResponse(data, status_code=status, headers=headers)
+            finally:
+                if token is not None:
+                    end_request_timings(token)
+            metrics.observe('http_request_duration_seconds', time.perf_counter() - start,
+                            endpoint=path, method=request.method, status=response.status_code)
+            return response
+
+        routes.append(Route(path, serve, methods=list(methods)))
+        return handler
+    return decorator
+
+
+async def standalone_question(question, history, config=None):
+    """backend.standalone_question without blocking the event loop"""
+    if not history:
+        return question
+    return await backend.question_rewriter().ainvoke({"input": question, "chat_history": history}, config=config)
+
+
+async def lookup_answer(document, question, operation, timings=None, bypass_cache=False):
+    """backend.lookup_answer without blocking the event loop"""
+    with span(f"{operation}.cache_lookup", timings):
+        vector = None
+        if backend.needs_query_embedding(document, question):
+            vector = await document.store.embedding_function.aembed_query(question)
+        return backend.cached_answer(document, question, vector, bypass_cache), vector
+
+
+async def run_analysis_pass(chain, name, question, request_timings=None):
+    async with analysis_slots():
+        start = time.perf_counter()
+        response = await chain.ainvoke(backend.qa_inputs(question),
+                                       config=chain_config(f"analysis.{name}", request_timings))
+        return backend.analysis_pass_result(name, response, start, request_timings)
+
+
+async def run_analysis_passes(chain, concurrent=True, passes=None):
+    """backend.run_analysis_passes on the event loop; concurrent passes are awaited together"""
+    passes = passes or backend.ANALYSIS_PASSES
+    request_timings = current_timings()
+    if concurrent:
+        results = await asyncio.gather(*(
+            run_analysis_pass(chain, name, question, request_timings) for name, question in passes.items()
+        ))
+    else:
+        results = [await run_analysis_pass(chain, name, question, request_timings)
+                   for name, question in passes.items()]
+    return backend.collect_pass_results(passes, results)
+
+
+async def run_structured_analysis(document, sections):
+    """backend.run_structured_analysis with the retrievals awaited together"""
+    start = time.perf_counter()
+    results = await asyncio.gather(*(
+        document.retriever.ainvoke(question, config=chain_config("analysis.structured"))
+        for question in backend.analysis_passes(sections).values()
+    ))
+    context = backend.merge_contexts(results)
+    retrieved = time.perf_counter()
+
+    async with analysis_slots():
+        answer_text = await backend.structured_analysis_chain().ainvoke(
+            backend.structured_analysis_inputs(context, sections), config=chain_config("analysis.structured")
+        )
+    return backend.structured_analysis_result(answer_text, context, start, retrieved, sections)
+
+
+async def get_document_analysis(doc_id, mode='concurrent', bypass_cache=False):
+    """backend.get_document_analysis with the LLM calls awaited on the event loop"""
+    start = time.perf_counter()
+    # The analysis cache, the CFR tables and the score table are on disk
+    cache_key, extracted = await run_in_threadpool(backend.analysis_plan, doc_id, mode)
+    if not bypass_cache:
+        cached = await run_in_threadpool(backend.cached_analysis, doc_id, cache_key, start)
+        if cached is not None:
+            return cached
+
+    document = await get_document(doc_id)
+    sections = backend.sections_to_ask(extracted)
+    passes = backend.analysis_passes(sections)
+    context_chunks = None
+    structured_error = None
+    if mode == 'structured':
+        try:
+            answers, timings, context_chunks = await run_structured_analysis(document, sections)
+        except ValueError as e:
+            structured_error = backend.structured_analysis_failed(e)
+            answers, timings = await run_analysis_passes(document.qa_chain, passes=passes)
+    else:
+        answers, timings = await run_analysis_passes(document.qa_chain, concurrent=(mode == 'concurrent'),
+                                                     passes=passes)
+    timings['total'] = round(time.perf_counter() - start, 3)
+
+    return await run_in_threadpool(backend.finish_analysis, doc_id, mode, cache_key, extracted,
+                                   answers, timings, context_chunks, structured_error)
+
+
+async def receive_upload(request):
+    """
+    Stream a multipart upload into a HashingUploadFile.
+
+    The body is parsed chunk by chunk as it arrives; parsing and writing run on
+    a worker thread so the event loop never waits for the disk.
+
+    Returns:
+        tuple: (upload or None, client file name, other form fields)
+
+    Raises:
+        RequestEntityTooLarge: If the file exceeds MAX_UPLOAD_MB
+    """
+    content_type, params = parse_options_header(request.headers.get('content-type', ''))
+    if content_type != b'multipart/form-data' or b'boundary' not in params:
+        return None, None, {}
+
+    state = {'upload': None, 'filename': None, 'fields': {}}
+    part = {}
+
+    def on_part_begin():
+        part.clear()
+        part.update(headers={}, field=b'', value=b'', name=None, target=None, data=[], size=0)
+
+    def on_header_field(data, start, end):
+        part['field'] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part['value'] += data[start:end]
+
+    def on_header_end():
+        part['headers'][part['field'].lower()] = part['value']
+        part['field'] = part['value'] = b''
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(part['headers'].get(b'content-disposition', b''))
+        part['name'] = disposition.get(b'name', b'').decode('utf-8', 'replace')
+        if part['name'] == 'file' and b'filename' in disposition and state['upload'] is None:
+            # Like Flask, only the first file of the request is kept
+            state['filename'] = disposition[b'filename'].decode('utf-8', 'replace')
+            state['upload'] = part['target'] = HashingUploadFile(
+                backend.UPLOAD_FOLDER, backend.MAX_UPLOAD_MB * 1024 * 1024
+            )
+
+    def on_part_data(data, start, end):
+        if part['target'] is not None:
+            part['target'].write(data[start:end])
+        elif part['name']:
+            part['size'] += end - start
+            if part['size'] > MAX_FORM_FIELD_BYTES:
+                raise RequestEntityTooLarge('Form field too large')
+            part['data'].append(data[start:end])
+
+    def on_part_end():
+        if part['target'] is None and part['name']:
+            state['fields'][part['name']] = b''.join(part['data']).decode('utf-8', 'replace')
+
+    parser = MultipartParser(params[b'boundary'], callbacks={
+        'on_part_begin': on_part_begin,
+        'on_header_field': on_header_field,
+        'on_header_value': on_header_value,
+        'on_header_end': on_header_end,
+        'on_headers_finished': on_headers_finished,
+        'on_part_data': on_part_data,
+        'on_part_end': on_part_end
+    })
+    try:
+        async for chunk in request.stream():
+            if chunk:
+                await run_in_threadpool(parser.write, chunk)
+        await run_in_threadpool(parser.finalize)
+    except BaseException:
+        if state['upload'] is not None:
+            state['upload'].close()
+        raise
+    return state['upload'], state['filename'], state['fields']
+
+
+@endpoint('/upload')
+async def upload_file(request):
+    content_length = request.headers.get('content-length')
+    if content_length and content_length.isdigit() and int(content_length) > (backend.MAX_UPLOAD_MB + 1) * 1024 * 1024:
+        return {'error': f'File too large, the limit is {backend.MAX_UPLOAD_MB} MB'}, 413
+
+    try:
+        upload, filename, fields = await receive_upload(request)
+    except RequestEntityTooLarge:
+        return {'error': f'File too large, the limit is {backend.MAX_UPLOAD_MB} MB'}, 413
+    if upload is None:
+        return {'error': 'No file provided'}, 400
+    if not filename:
+        upload.close()
+        return {'error': 'No file selected'}, 400
+
+    try:
+        session = session_for(request, form=fields)
+        return await run_in_threadpool(backend.accept_upload, upload, filename, session)
+    except Exception as e:
+        return {'error': str(e)}, 500
+    finally:
+        # Removes the temporary file unless the upload was moved into place
+        upload.close()
+
+
+@endpoint('/query')
+async def query(request):
+    data = await json_body(request)
+    session = session_for(request, data)
+    unavailable = backend.document_unavailable(session)
+    if unavailable:
+        message, status = unavailable
+        return {'error': message}, status
+
+    try:
+        question, bypass_cache = backend.query_request(data)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    try:
+        document = await get_document(session.doc_id)
+        history = session.memory.history()
+        config = chain_config("query")
+        # Follow-ups are rewritten first, so the cache and retrieval see the same question
+        standalone = await standalone_question(question, history, config)
+
+        cached, vector = await lookup_answer(document, standalone, "query", bypass_cache=bypass_cache)
+        if cached is not None:
+            answer = cached['answer']
+        else:
+            answer = (await document.qa_chain.ainvoke(backend.qa_inputs(standalone, history), config=config))["answer"]
+        backend.record_answer(session, document, history, question, standalone, vector, answer, cached)
+
+        return backend.answer_response(question, answer, cached)
+
+    except Exception as e:
+        return {'error': str(e)}, 500
+
+
+@endpoint('/query/stream')
+async def query_stream(request):
+    """Streaming variant of /query over Server-Sent Events, with the events of the Flask route"""
+    data = await json_body(request)
+    session = session_for(request, data)
+    unavailable = backend.document_unavailable(session)
+    if unavailable:
+        message, status = unavailable
+        return {'error': message}, status
+
+    try:
+        question, bypass_cache = backend.query_request(data)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    # The stream outlives the handler, so its timings are collected explicitly
+    stream_timings = StageTimings() if wants_timings(request) else None
+
+    async def generate():
+        stream = backend.AnswerStream(question, stream_timings)
+        try:
+            document = await get_document(session.doc_id)
+            history = session.memory.history()
+            config = chain_config("query_stream", stream_timings)
+            standalone = await standalone_question(question, history, config)
+
+            cached, vector = await lookup_answer(document, standalone, "query_stream", stream_timings, bypass_cache)
+            if cached is not None:
+                # A cached answer is sent as a single token
+                yield stream.token(cached['answer'], cached=True)
+            else:
+                async for chunk in document.qa_chain.astream(backend.qa_inputs(standalone, history), config=config):
+                    if chunk.get("answer"):
+                        yield stream.token(chunk["answer"])
+
+            backend.record_answer(session, document, history, question, standalone, vector, stream.answer, cached)
+            yield stream.done(cached)
+
+        except Exception as e:
+            yield backend.sse_event('error', {'error': str(e)})
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers=backend.SSE_HEADERS)
+
+
+@endpoint('/detect_type')
+async def detect_document_type(request):
+    data = await json_body(request)
+    session = session_for(request, data)
+    unavailable = backend.document_unavailable(session)
+    if unavailable:
+        message, status = unavailable
+        return {'error': message}, status
+
+    try:
+        qa_chain = (await get_document(session.doc_id)).qa_chain
+        ai_response = await qa_chain.ainvoke(backend.qa_inputs(backend.DETECTION_QUESTION),
+                                             config=chain_config("detect_type"))
+
+        return {'document_type': backend.record_document_type(session, ai_response["answer"])}
+
+    except Exception as e:
+        return {'error': str(e)}, 500
+
+
+@endpoint('/analyze_document')
+async def analyze_document(request):
+    data = await json_body(request)
+    session = session_for(request, data)
+    unavailable = backend.document_unavailable(session)
+    if unavailable:
+        message, status = unavailable
+        return {'error': message}, status
+
+    mode = data.get('mode', 'concurrent')
+    if mode not in backend.ANALYSIS_MODES:
+        return {'error': f"Unknown analysis mode '{mode}'. Use one of: {', '.join(backend.ANALYSIS_MODES)}"}, 400
+    bypass_cache = bool(data.get('bypass_cache', False))
+
+    try:
+        return await get_document_analysis(session.doc_id, mode, bypass_cache)
+
+    except Exception as e:
+        backend.document_registry.record_analysis(session.doc_id, succeeded=False)
+        return {'error': str(e)}, 500
+
+
+# Routes that call the LLM or the embedder are served on the event loop; the
+# remaining ones (jobs, files, deletes, caches, metrics, health) are quick
+# and served by the Flask app on a thread pool, so every JSON contract stays
+# the same.
+app = Starlette(
+    routes=routes + [Mount('/', app=WSGIMiddleware(backend.app, workers=ASGI_WSGI_WORKERS))],
+    middleware=[
+        Middleware(
+            CORSMiddleware,
+            allow_origins=['*'],
+            allow_methods=['*'],
+            allow_headers=['*'],
+            expose_headers=['Accept-Ranges', 'Content-Range', 'Content-Length', 'ETag', 'Last-Modified',
+                            'X-Next-Cursor', 'Link']
+        )
+    ]
+)
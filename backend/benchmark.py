@@ -0,0 +1,744 @@
+"""
+Offline benchmark of ingest, query and analysis.
+
+The app is imported in a scratch directory with the Groq LLM and the Ollama
+embedder replaced by deterministic local stand-ins with configurable latency,
+so runs need no network and are comparable between commits:
+
+    python benchmark.py --pages 10 100 1000 --concurrency 4 --output bench.json
+    python benchmark.py --pages 10 100 --compare bench.json
+
+Synthetic PDFs of the requested page counts are generated, uploaded through
+/upload (timed until their ingest job finishes), then /query and
+/analyze_document are called from concurrent sessions against each of them.
+Results (throughput and latency percentiles per scenario) are printed and,
+with --output, saved as JSON together with the commit and settings used.
+
+With --embed-http, uploads are embedded by the real Ollama client against a
+local stub server that answers the Ollama embedding API, so connection
+pooling, adaptive batching and concurrent requests are part of the run.
+
+With --serve, /query is also load tested over real HTTP at each given number
+of concurrent clients, once against the Flask app on a WSGI server with
+--serve-threads threads and once against the ASGI app (asgi.py) on uvicorn,
+to show how each serving mode scales with concurrency:
+
+    python benchmark.py --pages 10 --serve 1 10 50 100 200 --startup 0
+"""
+import argparse
+import asyncio
+import hashlib
+import importlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from embedding_cache import CachedEmbeddings
+from embedding_client import OllamaEmbeddingClient
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+WORDS = (
+    "ministry department scheme welfare rural urban infrastructure health education "
+    "employment farmers women youth digital housing water sanitation roads railways "
+    "budget allocation crore target indicator outcome objective mission vision policy "
+    "implementation district state national programme coverage percent increase reduce "
+    "improve access quality annual review monitoring framework commitment results"
+).split()
+
+QUESTIONS = [
+    "What is the main objective of the document?",
+    "Which schemes are proposed for farmers?",
+    "What targets are set for rural housing?",
+    "How will progress be monitored?",
+    "What budget allocation is mentioned?",
+    "Which departments are responsible for implementation?",
+]
+
+
+class StubChatModel(BaseChatModel):
+    """
+    Deterministic stand-in for the Groq chat model.
+
+    Sleeps latency seconds (plus latency_per_token for each output token) and
+    answers with output shaped like what each app prompt expects: evaluation
+    JSON, the structured analysis JSON, suggestion lists, or a plain answer.
+    """
+
+    latency: float = 0.2
+    latency_per_token: float = 0.0
+    section_names: list = []
+    model_name: str = "stub-llm"
+    temperature: float = 0
+
+    @property
+    def _llm_type(self):
+        return "benchmark-stub"
+
+    def respond(self, messages):
+        prompt = "\n".join(str(m.content) for m in messages)
+        question = str(messages[-1].content)
+        sections = {name: {"score": 80, "justification": "Stub justification."} for name in self.section_names}
+
+        if "formulate a standalone question" in prompt:
+            return question
+        if "running summary of a conversation" in prompt:
+            return "The user asked about the document and received answers."
+        if "single JSON object" in question:
+            return json.dumps({
+                "heading": "Ministry of Rural Development Department",
+                "summary": "The document sets out welfare schemes and targets.",
+                "suggestions": ["Clarify the monitoring framework.", "Publish trend values for targets."],
+                "sections": sections
+            })
+        if "Evaluate the quality" in question:
+            return json.dumps({"sections": sections})
+        if "constructive suggestions" in question:
+            return "1. Clarify the monitoring framework.\n2. Publish trend values for targets.\n3. Add baseline data."
+        if "most relevant ministry" in question:
+            return "Ministry of Rural Development Department"
+        return f"Based on the document, the answer to '{question[:60]}' is covered in the context."
+
+    def _delay(self, text):
+        return self.latency + self.latency_per_token * (len(text) // 4 + 1)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = self.respond(messages)
+        time.sleep(self._delay(text))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        # Waits like a remote API call, without holding a thread
+        text = self.respond(messages)
+        await asyncio.sleep(self._delay(text))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+
+class StubEmbeddings(Embeddings):
+    """
+    Deterministic stand-in for the Ollama embedder.
+
+    Vectors are derived from a hash of the text, so identical chunks get
+    identical vectors. Sleeps latency seconds per text, like Ollama embedding
+    one text per request.
+    """
+
+    def __init__(self, dim=768, latency=0.002):
+        self.model = "stub-embeddings"
+        self.dim = dim
+        self.latency = latency
+
+    def _vector(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+        vector = np.random.default_rng(seed).standard_normal(self.dim)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        time.sleep(self.latency * len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        time.sleep(self.latency)
+        return self._vector(text)
+
+    async def aembed_query(self, text):
+        await asyncio.sleep(self.latency)
+        return self._vector(text)
+
+
+# Length of the vectors the stub's /api/embeddings returns
+RAW_VECTOR_SCALE = 20.0
+
+
+class StubOllamaServer:
+    """
+    Local HTTP stand-in for the Ollama embedding API (/api/embed and /api/embeddings).
+
+    Each request costs request_latency seconds plus embedder.latency per text,
+    and at most slots requests are served at once, so the client's connection
+    reuse, batching and concurrency are measured against a server that
+    saturates.
+    """
+
+    def __init__(self, embedder, request_latency=0.005, slots=4):
+        self.embedder = embedder
+        self.request_latency = request_latency
+        self.slots = threading.Semaphore(slots)
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if self.path == '/api/embed':
+                    texts = payload['input'] if isinstance(payload['input'], list) else [payload['input']]
+                elif self.path == '/api/embeddings':
+                    texts = [payload['prompt']]
+                else:
+                    self.send_error(404)
+                    return
+                with server.slots:
+                    server.requests += 1
+                    vectors = server.embedder.embed_documents(texts)
+                    time.sleep(server.request_latency)
+                if self.path == '/api/embed':
+                    body = {'embeddings': vectors}
+                else:
+                    # Like Ollama, the older endpoint returns vectors that are not normalized
+                    body = {'embedding': [value * RAW_VECTOR_SCALE for value in vectors[0]]}
+                body = json.dumps(body).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, name="stub-ollama", daemon=True).start()
+
+
+class PooledWSGIServer(WSGIServer):
+    """wsgiref server handling requests on a fixed number of threads, like one threaded WSGI worker"""
+
+    request_queue_size = 1024
+
+    def __init__(self, address, threads):
+        class QuietHandler(WSGIRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+        super().__init__(address, QuietHandler)
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="wsgi")
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def serve_wsgi(app, threads):
+    """Serve the Flask app over HTTP on threads threads; returns (base URL, stop function)"""
+    server = PooledWSGIServer(('127.0.0.1', 0), threads)
+    server.set_app(app.app)
+    threading.Thread(target=server.serve_forever, name="wsgi", daemon=True).start()
+
+    def stop():
+        server.shutdown()
+        server.pool.shutdown(wait=True)
+        server.server_close()
+    return f"http://127.0.0.1:{server.server_port}", stop
+
+
+def serve_asgi():
+    """Serve the ASGI app with uvicorn in one process; returns (base URL, stop function)"""
+    import uvicorn
+
+    asgi = importlib.import_module('asgi')
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    server = uvicorn.Server(uvicorn.Config(asgi.app, log_level='warning', lifespan='off', backlog=2048))
+    thread = threading.Thread(target=server.run, kwargs={'sockets': [sock]}, name="asgi", daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError('uvicorn failed to start')
+        time.sleep(0.01)
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+        sock.close()
+    return f"http://127.0.0.1:{sock.getsockname()[1]}", stop
+
+
+def pdf_escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def synthetic_pdf(pages, seed=0, lines_per_page=45):
+    """Bytes of a text PDF with the given number of pages of manifesto-like text"""
+    rng = random.Random(seed)
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(None)
+    page_tree = add(None)
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    page_ids = []
+    for number in range(1, pages + 1):
+        lines = [f"Section {number}: commitment for results"]
+        for _ in range(lines_per_page - 1):
+            lines.append(" ".join(rng.choice(WORDS) for _ in range(12)).capitalize() + ".")
+        text = "BT /F1 10 Tf 12 TL 50 800 Td " + " ".join(f"({pdf_escape(line)}) Tj T*" for line in lines) + " ET"
+        stream = text.encode('latin-1')
+        content = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (page_tree, font, content)
+        ))
+
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % page_tree
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[page_tree - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    return bytes(out)
+
+
+def load_app(workdir, args):
+    """Import app inside workdir and swap its LLM and embedder for the stubs"""
+    os.chdir(workdir)
+    os.environ.setdefault("GROQ_API_KEY", "benchmark")
+    # The warm-up would create the real clients the stubs replace
+    os.environ.setdefault("WARMUP_ON_START", "0")
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    app = importlib.import_module('app')
+
+    app.llm = StubChatModel(
+        latency=args.llm_latency,
+        latency_per_token=args.llm_token_latency,
+        section_names=list(app.SECTION_WEIGHTS)
+    )
+    embedder = StubEmbeddings(dim=args.embedding_dim, latency=args.embed_latency)
+    if args.embed_http:
+        server = StubOllamaServer(embedder, args.embed_request_latency, args.embed_server_slots)
+        embedder = OllamaEmbeddingClient.from_env(model=embedder.model)
+        embedder.base_url = server.base_url
+    app.embeddings = CachedEmbeddings(
+        embedder,
+        cache_path=os.path.join(workdir, "embedding_cache", "embeddings.sqlite3")
+    )
+    return app
+
+
+def percentiles(latencies):
+    if not latencies:
+        return {}
+    values = np.array(latencies) * 1000
+    return {
+        'mean': round(float(values.mean()), 2),
+        'p50': round(float(np.percentile(values, 50)), 2),
+        'p90': round(float(np.percentile(values, 90)), 2),
+        'p95': round(float(np.percentile(values, 95)), 2),
+        'p99': round(float(np.percentile(values, 99)), 2),
+        'max': round(float(values.max()), 2)
+    }
+
+
+def run_load(calls, concurrency):
+    """Run calls (functions returning True on success) concurrently, returns stats"""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def timed(call):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            ok = call()
+        except Exception as e:
+            print(f"Error in benchmark call: {str(e)}")
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, calls))
+    wall = time.perf_counter() - start
+    return load_stats(len(calls), errors, concurrency, wall, latencies)
+
+
+def load_stats(requests_count, errors, concurrency, wall, latencies):
+    return {
+        'requests': requests_count,
+        'errors': errors,
+        'concurrency': concurrency,
+        'wall_s': round(wall, 3),
+        'throughput_rps': round(len(latencies) / wall, 3) if wall > 0 else None,
+        'latency_ms': percentiles(latencies)
+    }
+
+
+def upload(client, filename, content, session_id):
+    response = client.post(
+        '/upload',
+        data={'file': (io.BytesIO(content), filename)},
+        headers={'X-Session-ID': session_id},
+        content_type='multipart/form-data'
+    )
+    if response.status_code not in (200, 202):
+        raise RuntimeError(f"upload returned {response.status_code}: {response.get_data(as_text=True)}")
+    return response.get_json()
+
+
+def wait_for_job(client, job_id, interval=0.02, timeout=3600):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        job = client.get(f'/jobs/{job_id}').get_json()
+        if job['stage'] in ('done', 'failed'):
+            return job
+        time.sleep(interval)
+    raise RuntimeError(f"Job {job_id} did not finish within {timeout}s")
+
+
+def bench_upload(app, pages, docs, concurrency, seed):
+    """Upload docs distinct PDFs concurrently, each timed until its ingest job is done"""
+    pdfs = [(f"bench-{pages}p-{i}.pdf", synthetic_pdf(pages, seed=seed + i)) for i in range(docs)]
+
+    def call(filename, content, session_id):
+        def run():
+            client = app.app.test_client()
+            job = wait_for_job(client, upload(client, filename, content, session_id)['job_id'])
+            if job['stage'] != 'done':
+                print(f"Ingest of {filename} failed: {job.get('error')}")
+            return job['stage'] == 'done'
+        return run
+
+    stats = run_load(
+        [call(name, content, f"bench-upload-{i}") for i, (name, content) in enumerate(pdfs)],
+        concurrency
+    )
+    stats['pages_per_s'] = round(pages * (stats['requests'] - stats['errors']) / stats['wall_s'], 2)
+    return stats, pdfs[0]
+
+
+def bind_sessions(app, pdf, count):
+    """Point count benchmark sessions at an already indexed PDF"""
+    filename, content = pdf
+    client = app.app.test_client()
+    session_ids = [f"bench-worker-{i}" for i in range(count)]
+    for session_id in session_ids:
+        upload(client, filename, content, session_id)
+    return session_ids
+
+
+def bench_query(app, session_ids, requests_count, use_cache):
+    def call(i):
+        def run():
+            response = app.app.test_client().post(
+                '/query',
+                json={'question': QUESTIONS[i % len(QUESTIONS)], 'bypass_cache': not use_cache},
+                headers={'X-Session-ID': session_ids[i % len(session_ids)]}
+            )
+            return response.status_code == 200
+        return run
+
+    return run_load([call(i) for i in range(requests_count)], len(session_ids))
+
+
+def bench_analyze(app, session_ids, requests_count, mode, use_cache):
+    def call(i):
+        def run():
+            response = app.app.test_client().post(
+                '/analyze_document',
+                json={'mode': mode, 'bypass_cache': not use_cache},
+                headers={'X-Session-ID': session_ids[i % len(session_ids)]}
+            )
+            return response.status_code == 200
+        return run
+
+    return run_load([call(i) for i in range(requests_count)], len(session_ids))
+
+
+def bench_http_query(base_url, session_ids, requests_count, concurrency, use_cache):
+    """POST /query over HTTP from concurrency clients at once, one request in flight per client"""
+    import httpx
+
+    async def run():
+        latencies = []
+        errors = 0
+        pending = iter(range(requests_count))
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=base_url, timeout=600, limits=limits) as client:
+            async def worker():
+                nonlocal errors
+                for i in pending:
+                    start = time.perf_counter()
+                    try:
+                        response = await client.post(
+                            '/query',
+                            json={'question': QUESTIONS[i % len(QUESTIONS)], 'bypass_cache': not use_cache},
+                            headers={'X-Session-ID': session_ids[i % len(session_ids)]}
+                        )
+                        ok = response.status_code == 200
+                    except httpx.HTTPError as e:
+                        print(f"Error in benchmark call: {str(e)}")
+                        ok = False
+                    if ok:
+                        latencies.append(time.perf_counter() - start)
+                    else:
+                        errors += 1
+
+            start = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            return latencies, errors, time.perf_counter() - start
+
+    latencies, errors, wall = asyncio.run(run())
+    return load_stats(requests_count, errors, concurrency, wall, latencies)
+
+
+def bench_serving(app, pdf, levels, threads, rounds, use_cache):
+    """
+    /query over HTTP at each concurrency level, served by the WSGI and the ASGI app.
+
+    Every client sends rounds requests. Rows are named serve_<mode>_c<level>.
+    """
+    session_ids = bind_sessions(app, pdf, max(levels))
+    rows = []
+    for mode, start_server in (('wsgi', lambda: serve_wsgi(app, threads)), ('asgi', serve_asgi)):
+        base_url, stop = start_server()
+        try:
+            for level in levels:
+                stats = bench_http_query(base_url, session_ids[:level], level * rounds, level, use_cache)
+                rows.append({'scenario': f'serve_{mode}_c{level}', **stats})
+                print(f"serve {mode} x{level}: {stats['throughput_rps']} req/s, "
+                      f"p95 {stats['latency_ms'].get('p95')} ms")
+        finally:
+            stop()
+    return rows
+
+
+# Run in a fresh interpreter: import the app, answer /health, wait for /ready
+STARTUP_PROBE = """
+import json, sys, time
+sys.path.insert(0, {backend_dir!r})
+import app
+imported = time.time()
+client = app.app.test_client()
+healthy_status = client.get('/health').status_code
+healthy = time.time()
+while client.get('/ready').status_code == 503:
+    time.sleep(0.01)
+ready = time.time()
+print(json.dumps({{
+    'ok': healthy_status == 200 and client.get('/ready').status_code == 200,
+    'import': imported,
+    'health': healthy,
+    'ready': ready
+}}))
+"""
+
+
+def bench_startup(workdir, runs):
+    """
+    Cold start of the app in new processes, in a directory with saved indexes.
+
+    Returns rows for the time to import app, to answer /health and to report
+    ready from /ready (warm-up done: heavy imports, clients, index preload),
+    each measured from the moment the process was spawned.
+    """
+    env = {**os.environ, 'WARMUP_ON_START': '1'}
+    probe = STARTUP_PROBE.format(backend_dir=BACKEND_DIR)
+    timings = {'import': [], 'health': [], 'ready': []}
+    errors = 0
+    for _ in range(runs):
+        # Wall clock, the timestamps are compared across processes
+        start = time.time()
+        proc = subprocess.run([sys.executable, '-c', probe], cwd=workdir, env=env,
+                              capture_output=True, text=True, timeout=600)
+        try:
+            measured = json.loads(proc.stdout.strip().splitlines()[-1])
+        except (ValueError, IndexError):
+            print(f"Startup probe failed: {proc.stderr[-500:]}")
+            errors += 1
+            continue
+        if not measured['ok']:
+            errors += 1
+            continue
+        for name in timings:
+            timings[name].append(measured[name] - start)
+
+    return [{
+        'scenario': f'startup_{name}',
+        'pages': 0,
+        'requests': runs,
+        'errors': errors,
+        'concurrency': 1,
+        'wall_s': round(sum(values), 3),
+        'throughput_rps': None,
+        'latency_ms': percentiles(values)
+    } for name, values in timings.items()]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    print(f"\n{'scenario':<15} {'pages':>6} {'reqs':>5} {'errs':>5} {'rps':>8} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for row in results:
+        latency = row['latency_ms']
+        print(f"{row['scenario']:<15} {row['pages']:>6} {row['requests']:>5} {row['errors']:>5} "
+              f"{row['throughput_rps'] or '-':>8} {latency.get('p50', '-'):>9} {latency.get('p95', '-'):>9} "
+              f"{latency.get('p99', '-'):>9} {latency.get('max', '-'):>9}")
+
+
+def compare(results, baseline_path):
+    """Print the change of throughput and p50/p95 latency against a saved run"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(row['scenario'], row['pages']): row for row in baseline['results']}
+
+    print(f"\nCompared to {baseline_path} (commit {baseline.get('commit') or 'unknown'})")
+    print(f"{'scenario':<15} {'pages':>6} {'rps':>9} {'p50':>9} {'p95':>9}")
+    for row in results:
+        old = previous.get((row['scenario'], row['pages']))
+        if old is None:
+            continue
+
+        def change(new, before):
+            if not new or not before:
+                return '-'
+            return f"{(new - before) / before * 100:+.1f}%"
+
+        print(f"{row['scenario']:<15} {row['pages']:>6} "
+              f"{change(row['throughput_rps'], old['throughput_rps']):>9} "
+              f"{change(row['latency_ms'].get('p50'), old['latency_ms'].get('p50')):>9} "
+              f"{change(row['latency_ms'].get('p95'), old['latency_ms'].get('p95')):>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark with stub LLM and embedder")
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 100], help="Page counts of the synthetic PDFs")
+    parser.add_argument("--docs", type=int, default=4, help="PDFs uploaded per page count")
+    parser.add_argument("--concurrency", "-c", type=int, default=4, help="Concurrent clients")
+    parser.add_argument("--queries", type=int, default=40, help="/query requests per page count")
+    parser.add_argument("--analyses", type=int, default=8, help="/analyze_document requests per page count")
+    parser.add_argument("--mode", default="concurrent", help="Analysis mode")
+    parser.add_argument("--analysis-cache", action="store_true", help="Let /analyze_document serve cached results")
+    parser.add_argument("--answer-cache", action="store_true", help="Let /query serve cached answers")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Stub LLM seconds per call")
+    parser.add_argument("--llm-token-latency", type=float, default=0.0, help="Stub LLM seconds per output token")
+    parser.add_argument("--embed-latency", type=float, default=0.002, help="Stub embedder seconds per text")
+    parser.add_argument("--embedding-dim", type=int, default=768, help="Stub embedding size")
+    parser.add_argument("--embed-http", action="store_true",
+                        help="Embed through the Ollama client against a local stub HTTP server")
+    parser.add_argument("--embed-request-latency", type=float, default=0.005,
+                        help="--embed-http: stub server seconds per request")
+    parser.add_argument("--embed-server-slots", type=int, default=4,
+                        help="--embed-http: requests the stub server handles at once")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic PDF text")
+    parser.add_argument("--output", "-o", help="Save results as JSON")
+    parser.add_argument("--compare", help="JSON of an earlier run to compare against")
+    parser.add_argument("--startup", type=int, default=3,
+                        help="Cold starts measured in new processes after the load scenarios (0 to skip)")
+    parser.add_argument("--serve", type=int, nargs="*", default=[],
+                        help="Concurrent clients of the HTTP serving load test, e.g. 1 10 50 100 200")
+    parser.add_argument("--serve-threads", type=int, default=8,
+                        help="Threads of the WSGI server the ASGI app is compared against")
+    parser.add_argument("--serve-rounds", type=int, default=2, help="/query requests per client in --serve")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch directory")
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.compare) if args.compare else None
+    workdir = tempfile.mkdtemp(prefix="codeguardians-bench-")
+    app = load_app(workdir, args)
+
+    results = []
+    try:
+        for pages in args.pages:
+            print(f"\n=== {pages} pages ===")
+            stats, pdf = bench_upload(app, pages, args.docs, args.concurrency, args.seed + pages * 1000)
+            results.append({'scenario': 'upload', 'pages': pages, **stats})
+            print(f"upload: {stats['wall_s']}s, {stats['pages_per_s']} pages/s")
+
+            session_ids = bind_sessions(app, pdf, args.concurrency)
+
+            stats = bench_query(app, session_ids, args.queries, args.answer_cache)
+            results.append({'scenario': 'query', 'pages': pages, **stats})
+            print(f"query: {stats['throughput_rps']} req/s")
+
+            stats = bench_analyze(app, session_ids, args.analyses, args.mode, args.analysis_cache)
+            results.append({'scenario': 'analyze', 'pages': pages, **stats})
+            print(f"analyze: {stats['throughput_rps']} req/s")
+
+            if args.serve:
+                rows = bench_serving(app, pdf, args.serve, args.serve_threads, args.serve_rounds, args.answer_cache)
+                results.extend({**row, 'pages': pages} for row in rows)
+
+        if args.startup:
+            print(f"\n=== startup ({args.startup} runs) ===")
+            results.extend(bench_startup(workdir, args.startup))
+    finally:
+        os.chdir(cwd)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_results(results)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'settings': {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'keep')},
+        'results': results
+    }
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults saved to {output}")
+    if baseline:
+        compare(results, baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import json
+import os
+import re
+
+# Bump when the extraction rules change, so cached analyses are recomputed
+EXTRACTOR_VERSION = 1
+TABLES_FILE = "cfr_tables.json"
+TARGET_COLUMNS = 5
+TREND_COLUMNS = 5
+
+_SECTION_2 = re.compile(r"inter\s*-?\s*se\s+priorit", re.IGNORECASE)
+_SECTION_3 = re.compile(r"trend\s+values", re.IGNORECASE)
+_SECTION_END = re.compile(
+    r"section\s*[4-9]\b|description\s+and\s+definition\s+of\s+success\s+indicators", re.IGNORECASE
+)
+
+_NUMBER = r"(?:\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}|\d[\d,]*(?:\.\d+)?\s?%?)"
+_MISSING = r"(?:-{1,2}|N\.?A\.?|nil)"
+_INDICATOR_ID = re.compile(
+    r"\[(\d{1,2})\.(\d{1,2})\.(\d{1,2})\]|(?<![\d.])(\d{1,2})\.(\d{1,2})\.(\d{1,2})(?![\d.])(?=\s+[A-Za-z])"
+)
+_ANY_ID = re.compile(r"\[\d{1,2}(?:\.\d{1,2}){0,2}\]")
+# An objective row: "[1] <objective> <weight>" followed by its first action "[1.1]"
+_OBJECTIVE = re.compile(r"\[(\d{1,2})\]\s+([^\[\]]+?)\s+(\d{1,3}(?:\.\d+)?)\s*%?\s+(?=\[\d{1,2}\.\d{1,2}\])")
+_TRAILING_TARGETS = re.compile(
+    rf"^(.*?)\s+({_NUMBER})\s+((?:{_NUMBER}\s+){{{TARGET_COLUMNS - 1}}}{_NUMBER})\s*$"
+)
+_TREND_CELL = re.compile(rf"^(?:{_NUMBER}|{_MISSING})$", re.IGNORECASE)
+
+UNITS = (
+    'rs. crore', 'rs crore', 'crore', 'lakh', 'percentage', '%', 'number', 'no.', 'nos.', 'date',
+    'km', 'kms', 'hectare', 'ha', 'mw', 'tonnes', 'mt', 'days', 'months', 'index', 'ratio'
+)
+
+# Keywords of success indicators by what they measure, checked in this order
+MEASUREMENT_KEYWORDS = (
+    ('input', ('fund released', 'funds released', 'expenditure', 'budget', 'allocation', 'utilisation of funds')),
+    ('process', ('date', 'approval', 'notified', 'notification', 'launch', 'issue of', 'finalisation',
+                 'finalization', 'framing', 'constitution of', 'sanction')),
+    ('internal_output', ('report', 'meeting', 'training', 'workshop', 'guidelines', 'review', 'inspection',
+                         'survey conducted', 'proposal')),
+    ('outcome', ('reduction', 'increase in', 'decrease in', 'rate', 'coverage', 'access', 'literacy',
+                 'mortality', 'income', 'yield', 'satisfaction', 'employment generated', 'share of')),
+)
+
+
+def _clean(text):
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _to_number(token):
+    token = token.strip().rstrip('%').replace(',', '').strip()
+    try:
+        return float(token)
+    except ValueError:
+        # Dates and other non-numeric targets are kept as text
+        return token
+
+
+def classify_measurement(indicator):
+    """Kind of result a success indicator measures: outcome, external_output, internal_output, process or input"""
+    text = indicator.lower()
+    for kind, keywords in MEASUREMENT_KEYWORDS:
+        if any(keyword in text for keyword in keywords):
+            return kind
+    # Counts of things delivered to citizens (houses built, km of roads, beneficiaries)
+    return 'external_output'
+
+
+def _split_unit(text):
+    lowered = text.lower()
+    for unit in UNITS:
+        if lowered.endswith(' ' + unit) or lowered == unit:
+            return _clean(text[:len(text) - len(unit)]), text[len(text) - len(unit):].strip()
+    return text, None
+
+
+def _indicator_segments(text):
+    """(indicator ID, text up to the next numbered row) for every success indicator in text"""
+    matches = list(_INDICATOR_ID.finditer(text))
+    segments = []
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        next_id = _ANY_ID.search(text, match.end(), end)
+        if next_id is not None:
+            end = next_id.start()
+        groups = [g for g in match.groups() if g is not None]
+        segments.append(('.'.join(groups), _clean(text[match.end():end])))
+    return segments
+
+
+def parse_priorities(text):
+    """Objectives and success indicators of the Section 2 table"""
+    text = _clean(text)
+    objectives = {
+        match.group(1): {'id': match.group(1), 'objective': _clean(match.group(2)), 'weight': float(match.group(3))}
+        for match in _OBJECTIVE.finditer(text)
+    }
+
+    indicators = []
+    for indicator_id, segment in _indicator_segments(text):
+        match = _TRAILING_TARGETS.match(segment)
+        if match is None:
+            continue
+        description, unit = _split_unit(match.group(1))
+        weight = _to_number(match.group(2))
+        indicators.append({
+            'id': indicator_id,
+            'objective_id': indicator_id.split('.')[0],
+            'indicator': description,
+            'unit': unit,
+            'weight': weight if isinstance(weight, float) else None,
+            'targets': [_to_number(token) for token in re.findall(_NUMBER, match.group(3))],
+            'measurement': classify_measurement(description)
+        })
+
+    # Numbered indicators without bracketed objective rows still tell the objectives apart
+    for indicator in indicators:
+        objectives.setdefault(indicator['objective_id'], {
+            'id': indicator['objective_id'], 'objective': None, 'weight': None
+        })
+    return {'objectives': list(objectives.values()), 'indicators': indicators}
+
+
+def parse_trend_values(text):
+    """Trend value rows of the Section 3 table, missing cells as None"""
+    rows = []
+    for indicator_id, segment in _indicator_segments(_clean(text)):
+        tokens = segment.split(' ')
+        cells = []
+        while tokens and len(cells) < TREND_COLUMNS and _TREND_CELL.match(tokens[-1]):
+            cells.insert(0, tokens.pop())
+        values = [value if isinstance(value, float) else None for value in map(_to_number, cells)]
+        description, unit = _split_unit(' '.join(tokens))
+        rows.append({
+            'id': indicator_id,
+            'indicator': description,
+            'unit': unit,
+            # Cells left empty in the PDF leave no text at all
+            'values': [None] * (TREND_COLUMNS - len(values)) + values
+        })
+    return rows
+
+
+class CfrTableExtractor:
+    """
+    Collects the text of the CFR Sections 2 and 3 page by page and parses their tables.
+
+    Section 2 (inter se priorities) lists objectives with their weights and,
+    per action, success indicators with a unit, a weight and five targets
+    (Excellent to Poor). Section 3 lists the trend values of the same success
+    indicators over five years. Rows are recognised by the numbering of the
+    framework: [1] objective, [1.1] action, [1.1.1] success indicator.
+    Only the lines inside those sections are kept, so pages can be fed while
+    a large PDF is streamed through ingest.
+    """
+
+    def __init__(self):
+        self._section = None
+        self._lines = {'priorities': [], 'trend_values': []}
+        self.pages = {'priorities': set(), 'trend_values': set()}
+
+    def add_page(self, text, page_number=None):
+        for line in text.splitlines():
+            if _SECTION_END.search(line):
+                self._section = None
+            elif _SECTION_3.search(line):
+                self._section = 'trend_values'
+                continue
+            elif _SECTION_2.search(line):
+                self._section = 'priorities'
+                continue
+            if self._section is not None:
+                self._lines[self._section].append(line)
+                if page_number is not None:
+                    self.pages[self._section].add(page_number)
+
+    def result(self):
+        priorities = parse_priorities('\n'.join(self._lines['priorities']))
+        return {
+            'version': EXTRACTOR_VERSION,
+            'objectives': priorities['objectives'],
+            'indicators': priorities['indicators'],
+            'trend_values': parse_trend_values('\n'.join(self._lines['trend_values'])),
+            'pages': {section: sorted(pages) for section, pages in self.pages.items()}
+        }
+
+
+def save_tables(folder, tables):
+    path = os.path.join(folder, TABLES_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(tables, f)
+    os.replace(tmp_path, path)
+
+
+def load_tables(folder):
+    """Tables extracted at ingest, None for documents indexed before extraction existed"""
+    try:
+        with open(os.path.join(folder, TABLES_FILE)) as f:
+            tables = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return tables if tables.get('version') == EXTRACTOR_VERSION else None
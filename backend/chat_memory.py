@@ -0,0 +1,103 @@
+import threading
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+
+def approx_tokens(text):
+    """Cheap token estimate (about four characters per token for English text)"""
+    return len(text) // 4 + 1
+
+
+class ConversationMemory:
+    """
+    Chat history kept within a token budget.
+
+    The most recent turns are kept verbatim. When they exceed token_budget the
+    oldest turns are moved out of the window and folded into a rolling summary
+    by summarize(summary, messages), on executor when one is given so the
+    request that overflowed the budget does not wait for it. Until the summary
+    is updated the moved turns are still sent verbatim; if summarize() fails they
+    stay pending and folding is retried after the next turn.
+    """
+
+    def __init__(self, token_budget=2000, summarize=None, executor=None, count_tokens=approx_tokens):
+        self.token_budget = token_budget
+        self.summarize = summarize
+        self.executor = executor
+        self.count_tokens = count_tokens
+        self.summary = ''
+        self.messages = []
+        self._pending = []
+        self._compacting = False
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending) + len(self.messages)
+
+    def history(self):
+        """Messages to pass as chat_history: summary, pending turns, recent window"""
+        with self._lock:
+            history = []
+            if self.summary:
+                history.append(SystemMessage(content=f"Summary of the earlier conversation: {self.summary}"))
+            return history + self._pending + self.messages
+
+    def add_turn(self, question, answer):
+        with self._lock:
+            self.messages.extend([
+                HumanMessage(content=question),
+                AIMessage(content=answer)
+            ])
+            self._trim()
+
+    def clear(self):
+        with self._lock:
+            self.summary = ''
+            self.messages = []
+            self._pending = []
+
+    def _window_tokens(self):
+        return self.count_tokens(self.summary) + sum(self.count_tokens(m.content) for m in self.messages)
+
+    def _trim(self):
+        # Always keep the latest turn, even if it alone exceeds the budget
+        while len(self.messages) > 2 and self._window_tokens() > self.token_budget:
+            self._pending.extend(self.messages[:2])
+            self.messages = self.messages[2:]
+
+        if not self._pending:
+            return
+        if self.summarize is None:
+            self._pending = []
+        elif not self._compacting:
+            self._compacting = True
+            if self.executor is not None:
+                self.executor.submit(self._compact)
+            else:
+                self._compact()
+
+    def _compact(self):
+        """Fold the pending turns into the summary"""
+        while True:
+            with self._lock:
+                pending = list(self._pending)
+                summary = self.summary
+                if not pending:
+                    self._compacting = False
+                    return
+
+            try:
+                new_summary = self.summarize(summary, pending)
+            except Exception as e:
+                print(f"Error summarizing chat history: {str(e)}")
+                # Keep the turns pending (still sent verbatim); the next add_turn retries
+                with self._lock:
+                    self._compacting = False
+                return
+
+            with self._lock:
+                # The history may have been cleared while summarizing
+                if self._pending[:len(pending)] == pending:
+                    self._pending = self._pending[len(pending):]
+                    self.summary = new_summary.strip()
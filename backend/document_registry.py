@@ -0,0 +1,266 @@
+import base64
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+ANALYSIS_STATUSES = ('not_analyzed', 'analyzed', 'failed')
+
+# Sort keys of list(), named like the fields of the listed documents
+SORT_COLUMNS = {
+    'uploadDate': 'uploaded_at',
+    'filename': 'filename',
+    'size': 'size',
+    'chunks': 'chunks'
+}
+
+
+class InvalidCursor(ValueError):
+    """A page cursor that was not produced by the same sort"""
+
+
+class DocumentRegistry:
+    """
+    Persistent registry of processed documents, listed by the dashboard.
+
+    One SQLite row per document content hash with its filename, size, upload
+    time, chunk count, detected type and analysis status. Every sort key has
+    an index ending in the document ID, and one led by the analysis status
+    for filtered listings. Pages are read with keyset pagination: the cursor
+    of a page holds the sort value and ID of its last row, so any page costs
+    one index seek however deep into the list it is.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS documents (
+                doc_id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                uploaded_at REAL NOT NULL,
+                chunks INTEGER NOT NULL DEFAULT 0,
+                document_type TEXT,
+                analysis_status TEXT NOT NULL DEFAULT 'not_analyzed',
+                analyzed_at REAL
+            )"""
+        )
+        for column in SORT_COLUMNS.values():
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_documents_{column} ON documents ({column}, doc_id)"
+            )
+            # Pages filtered by status seek into that status instead of scanning every row
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_documents_status_{column} "
+                f"ON documents (analysis_status, {column}, doc_id)"
+            )
+        # Every name a document was uploaded under, each linked in the upload folder
+        has_files = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'document_files'"
+        ).fetchone()
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS document_files (
+                filename TEXT PRIMARY KEY,
+                doc_id TEXT NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_document_files_doc_id ON document_files (doc_id)")
+        if not has_files:
+            # Registries created before the table knew one name per document
+            self._conn.execute(
+                "INSERT OR IGNORE INTO document_files (filename, doc_id) SELECT filename, doc_id FROM documents"
+            )
+        self._conn.commit()
+
+    def register(self, doc_id, filename, size, chunks, uploaded_at=None):
+        """Add a processed document, or update the size and chunk count of a known one (which keeps its name)"""
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO documents (doc_id, filename, size, uploaded_at, chunks) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (doc_id) DO UPDATE SET size = excluded.size, chunks = excluded.chunks""",
+                (doc_id, filename, size, uploaded_at or time.time(), chunks)
+            )
+            self._conn.execute(
+                "INSERT OR IGNORE INTO document_files (filename, doc_id) VALUES (?, ?)", (filename, doc_id)
+            )
+            self._conn.commit()
+
+    def add_file(self, doc_id, filename):
+        """Record that filename in the upload folder now holds doc_id, replacing the document it held before"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO document_files (filename, doc_id) VALUES (?, ?)", (filename, doc_id)
+            )
+            self._conn.commit()
+
+    def files(self, doc_id):
+        """Names doc_id was uploaded under that still hold it"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT filename FROM document_files WHERE doc_id = ? ORDER BY filename", (doc_id,)
+            ).fetchall()
+        return [filename for (filename,) in rows]
+
+    def file_document(self, filename):
+        """ID of the document uploaded under filename, None for names that were never uploaded"""
+        with self._lock:
+            row = self._conn.execute("SELECT doc_id FROM document_files WHERE filename = ?", (filename,)).fetchone()
+        return row[0] if row else None
+
+    def backfill(self, entries):
+        """
+        Add documents indexed before the registry existed.
+
+        Args:
+            entries (iterable): (doc_id, filename, size, chunks, uploaded_at) tuples;
+                documents already registered are left unchanged
+
+        Returns:
+            int: Number of documents added
+        """
+        entries = list(entries)
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO documents (doc_id, filename, size, chunks, uploaded_at) VALUES (?, ?, ?, ?, ?)",
+                entries
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO document_files (filename, doc_id) VALUES (?, ?)",
+                [(filename, doc_id) for doc_id, filename, *_ in entries]
+            )
+            self._conn.commit()
+            return self._conn.total_changes - before
+
+    def set_document_type(self, doc_id, document_type):
+        with self._lock:
+            self._conn.execute("UPDATE documents SET document_type = ? WHERE doc_id = ?", (document_type, doc_id))
+            self._conn.commit()
+
+    def record_analysis(self, doc_id, succeeded=True):
+        """Mark a document analyzed, or failed unless an earlier analysis of it succeeded"""
+        with self._lock:
+            if succeeded:
+                self._conn.execute(
+                    "UPDATE documents SET analysis_status = 'analyzed', analyzed_at = ? WHERE doc_id = ?",
+                    (time.time(), doc_id)
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE documents SET analysis_status = 'failed' "
+                    "WHERE doc_id = ? AND analysis_status != 'analyzed'",
+                    (doc_id,)
+                )
+            self._conn.commit()
+
+    def get(self, doc_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+            self._conn.execute("DELETE FROM document_files WHERE doc_id = ?", (doc_id,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM documents")
+            self._conn.execute("DELETE FROM document_files")
+            self._conn.commit()
+
+    def count(self):
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()
+        return count
+
+    def list(self, sort='uploadDate', order='desc', limit=100, cursor=None, analysis_status=None):
+        """
+        One page of documents.
+
+        Args:
+            sort (str): One of SORT_COLUMNS
+            order (str): 'asc' or 'desc'
+            limit (int): Documents per page
+            cursor (str): next_cursor of the previous page, None for the first page
+            analysis_status (str): Only documents with this status (one of ANALYSIS_STATUSES)
+
+        Returns:
+            tuple: (documents, next_cursor), next_cursor is None on the last page
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Unknown sort '{sort}'. Use one of: {', '.join(SORT_COLUMNS)}")
+        if order not in ('asc', 'desc'):
+            raise ValueError("order must be 'asc' or 'desc'")
+        if analysis_status is not None and analysis_status not in ANALYSIS_STATUSES:
+            raise ValueError(f"Unknown analysis status '{analysis_status}'. Use one of: {', '.join(ANALYSIS_STATUSES)}")
+        column = SORT_COLUMNS[sort]
+
+        where, params = [], []
+        if analysis_status is not None:
+            where.append("analysis_status = ?")
+            params.append(analysis_status)
+        if cursor is not None:
+            value, doc_id = self._decode_cursor(cursor, sort)
+            # Row values compare column first, then ID, matching the index order
+            where.append(f"({column}, doc_id) {'<' if order == 'desc' else '>'} (?, ?)")
+            params.extend([value, doc_id])
+        direction = order.upper()
+        query = (
+            "SELECT * FROM documents"
+            + (f" WHERE {' AND '.join(where)}" if where else "")
+            + f" ORDER BY {column} {direction}, doc_id {direction} LIMIT ?"
+        )
+
+        with self._lock:
+            rows = self._conn.execute(query, params + [limit + 1]).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = self._encode_cursor(sort, last[self._column_index(column)], last[0])
+        return [self._to_dict(row) for row in rows], next_cursor
+
+    @staticmethod
+    def _column_index(column):
+        return ('doc_id', 'filename', 'size', 'uploaded_at', 'chunks').index(column)
+
+    @staticmethod
+    def _encode_cursor(sort, value, doc_id):
+        payload = json.dumps([sort, value, doc_id]).encode('utf-8')
+        return base64.urlsafe_b64encode(payload).decode('ascii')
+
+    @staticmethod
+    def _decode_cursor(cursor, sort):
+        try:
+            cursor_sort, value, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        except (ValueError, TypeError):
+            raise InvalidCursor("Invalid cursor")
+        if cursor_sort != sort:
+            raise InvalidCursor(f"Cursor belongs to a listing sorted by '{cursor_sort}'")
+        return value, doc_id
+
+    @staticmethod
+    def _to_dict(row):
+        doc_id, filename, size, uploaded_at, chunks, document_type, analysis_status, analyzed_at = row
+        return {
+            '_id': doc_id,
+            'filename': filename,
+            'filePath': f'/uploads/{filename}',
+            'uploadDate': datetime.fromtimestamp(uploaded_at).isoformat(),
+            'size': size,
+            'chunks': chunks,
+            'documentType': document_type,
+            'analysisStatus': analysis_status,
+            'analyzedAt': datetime.fromtimestamp(analyzed_at).isoformat() if analyzed_at else None
+        }
@@ -0,0 +1,178 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper with a persistent, size-bounded chunk cache.
+
+    Vectors are stored in SQLite keyed by (embedding model, SHA-256 of the chunk
+    text). Only the texts that miss the cache are sent to the wrapped embeddings
+    in one call. The cache size is a running count taken when the cache
+    opens; once it passes max_entries the rows are counted exactly and the
+    least recently used ones evicted down to 95% of max_entries, so stores
+    never scan the table. Query embeddings are only remembered in memory for
+    the last max_queries queries, so the answer cache lookup and the
+    retrieval of the same question share one embedding call.
+    """
+
+    def __init__(self, embeddings, cache_path, max_entries=200000, max_queries=256):
+        self.embeddings = embeddings
+        # Clients whose vectors depend on more than the model name provide a cache_key
+        self.model = getattr(embeddings, 'cache_key', None) or getattr(embeddings, 'model', type(embeddings).__name__)
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.max_queries = max_queries
+        self._queries = OrderedDict()
+        self._lock = threading.Lock()
+
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings (last_access)"
+        )
+        self._conn.commit()
+        (self._entries,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+
+    @staticmethod
+    def text_hash(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _lookup(self, hashes):
+        """Fetch cached vectors for the given hashes and refresh their recency"""
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        # Stay well below SQLite's limit on bound parameters
+        for i in range(0, len(unique), 500):
+            batch = unique[i:i + 500]
+            placeholders = ','.join('?' * len(batch))
+            rows = self._conn.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                [self.model, *batch]
+            ).fetchall()
+            for text_hash, blob in rows:
+                vector = array('d')
+                vector.frombytes(blob)
+                found[text_hash] = vector.tolist()
+
+        if found:
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE model = ? AND text_hash = ?",
+                [(now, self.model, text_hash) for text_hash in found]
+            )
+            self._conn.commit()
+        return found
+
+    def _store(self, vectors_by_hash):
+        """Insert new vectors and evict the least recently used overflow"""
+        now = time.time()
+        before = self._conn.total_changes
+        # A vector stored meanwhile by another process is the same vector
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO embeddings (model, text_hash, vector, last_access) VALUES (?, ?, ?, ?)",
+            [
+                (self.model, text_hash, array('d', vector).tobytes(), now)
+                for text_hash, vector in vectors_by_hash.items()
+            ]
+        )
+        self._entries += self._conn.total_changes - before
+        if self._entries > self.max_entries:
+            # Other processes sharing the file also add rows: count exactly before evicting
+            (self._entries,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            overflow = self._entries - (self.max_entries - self.max_entries // 20)
+            if self._entries > self.max_entries and overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE rowid IN "
+                    "(SELECT rowid FROM embeddings ORDER BY last_access LIMIT ?)",
+                    (overflow,)
+                )
+                self._entries -= overflow
+                self.evictions += overflow
+        self._conn.commit()
+
+    def embed_documents(self, texts):
+        hashes = [self.text_hash(text) for text in texts]
+        with self._lock:
+            cached = self._lookup(hashes)
+
+        missing = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in cached and text_hash not in missing:
+                missing[text_hash] = text
+
+        computed = {}
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+            if computed:
+                self._store(computed)
+
+        return [cached[h] if h in cached else computed[h] for h in hashes]
+
+    def _recent_query(self, text):
+        with self._lock:
+            vector = self._queries.get(text)
+            if vector is not None:
+                self._queries.move_to_end(text)
+            return vector
+
+    def _remember_query(self, text, vector):
+        with self._lock:
+            self._queries[text] = vector
+            while len(self._queries) > self.max_queries:
+                self._queries.popitem(last=False)
+
+    def embed_query(self, text):
+        vector = self._recent_query(text)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self._remember_query(text, vector)
+        return vector
+
+    async def aembed_query(self, text):
+        vector = self._recent_query(text)
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            self._remember_query(text, vector)
+        return vector
+
+    def stats(self):
+        """Hit/miss counters of this process and the cache size it counted"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'model': self.model,
+                'entries': self._entries,
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
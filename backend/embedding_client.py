@@ -0,0 +1,297 @@
+import asyncio
+import copy
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from langchain_core.embeddings import Embeddings
+
+from metrics import metrics, record_stage
+
+# Ollama endpoints: /api/embed takes a list of texts per request and returns
+# L2-normalized vectors, the older /api/embeddings takes one text per request
+# and returns raw vectors. Indexes must be queried with the endpoint that
+# built them.
+EMBED_APIS = ('embed', 'embeddings')
+
+
+def embedding_space(model, api):
+    """Name of the vector space of a model and endpoint, recorded with every index built in it"""
+    return model if api == 'embeddings' else f"{model}@api/embed"
+
+
+def parse_embedding_space(space):
+    """(model, api) of a name returned by embedding_space()"""
+    model, _, api = space.partition('@api/')
+    return model, api or 'embeddings'
+
+# Worth retrying: the server is overloaded, restarting or the model is loading
+RETRY_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+
+class TransientEmbeddingError(Exception):
+    """A failed embedding request that may succeed when retried"""
+
+
+class AdaptiveBatchSize:
+    """
+    Texts per embedding request, adapted to the observed request latency.
+
+    Grows by a quarter after every full batch that finished within
+    target_latency seconds, shrinks proportionally when a batch took longer
+    and halves after a failure, always staying within [minimum, maximum].
+    """
+
+    def __init__(self, initial=32, minimum=1, maximum=256, target_latency=2.0):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self._size = max(minimum, min(maximum, initial))
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        with self._lock:
+            return self._size
+
+    def success(self, batch_size, seconds):
+        with self._lock:
+            if seconds > self.target_latency:
+                scaled = int(batch_size * self.target_latency / seconds)
+                self._size = max(self.minimum, min(self._size, scaled))
+            elif batch_size >= self._size:
+                # Only full batches show whether a larger one would still be fast
+                self._size = min(self.maximum, self._size + max(1, self._size // 4))
+
+    def failure(self):
+        with self._lock:
+            self._size = max(self.minimum, self._size // 2)
+
+
+class OllamaEmbeddingClient(Embeddings):
+    """
+    Ollama embeddings over a persistent connection pool with concurrent requests.
+
+    embed_documents() splits the texts into batches sized by an
+    AdaptiveBatchSize and sends them from a pool of concurrency threads. At
+    most concurrency requests (batches and queries, of every caller and of
+    the clients made by with_api()) are in flight at once, so concurrent
+    uploads do not overload the server. Connection errors, timeouts and 408/429/5xx responses are retried
+    with exponential backoff and jitter, other errors are raised right away.
+    aembed_query() sends the query over an httpx.AsyncClient, so the async
+    server waits for it without holding a thread.
+    """
+
+    def __init__(self, model="nomic-embed-text", base_url="http://localhost:11434", api='embed',
+                 concurrency=4, batch_size=32, min_batch_size=1, max_batch_size=256,
+                 target_latency=2.0, max_retries=4, backoff=0.5, timeout=120):
+        if api not in EMBED_APIS:
+            raise ValueError(f"Unknown Ollama embedding API '{api}'. Use one of: {', '.join(EMBED_APIS)}")
+        self.model = model
+        self.base_url = base_url.rstrip('/')
+        self.api = api
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.batch_size = AdaptiveBatchSize(batch_size, min_batch_size, max_batch_size, target_latency)
+        # Vectors of the two endpoints differ, so they are cached apart
+        self.cache_key = embedding_space(model, api)
+
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency + 1)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed")
+        # Taken by every request while it is in flight
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._async_client_lock = threading.Lock()
+        # [event loop, client]: an AsyncClient's connections belong to the loop that opened them
+        self._async_client = [None, None]
+
+    @classmethod
+    def from_env(cls, model="nomic-embed-text"):
+        return cls(
+            model=model,
+            base_url=os.getenv("OLLAMA_BASE_URL", "http://localhost:11434"),
+            api=os.getenv("OLLAMA_EMBED_API", "embed"),
+            concurrency=int(os.getenv("EMBED_CONCURRENCY", "4")),
+            batch_size=int(os.getenv("EMBED_BATCH_SIZE", "32")),
+            max_batch_size=int(os.getenv("EMBED_MAX_BATCH_SIZE", "256")),
+            target_latency=float(os.getenv("EMBED_TARGET_LATENCY", "2.0")),
+            max_retries=int(os.getenv("EMBED_MAX_RETRIES", "4"))
+        )
+
+    def with_api(self, api):
+        """
+        A client that sends the same model to another endpoint. It shares this
+        client's connections, request slots and batch size; only its counters
+        are its own.
+        """
+        if api not in EMBED_APIS:
+            raise ValueError(f"Unknown Ollama embedding API '{api}'. Use one of: {', '.join(EMBED_APIS)}")
+        client = copy.copy(self)
+        client.api = api
+        client.cache_key = embedding_space(self.model, api)
+        client.requests = client.retries = client.failures = client.in_flight = 0
+        client._lock = threading.Lock()
+        return client
+
+    @staticmethod
+    def _checked(response):
+        if response.status_code in RETRY_STATUS_CODES:
+            raise TransientEmbeddingError(
+                f"Embedding server returned HTTP {response.status_code}: {response.text[:200]}"
+            )
+        if response.status_code != 200:
+            raise ValueError(f"Embedding server returned HTTP {response.status_code}: {response.text[:200]}")
+        return response.json()
+
+    def _post(self, path, payload):
+        try:
+            response = self._session.post(f"{self.base_url}{path}", json=payload, timeout=self.timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise TransientEmbeddingError(f"Embedding request failed: {e}")
+        return self._checked(response)
+
+    def _client(self):
+        loop = asyncio.get_running_loop()
+        with self._async_client_lock:
+            client_loop, client = self._async_client
+            if client_loop is not loop:
+                client = httpx.AsyncClient(
+                    timeout=self.timeout,
+                    limits=httpx.Limits(max_connections=self.concurrency + 1)
+                )
+                self._async_client[:] = [loop, client]
+            return client
+
+    async def _apost(self, path, payload):
+        try:
+            response = await self._client().post(f"{self.base_url}{path}", json=payload)
+        except httpx.TransportError as e:
+            raise TransientEmbeddingError(f"Embedding request failed: {e}")
+        return self._checked(response)
+
+    def _request(self, texts):
+        if self.api == 'embed':
+            return self._post('/api/embed', {'model': self.model, 'input': texts})['embeddings']
+        return [self._post('/api/embeddings', {'model': self.model, 'prompt': text})['embedding'] for text in texts]
+
+    async def _arequest(self, texts):
+        if self.api == 'embed':
+            return (await self._apost('/api/embed', {'model': self.model, 'input': texts}))['embeddings']
+        return [(await self._apost('/api/embeddings', {'model': self.model, 'prompt': text}))['embedding']
+                for text in texts]
+
+    def _attempt_started(self):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+
+    def _attempt_ended(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _succeeded(self, texts, seconds, adapt):
+        if adapt:
+            self.batch_size.success(len(texts), seconds)
+        record_stage('embed.request', seconds)
+        metrics.inc('embedding_requests_total', outcome='ok')
+
+    def _failed(self, error, attempt, adapt):
+        """Count a failed attempt; returns the delay before retrying, raises once retries are exhausted"""
+        if adapt:
+            self.batch_size.failure()
+        if attempt == self.max_retries:
+            with self._lock:
+                self.failures += 1
+            metrics.inc('embedding_requests_total', outcome='failed')
+            raise RuntimeError(f"{error} (gave up after {attempt + 1} attempts)")
+        with self._lock:
+            self.retries += 1
+        metrics.inc('embedding_requests_total', outcome='retried')
+        return self.backoff * 2 ** attempt * (0.5 + random.random())
+
+    def _embed_batch(self, texts, adapt=True):
+        """Embed one batch, retrying transient failures"""
+        for attempt in range(self.max_retries + 1):
+            with self._slots:
+                self._attempt_started()
+                start = time.perf_counter()
+                try:
+                    vectors = self._request(texts)
+                except TransientEmbeddingError as e:
+                    delay = self._failed(e, attempt, adapt)
+                else:
+                    self._succeeded(texts, time.perf_counter() - start, adapt)
+                    return vectors
+                finally:
+                    self._attempt_ended()
+            time.sleep(delay)
+
+    async def _acquire_slot(self):
+        # Polled, so a cancelled request never holds a slot
+        while not self._slots.acquire(blocking=False):
+            await asyncio.sleep(0.005)
+
+    async def _aembed_batch(self, texts, adapt=True):
+        """_embed_batch for the event loop"""
+        for attempt in range(self.max_retries + 1):
+            await self._acquire_slot()
+            self._attempt_started()
+            start = time.perf_counter()
+            try:
+                vectors = await self._arequest(texts)
+            except TransientEmbeddingError as e:
+                delay = self._failed(e, attempt, adapt)
+            else:
+                self._succeeded(texts, time.perf_counter() - start, adapt)
+                return vectors
+            finally:
+                self._attempt_ended()
+                self._slots.release()
+            await asyncio.sleep(delay)
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        size = self.batch_size.size
+        batches = [texts[i:i + size] for i in range(0, len(texts), size)]
+        futures = [self._executor.submit(self._embed_batch, batch) for batch in batches]
+        try:
+            return [vector for future in futures for vector in future.result()]
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def embed_query(self, text):
+        # Single texts say nothing about how large a batch can be
+        return self._embed_batch([text], adapt=False)[0]
+
+    async def aembed_query(self, text):
+        return (await self._aembed_batch([text], adapt=False))[0]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'model': self.model,
+                'api': self.api,
+                'concurrency': self.concurrency,
+                'batch_size': self.batch_size.size,
+                'in_flight': self.in_flight,
+                'requests': self.requests,
+                'retries': self.retries,
+                'failures': self.failures
+            }
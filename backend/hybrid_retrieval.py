@@ -0,0 +1,201 @@
+import os
+import re
+from collections import Counter
+from typing import Any, Optional
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from metrics import metrics
+
+LEXICAL_INDEX_FILE = "lexical.npz"
+
+# Words, numbers and compounds such as "pmay-g", "2023-24" or "sdg-6.1"
+_TOKEN = re.compile(r"[a-z0-9]+(?:[-./][a-z0-9]+)*")
+# Acronyms and codes as written in the query: "NREGA", "PMAY-G", "FY24", "6.1"
+_IDENTIFIER = re.compile(r"^(?:[A-Z]{2,}[A-Z0-9]*|[A-Za-z]*\d[\w./-]*|[A-Za-z0-9]+(?:[-./][A-Za-z0-9]+)+)$")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by does for from has have how in is it its of on or "
+    "that the their this to was were what when where which who why will with "
+    "about any are can do give list me show tell there these those".split()
+)
+
+
+def tokenize(text):
+    """Lower-cased terms of text; compounds are kept whole and also split into their parts"""
+    terms = []
+    for token in _TOKEN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+        if not token.isalnum():
+            terms.extend(part for part in re.split(r"[-./]", token) if part and part not in STOPWORDS)
+    return terms
+
+
+def looks_like_identifier(query, max_terms=3):
+    """True for short queries made only of acronyms, codes and numbers, e.g. 'PMAY-G 2023-24'"""
+    words = [word.strip("?!,;:()'\"") for word in query.split()]
+    words = [word for word in words if word and word.lower() not in STOPWORDS]
+    return 0 < len(words) <= max_terms and all(_IDENTIFIER.match(word) for word in words)
+
+
+class BM25Index:
+    """
+    Okapi BM25 inverted index over the chunks of one document.
+
+    Postings are stored in CSR form (per term a slice of chunk positions and
+    term frequencies), so scoring a query is a few vectorized array operations.
+    Chunks are identified by their docstore IDs, the same IDs the FAISS store
+    uses.
+    """
+
+    def __init__(self, chunk_ids, terms, offsets, postings, frequencies, lengths, k1=1.2, b=0.75):
+        self.chunk_ids = list(chunk_ids)
+        self.terms = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.postings = postings
+        self.frequencies = frequencies
+        self.lengths = lengths
+        self.k1 = k1
+        self.b = b
+        self.avg_length = float(lengths.mean()) if len(lengths) and lengths.mean() > 0 else 1.0
+        document_frequency = np.diff(offsets).astype(np.float32)
+        n = len(self.chunk_ids)
+        self.idf = np.log1p((n - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+
+    @classmethod
+    def build(cls, chunk_ids, texts):
+        counts = [Counter(tokenize(text)) for text in texts]
+        terms = sorted({term for chunk in counts for term in chunk})
+        term_ids = {term: i for i, term in enumerate(terms)}
+
+        per_term = [[] for _ in terms]
+        for position, chunk in enumerate(counts):
+            for term, frequency in chunk.items():
+                per_term[term_ids[term]].append((position, frequency))
+
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(entries) for entries in per_term])
+        postings = np.fromiter((p for entries in per_term for p, _ in entries), dtype=np.int32, count=offsets[-1])
+        frequencies = np.fromiter((f for entries in per_term for _, f in entries), dtype=np.float32, count=offsets[-1])
+        lengths = np.array([sum(chunk.values()) for chunk in counts], dtype=np.float32)
+        return cls(chunk_ids, terms, offsets, postings, frequencies, lengths)
+
+    def save(self, folder):
+        path = os.path.join(folder, LEXICAL_INDEX_FILE)
+        tmp_path = f"{path}.tmp.npz"
+        terms = sorted(self.terms, key=self.terms.get)
+        np.savez(
+            tmp_path,
+            chunk_ids=np.array(self.chunk_ids, dtype=str),
+            terms=np.array(terms, dtype=str),
+            offsets=self.offsets,
+            postings=self.postings,
+            frequencies=self.frequencies,
+            lengths=self.lengths
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, folder):
+        with np.load(os.path.join(folder, LEXICAL_INDEX_FILE)) as data:
+            return cls(data['chunk_ids'].tolist(), data['terms'].tolist(), data['offsets'],
+                       data['postings'], data['frequencies'], data['lengths'])
+
+    def search(self, query, k=10):
+        """Top k (chunk ID, score) pairs for query, best first; chunks sharing no term are left out"""
+        term_ids = [self.terms[term] for term in set(tokenize(query)) if term in self.terms]
+        if not term_ids:
+            return []
+
+        scores = np.zeros(len(self.chunk_ids), dtype=np.float32)
+        norm = self.k1 * (1 - self.b + self.b * self.lengths / self.avg_length)
+        for term_id in term_ids:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            positions = self.postings[start:end]
+            frequencies = self.frequencies[start:end]
+            scores[positions] += self.idf[term_id] * frequencies * (self.k1 + 1) / (frequencies + norm[positions])
+
+        matched = np.flatnonzero(scores)
+        top = matched[np.argsort(-scores[matched], kind='stable')[:k]]
+        return [(self.chunk_ids[i], float(scores[i])) for i in top]
+
+
+def load_or_build_lexical_index(folder, store):
+    """The document's saved BM25 index, built from the FAISS docstore (and saved) when missing"""
+    if os.path.exists(os.path.join(folder, LEXICAL_INDEX_FILE)):
+        return BM25Index.load(folder)
+    chunk_ids = [store.index_to_docstore_id[i] for i in range(len(store.index_to_docstore_id))]
+    index = BM25Index.build(chunk_ids, [store.docstore.search(chunk_id).page_content for chunk_id in chunk_ids])
+    index.save(folder)
+    return index
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever fusing BM25 and FAISS MMR results with reciprocal rank fusion.
+
+    Queries that consist only of identifiers (scheme acronyms, indicator codes,
+    fiscal years) are answered from the lexical index alone, without embedding
+    the query, as long as it has matches.
+    """
+
+    store: Any
+    lexical: Any
+    k: int = 6
+    fetch_k: int = 10
+    rrf_k: int = 60
+    lexical_fast_path: bool = True
+
+    def _lexical_documents(self, hits):
+        documents = (self.store.docstore.search(chunk_id) for chunk_id, _ in hits)
+        # The docstore answers unknown IDs with a message instead of a Document
+        return [doc for doc in documents if isinstance(doc, Document)]
+
+    def _fuse(self, vector_docs, hits):
+        if not hits:
+            metrics.inc('retrievals_total', path='vector')
+            return vector_docs
+
+        metrics.inc('retrievals_total', path='hybrid')
+        scores = {}
+        documents = {}
+        for ranked in (vector_docs, self._lexical_documents(hits)):
+            for rank, doc in enumerate(ranked):
+                key = doc.id or doc.page_content
+                scores[key] = scores.get(key, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+                documents.setdefault(key, doc)
+        best = sorted(scores, key=scores.get, reverse=True)[:self.k]
+        return [documents[key] for key in best]
+
+    def answers_lexically(self, query):
+        """Whether query is answered from the lexical index alone, so it never needs an embedding"""
+        return self.lexical_fast_path and looks_like_identifier(query) and bool(self.lexical.search(query, 1))
+
+    def _lexical_fast_path(self, query, hits):
+        if self.lexical_fast_path and hits and looks_like_identifier(query):
+            metrics.inc('retrievals_total', path='lexical')
+            return self._lexical_documents(hits[:self.k])
+        return None
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun,
+                                **kwargs: Optional[Any]) -> list:
+        hits = self.lexical.search(query, self.fetch_k)
+        lexical_docs = self._lexical_fast_path(query, hits)
+        if lexical_docs is not None:
+            return lexical_docs
+        return self._fuse(self.store.max_marginal_relevance_search(query, k=self.k, fetch_k=self.fetch_k), hits)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun,
+                                       **kwargs: Optional[Any]) -> list:
+        # BM25 scoring is a few array operations, only the query embedding is awaited
+        hits = self.lexical.search(query, self.fetch_k)
+        lexical_docs = self._lexical_fast_path(query, hits)
+        if lexical_docs is not None:
+            return lexical_docs
+        vector_docs = await self.store.amax_marginal_relevance_search(query, k=self.k, fetch_k=self.fetch_k)
+        return self._fuse(vector_docs, hits)
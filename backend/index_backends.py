@@ -0,0 +1,224 @@
+import os
+import pickle
+import time
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+INDEX_TYPES = ('flat', 'ivf', 'ivfpq', 'hnsw')
+
+# PQ codebooks use 8 bits, i.e. 256 centroids per sub-quantizer
+PQ_MIN_TRAINING_POINTS = 256
+
+
+class IndexConfig:
+    """Which FAISS index serves searches and how it is built, searched and loaded"""
+
+    def __init__(self, index_type='flat', nlist=256, nprobe=16, hnsw_m=32,
+                 ef_search=64, pq_m=16, mmap=True):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{index_type}'. Use one of: {', '.join(INDEX_TYPES)}")
+        self.index_type = index_type
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self.pq_m = pq_m
+        self.mmap = mmap
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            index_type=os.getenv("FAISS_INDEX_TYPE", "flat"),
+            nlist=int(os.getenv("FAISS_IVF_NLIST", "256")),
+            nprobe=int(os.getenv("FAISS_NPROBE", "16")),
+            hnsw_m=int(os.getenv("FAISS_HNSW_M", "32")),
+            ef_search=int(os.getenv("FAISS_HNSW_EF_SEARCH", "64")),
+            pq_m=int(os.getenv("FAISS_PQ_M", "16")),
+            mmap=os.getenv("FAISS_MMAP", "1") == "1"
+        )
+
+
+def serving_index_path(folder, index_type):
+    """File of the approximate index built next to the exact index.faiss"""
+    return os.path.join(folder, f"index.{index_type}.faiss")
+
+
+def factory_spec(config, ntotal, dim):
+    """
+    FAISS index_factory string for config, adapted to the number of vectors.
+
+    Small indexes cannot train many IVF lists or PQ codebooks, so nlist is
+    reduced to what ntotal supports and PQ falls back to IVF-Flat (or Flat)
+    when there are too few vectors.
+    """
+    if config.index_type == 'hnsw':
+        return f"HNSW{config.hnsw_m},Flat"
+    if config.index_type == 'flat':
+        return "Flat"
+
+    # FAISS wants roughly 39 training points per IVF list
+    nlist = min(config.nlist, ntotal // 39)
+    if nlist < 2:
+        return "Flat"
+    if config.index_type == 'ivfpq' and ntotal >= PQ_MIN_TRAINING_POINTS:
+        pq_m = max(m for m in range(1, config.pq_m + 1) if dim % m == 0)
+        return f"IVF{nlist},PQ{pq_m}"
+    return f"IVF{nlist},Flat"
+
+
+def configure_search(index, config):
+    """Apply the search-time parameters of config to an index"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(config.nprobe, ivf.nlist)
+        # MMR search reconstructs vectors by ID
+        ivf.make_direct_map()
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = config.ef_search
+    return index
+
+
+def build_index(vectors, config):
+    """Train and fill an index of config's type, returns (index, factory spec)"""
+    ntotal, dim = vectors.shape
+    spec = factory_spec(config, ntotal, dim)
+    index = faiss.index_factory(dim, spec, faiss.METRIC_L2)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return configure_search(index, config), spec
+
+
+def read_index(path, mmap):
+    """Read an index, memory-mapped and read-only when supported"""
+    if mmap:
+        flags = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+        try:
+            return faiss.read_index(path, flags)
+        except RuntimeError as e:
+            print(f"Memory-mapped loading of {path} failed, reading it instead: {str(e)}")
+    return faiss.read_index(path)
+
+
+def read_vectors(folder):
+    """All vectors of a document's exact index, in insertion order"""
+    index = faiss.read_index(os.path.join(folder, "index.faiss"))
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def vectors_normalized(folder, sample=8):
+    """Whether the first vectors of a document's exact index have unit length"""
+    index = read_index(os.path.join(folder, "index.faiss"), mmap=True)
+    if index.ntotal == 0:
+        return False
+    vectors = index.reconstruct_n(0, min(sample, index.ntotal))
+    return bool(np.allclose(np.linalg.norm(vectors, axis=1), 1.0, atol=1e-3))
+
+
+def build_serving_index(folder, config, vectors=None):
+    """
+    Build the approximate index of config's type for a saved document index.
+
+    The exact index.faiss stays the source of truth; the approximate index is
+    written atomically next to it and uses the same positions, so the saved
+    docstore mapping applies to both.
+
+    Returns:
+        tuple: (index, factory spec), or (None, 'Flat') for the flat type
+    """
+    if config.index_type == 'flat':
+        return None, "Flat"
+    if vectors is None:
+        vectors = read_vectors(folder)
+    index, spec = build_index(np.ascontiguousarray(vectors, dtype='float32'), config)
+
+    path = serving_index_path(folder, config.index_type)
+    tmp_path = f"{path}.tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+    return index, spec
+
+
+def load_store(folder, embeddings, config):
+    """
+    Load a saved document index as a LangChain FAISS store.
+
+    Searches use the approximate index of the configured type when one was
+    built, the exact index otherwise. Indexes are memory-mapped read-only when
+    config.mmap is set, so worker processes share the pages.
+    """
+    with open(os.path.join(folder, "index.pkl"), 'rb') as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+
+    path = serving_index_path(folder, config.index_type)
+    if config.index_type == 'flat' or not os.path.exists(path):
+        path = os.path.join(folder, "index.faiss")
+    index = configure_search(read_index(path, config.mmap), config)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+
+def recall_report(vectors, config, k=6, n_queries=200, sweep=None, seed=0):
+    """
+    Measure recall@k and query latency of an approximate index against exact search.
+
+    Queries are stored vectors with small Gaussian noise added, a stand-in for
+    questions that land near document chunks. The search parameter (nprobe for
+    IVF types, efSearch for HNSW) is varied over sweep.
+
+    Returns:
+        list: One dict per setting with recall, mean/p95 latency (ms) and speedup
+    """
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    ntotal, dim = vectors.shape
+    k = min(k, ntotal)
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(ntotal, size=min(n_queries, ntotal), replace=False)
+    noise = rng.normal(scale=vectors.std() * 0.1, size=(len(picks), dim)).astype('float32')
+    queries = vectors[picks] + noise
+
+    exact = faiss.IndexFlatL2(dim)
+    exact.add(vectors)
+    exact_ids, exact_latencies = _timed_search(exact, queries, k)
+    exact_mean = float(np.mean(exact_latencies))
+
+    index, spec = build_index(vectors, config)
+    if sweep is None:
+        sweep = [1, 2, 4, 8, 16, 32, 64] if config.index_type in ('ivf', 'ivfpq') else [16, 32, 64, 128, 256]
+
+    rows = []
+    for value in sweep:
+        if faiss.try_extract_index_ivf(index) is not None:
+            faiss.extract_index_ivf(index).nprobe = value
+        elif isinstance(index, faiss.IndexHNSW):
+            index.hnsw.efSearch = value
+        ids, latencies = _timed_search(index, queries, k)
+        hits = sum(len(set(found) & set(expected)) for found, expected in zip(ids, exact_ids))
+        mean = float(np.mean(latencies))
+        rows.append({
+            'index': spec,
+            'param': 'nprobe' if config.index_type in ('ivf', 'ivfpq') else 'efSearch',
+            'value': value,
+            'recall_at_k': round(hits / (len(queries) * k), 4),
+            'mean_ms': round(mean, 4),
+            'p95_ms': round(float(np.percentile(latencies, 95)), 4),
+            'exact_mean_ms': round(exact_mean, 4),
+            'speedup': round(exact_mean / mean, 2) if mean > 0 else None
+        })
+        if spec == "Flat":
+            # Nothing to tune, the index fell back to exact search
+            break
+    return rows
+
+
+def _timed_search(index, queries, k):
+    """Search one query at a time, returns (ids per query, latencies in ms)"""
+    ids = []
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        _, found = index.search(query.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        ids.append([int(i) for i in found[0] if i != -1])
+    return ids, latencies
@@ -0,0 +1,246 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import record_stage
+
+MANIFEST_FILE = "manifest.json"
+SEGMENTS_DIR = "manifest.d"
+STAGING_PREFIX = ".staging-"
+TRASH_PREFIX = ".deleted-"
+
+
+def fsync_directory(path):
+    """Make renames and removals inside a directory durable (a no-op where directories cannot be opened)"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_json_atomic(path, data, indent=None):
+    """Write JSON to a temporary file, flush it to disk and rename it over path"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_directory(os.path.dirname(path) or '.')
+
+
+def staging_directory(root, doc_id):
+    """New private directory below root where one document's index files are written before publishing"""
+    path = os.path.join(root, f"{STAGING_PREFIX}{doc_id}-{uuid.uuid4().hex[:8]}")
+    os.makedirs(path)
+    return path
+
+
+def publish_directory(staging_path, target_path):
+    """
+    Move a fully written staging directory to target_path.
+
+    Its files are flushed to disk first, so target_path either does not
+    exist or holds a complete index; a previous version is renamed away
+    before the new one takes its place and removed afterwards.
+    """
+    for name in os.listdir(staging_path):
+        path = os.path.join(staging_path, name)
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                os.fsync(f.fileno())
+    fsync_directory(staging_path)
+
+    root = os.path.dirname(target_path)
+    trash_path = None
+    if os.path.exists(target_path):
+        trash_path = os.path.join(root, f"{TRASH_PREFIX}{os.path.basename(target_path)}-{uuid.uuid4().hex[:8]}")
+        os.replace(target_path, trash_path)
+    os.replace(staging_path, target_path)
+    fsync_directory(root)
+    if trash_path is not None:
+        shutil.rmtree(trash_path, ignore_errors=True)
+
+
+def remove_incomplete(root):
+    """
+    Delete what an interrupted ingest, delete or reset left behind: staging
+    and renamed-away directories below root and renamed-away copies of root itself.
+
+    Returns:
+        int: Number of directories removed
+    """
+    removed = 0
+    if os.path.isdir(root):
+        for name in os.listdir(root):
+            if name.startswith((STAGING_PREFIX, TRASH_PREFIX)):
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+                removed += 1
+    parent = os.path.dirname(os.path.abspath(root))
+    prefix = f"{os.path.basename(os.path.abspath(root))}{TRASH_PREFIX}"
+    for name in os.listdir(parent):
+        if name.startswith(prefix):
+            shutil.rmtree(os.path.join(parent, name), ignore_errors=True)
+            removed += 1
+    return removed
+
+
+class SegmentedManifest:
+    """
+    Content-hash manifest persisted as a base file plus immutable delta segments.
+
+    manifest.json keeps the {doc_id: entry} mapping the index has always
+    used. Every put() or remove() writes one small segment file to
+    manifest.d/ instead of rewriting the whole mapping, so the write cost of
+    an upload does not grow with the corpus; each segment is written to a
+    temporary file and renamed into place, so a crash never leaves a torn
+    one. Lookups are served from memory, loaded at startup from the base
+    and the segments replayed in order.
+
+    Once compact_after segments have piled up, a background thread folds
+    them into a new manifest.json and deletes them. Replaying a segment is
+    idempotent, so a crash between writing the base and deleting the
+    segments loses nothing.
+    """
+
+    def __init__(self, root, compact_after=64):
+        self.root = root
+        self.compact_after = compact_after
+        self.path = os.path.join(root, MANIFEST_FILE)
+        self.segments_path = os.path.join(root, SEGMENTS_DIR)
+        self.compactions = 0
+        self.last_compaction = None
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._compactor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="manifest-compact")
+        self._compaction_pending = False
+        self._entries = {}
+        self._segments = []
+        self._next_seq = 1
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            self._entries = {}
+        except (OSError, ValueError) as e:
+            print(f"Error loading index manifest: {str(e)}")
+            self._entries = {}
+
+        if not os.path.isdir(self.segments_path):
+            return
+        for name in sorted(os.listdir(self.segments_path)):
+            path = os.path.join(self.segments_path, name)
+            if not name.endswith('.json'):
+                # Temporary file of a segment that was never renamed into place
+                os.unlink(path)
+                continue
+            try:
+                with open(path) as f:
+                    segment = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Skipping unreadable manifest segment {name}: {str(e)}")
+                continue
+            self._apply(segment)
+            self._segments.append(path)
+            self._next_seq = max(self._next_seq, int(name.split('.')[0]) + 1)
+
+    def _apply(self, segment):
+        if segment['entry'] is None:
+            self._entries.pop(segment['doc_id'], None)
+        else:
+            self._entries[segment['doc_id']] = segment['entry']
+
+    def _write_segment(self, doc_id, entry):
+        segment = {'doc_id': doc_id, 'entry': entry}
+        with self._lock:
+            os.makedirs(self.segments_path, exist_ok=True)
+            path = os.path.join(self.segments_path, f"{self._next_seq:012d}.json")
+            self._next_seq += 1
+            write_json_atomic(path, segment)
+            self._apply(segment)
+            self._segments.append(path)
+            start_compaction = len(self._segments) >= self.compact_after and not self._compaction_pending
+            if start_compaction:
+                self._compaction_pending = True
+        if start_compaction:
+            self._compactor.submit(self.compact)
+
+    def get(self, doc_id, default=None):
+        with self._lock:
+            return self._entries.get(doc_id, default)
+
+    def __contains__(self, doc_id):
+        with self._lock:
+            return doc_id in self._entries
+
+    def items(self):
+        with self._lock:
+            return list(self._entries.items())
+
+    def put(self, doc_id, entry):
+        self._write_segment(doc_id, entry)
+
+    def remove(self, doc_id):
+        """Drop a document's entry, returns it (None if it had none)"""
+        entry = self.get(doc_id)
+        if entry is not None:
+            self._write_segment(doc_id, None)
+        return entry
+
+    def compact(self):
+        """Fold the segments written so far into manifest.json and delete them"""
+        with self._compact_lock:
+            start = time.perf_counter()
+            with self._lock:
+                self._compaction_pending = False
+                entries = dict(self._entries)
+                segments = list(self._segments)
+            if not segments:
+                return 0
+            try:
+                write_json_atomic(self.path, entries, indent=2)
+                for path in segments:
+                    os.unlink(path)
+                fsync_directory(self.segments_path)
+            except OSError as e:
+                print(f"Error compacting index manifest: {str(e)}")
+                return 0
+            with self._lock:
+                # Segments written while the base was saved stay for the next compaction
+                self._segments = self._segments[len(segments):]
+            self.compactions += 1
+            self.last_compaction = round(time.perf_counter() - start, 3)
+            record_stage('index.compact', self.last_compaction)
+            return len(segments)
+
+    def clear(self):
+        """Forget every entry and delete the base and segment files"""
+        with self._compact_lock, self._lock:
+            self._entries = {}
+            self._segments = []
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            shutil.rmtree(self.segments_path, ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'segments': len(self._segments),
+                'compact_after': self.compact_after,
+                'compactions': self.compactions,
+                'last_compaction_seconds': self.last_compaction
+            }
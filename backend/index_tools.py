@@ -0,0 +1,95 @@
+"""
+Maintenance commands for the per-document FAISS indexes.
+
+    python index_tools.py rebuild --type hnsw
+    python index_tools.py report --type ivf --corpus --output ivf_report.json
+
+rebuild trains and writes the approximate index of the given type for every
+document (or one with --doc). report compares recall and latency of an index
+type against exact flat search, per document or over all documents merged
+with --corpus. Index settings come from the same FAISS_* environment
+variables the server reads; --type overrides FAISS_INDEX_TYPE.
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+from index_backends import INDEX_TYPES, IndexConfig, build_serving_index, read_vectors, recall_report
+
+INDEX_PATH = "./faiss_index"
+
+
+def document_folders(doc_id=None):
+    """(doc_id, folder) of every saved document index"""
+    if doc_id:
+        folder = os.path.join(INDEX_PATH, doc_id)
+        if not os.path.exists(os.path.join(folder, "index.faiss")):
+            raise SystemExit(f"No index for document {doc_id}")
+        return [(doc_id, folder)]
+
+    folders = []
+    for name in sorted(os.listdir(INDEX_PATH)) if os.path.isdir(INDEX_PATH) else []:
+        folder = os.path.join(INDEX_PATH, name)
+        if not name.startswith('.') and os.path.exists(os.path.join(folder, "index.faiss")):
+            folders.append((name, folder))
+    return folders
+
+
+def rebuild(config, doc_id=None):
+    for name, folder in document_folders(doc_id):
+        _, spec = build_serving_index(folder, config)
+        print(f"{name}: {spec}")
+
+
+def report(config, doc_id=None, corpus=False, k=6, queries=200, output=None):
+    folders = document_folders(doc_id)
+    if not folders:
+        raise SystemExit("No document indexes found")
+
+    if corpus:
+        vectors = np.vstack([read_vectors(folder) for _, folder in folders])
+        results = {'corpus': {'vectors': len(vectors), 'rows': recall_report(vectors, config, k, queries)}}
+    else:
+        results = {}
+        for name, folder in folders:
+            vectors = read_vectors(folder)
+            results[name] = {'vectors': len(vectors), 'rows': recall_report(vectors, config, k, queries)}
+
+    for name, result in results.items():
+        print(f"\n{name} ({result['vectors']} vectors)")
+        print(f"{'index':<16} {'param':<9} {'value':>5} {'recall@k':>9} {'mean ms':>9} {'p95 ms':>9} {'exact ms':>9} {'speedup':>8}")
+        for row in result['rows']:
+            print(f"{row['index']:<16} {row['param']:<9} {row['value']:>5} {row['recall_at_k']:>9.4f} "
+                  f"{row['mean_ms']:>9.4f} {row['p95_ms']:>9.4f} {row['exact_mean_ms']:>9.4f} {row['speedup']:>8}")
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump({'index_type': config.index_type, 'k': k, 'results': results}, f, indent=2)
+        print(f"\nReport saved to {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FAISS index maintenance")
+    parser.add_argument("command", choices=["rebuild", "report"])
+    parser.add_argument("--type", "-t", choices=INDEX_TYPES, help="Index type (default: FAISS_INDEX_TYPE)")
+    parser.add_argument("--doc", "-d", help="Only this document ID")
+    parser.add_argument("--corpus", action="store_true", help="report: merge all documents into one index")
+    parser.add_argument("--k", type=int, default=6, help="report: neighbours per query")
+    parser.add_argument("--queries", type=int, default=200, help="report: queries per index")
+    parser.add_argument("--output", "-o", help="report: save results as JSON")
+    args = parser.parse_args()
+
+    config = IndexConfig.from_env()
+    if args.type:
+        config.index_type = args.type
+
+    if args.command == "rebuild":
+        rebuild(config, args.doc)
+    else:
+        report(config, args.doc, args.corpus, args.k, args.queries, args.output)
+
+
+if __name__ == "__main__":
+    main()
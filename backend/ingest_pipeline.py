@@ -0,0 +1,115 @@
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+_END = object()
+
+
+def _put(q, item, stop):
+    """Put item on a bounded queue, giving up once the consumer has stopped"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def prefetch(iterable, maxsize=2, name="prefetch"):
+    """
+    Iterate over iterable on a background thread, handing items over through a bounded queue.
+
+    The producer runs at most maxsize items ahead of the consumer, so chained
+    prefetch stages overlap their work while memory stays bounded. Exceptions
+    raised by the producer are re-raised in the consumer. Closing the returned
+    generator stops the producer and closes the source iterator.
+    """
+    q = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def produce():
+        source = iter(iterable)
+        try:
+            for item in source:
+                if not _put(q, (item, None), stop):
+                    return
+            _put(q, (_END, None), stop)
+        except BaseException as e:
+            _put(q, (_END, e), stop)
+        finally:
+            close = getattr(source, 'close', None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, name=name, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = q.get()
+            if item is _END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def ordered_map(fn, iterable, max_in_flight=4, name="map"):
+    """
+    Yield fn(item) for every item, running up to max_in_flight calls at once.
+
+    Results come out in input order; the source is only read as far as the
+    window of running calls allows. Exceptions are re-raised when their result
+    is reached, and closing the returned generator cancels the pending calls.
+    """
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix=name) as executor:
+        try:
+            for item in iterable:
+                pending.append(executor.submit(fn, item))
+                if len(pending) >= max_in_flight:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def iter_split_batches(loader, text_splitter, batch_size, on_page=None, page_sink=None, timed=None):
+    """
+    Lazily load pages, split each one and yield the chunks in batches of batch_size.
+
+    Only the current page and the pending batch are held in memory. on_page is
+    called with the number of pages parsed so far after every page, page_sink
+    with every parsed page Document before it is split. timed, when
+    given, is called as timed('parse') and timed('split') for a context
+    manager around the parsing and the splitting of each page.
+    """
+    if timed is None:
+        timed = lambda stage: nullcontext()
+
+    batch = []
+    pages = 0
+    source = iter(loader.lazy_load())
+    while True:
+        with timed('parse'):
+            page = next(source, None)
+        if page is None:
+            break
+        pages += 1
+        if page_sink is not None:
+            page_sink(page)
+        with timed('split'):
+            batch.extend(text_splitter.split_documents([page]))
+        if on_page is not None:
+            on_page(pages)
+        while len(batch) >= batch_size:
+            yield batch[:batch_size]
+            batch = batch[batch_size:]
+    if batch:
+        yield batch
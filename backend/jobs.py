@@ -0,0 +1,211 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import StageTimings
+
+
+class Job:
+    """Status of a unit of background work, updated from the worker thread"""
+
+    FINISHED_STAGES = ('done', 'failed')
+
+    def __init__(self):
+        self.job_id = uuid.uuid4().hex
+        self.stage = 'queued'
+        self.error = None
+        self.result = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.future = None
+        self._lock = threading.Lock()
+
+    @property
+    def dedupe_key(self):
+        """Jobs sharing a key are not run concurrently, None disables this"""
+        return None
+
+    def update(self, **fields):
+        with self._lock:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.updated_at = time.time()
+
+    @property
+    def finished(self):
+        return self.stage in self.FINISHED_STAGES
+
+    def progress(self):
+        """Job specific status fields"""
+        return {}
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'job_id': self.job_id,
+                **self.progress(),
+                'stage': self.stage,
+                'error': self.error,
+                'result': self.result,
+                'elapsed': round(self.updated_at - self.created_at, 3)
+            }
+
+
+class IngestJob(Job):
+    """Progress of one document ingestion running on the worker pool"""
+
+    def __init__(self, filename, doc_id, session_id):
+        super().__init__()
+        self.filename = filename
+        self.doc_id = doc_id
+        self.session_id = session_id
+        self.pages_parsed = 0
+        self.chunks_total = None
+        self.chunks_embedded = 0
+        self.timings = StageTimings()
+
+    @property
+    def dedupe_key(self):
+        return self.doc_id
+
+    def progress(self):
+        return {
+            'filename': self.filename,
+            'doc_id': self.doc_id,
+            'session_id': self.session_id,
+            'pages_parsed': self.pages_parsed,
+            'chunks_total': self.chunks_total,
+            'chunks_embedded': self.chunks_embedded,
+            'timings': self.timings.to_dict()
+        }
+
+
+class BatchJob(Job):
+    """Progress of a batch analysis over a directory of PDFs"""
+
+    def __init__(self, directory, output_dir):
+        super().__init__()
+        self.directory = directory
+        self.output_dir = output_dir
+        self.files_total = 0
+        self.files_done = 0
+        self.files_skipped = 0
+        self.files_failed = 0
+
+    @property
+    def dedupe_key(self):
+        return ('batch', self.output_dir)
+
+    def record(self, outcome):
+        """Count one finished file: 'done', 'skipped' or 'failed'"""
+        with self._lock:
+            attribute = f'files_{outcome}'
+            setattr(self, attribute, getattr(self, attribute) + 1)
+            self.updated_at = time.time()
+
+    def progress(self):
+        return {
+            'directory': self.directory,
+            'output_dir': self.output_dir,
+            'files_total': self.files_total,
+            'files_done': self.files_done,
+            'files_skipped': self.files_skipped,
+            'files_failed': self.files_failed
+        }
+
+
+class WarmupJob(Job):
+    """Background warm-up of a server process: imports, clients and resident indexes"""
+
+    def __init__(self):
+        super().__init__()
+        self.steps = {}
+        self.indexes_total = 0
+        self.indexes_loaded = 0
+
+    def progress(self):
+        return {
+            'steps': dict(self.steps),
+            'indexes_total': self.indexes_total,
+            'indexes_loaded': self.indexes_loaded
+        }
+
+
+class JobManager:
+    """
+    Runs jobs on a bounded worker pool and keeps their status for polling.
+
+    Only one job per dedupe key runs at a time: submitting a document that is
+    already being ingested returns the running job. The newest max_jobs jobs
+    are kept for status queries.
+    """
+
+    def __init__(self, max_workers=2, max_jobs=1000, name="ingest"):
+        self.max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._jobs = OrderedDict()
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def submit(self, job, work):
+        """
+        Queue work(job) for execution, unless a job with the same dedupe key is in progress.
+
+        Args:
+            job (Job): The job to track
+            work (callable): Called with the job on a worker thread, returns the job result
+
+        Returns:
+            Job: The queued job, or the running job with the same key
+        """
+        with self._lock:
+            key = job.dedupe_key
+            if key is not None:
+                active = self._active.get(key)
+                if active is not None:
+                    return active
+                self._active[key] = job
+            self._remember(job)
+            job.future = self._executor.submit(self._run, job, work)
+        return job
+
+    def wait(self, job, timeout=None):
+        """Block until a submitted job has finished and return it"""
+        if job.future is not None:
+            job.future.result(timeout=timeout)
+        return job
+
+    def add_finished(self, job, result):
+        """Record a job that completed without going through the pool"""
+        job.update(stage='done', result=result)
+        with self._lock:
+            self._remember(job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active(self, dedupe_key):
+        """The job currently running for a dedupe key, if any"""
+        with self._lock:
+            return self._active.get(dedupe_key)
+
+    def _remember(self, job):
+        self._jobs[job.job_id] = job
+        while len(self._jobs) > self.max_jobs:
+            self._jobs.popitem(last=False)
+
+    def _run(self, job, work):
+        try:
+            result = work(job)
+            job.update(stage='done', result=result)
+        except Exception as e:
+            print(f"Error in job {job.job_id}: {str(e)}")
+            job.update(stage='failed', error=str(e))
+        finally:
+            with self._lock:
+                if self._active.get(job.dedupe_key) is job:
+                    del self._active[job.dedupe_key]
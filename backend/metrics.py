@@ -0,0 +1,275 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Seconds; covers everything from a FAISS search to a slow Groq call
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels) + list(extra or [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms rendered in the Prometheus text format.
+
+    Metrics are declared once with counter()/histogram() and updated with
+    inc()/observe() and labels as keyword arguments. Collectors registered with
+    add_collector() are called on every render and return gauge samples, for
+    values that already live elsewhere (cache sizes, hit counters).
+    """
+
+    def __init__(self, namespace='codeguardians'):
+        self.namespace = namespace
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _declare(self, name, kind, help_text, buckets=None):
+        with self._lock:
+            self._metrics.setdefault(name, {
+                'kind': kind,
+                'help': help_text,
+                'buckets': buckets,
+                'samples': {}
+            })
+
+    def counter(self, name, help_text):
+        self._declare(name, 'counter', help_text)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self._declare(name, 'histogram', help_text, tuple(buckets))
+
+    def inc(self, name, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            samples = self._metrics[name]['samples']
+            samples[key] = samples.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            metric = self._metrics[name]
+            sample = metric['samples'].get(key)
+            if sample is None:
+                sample = metric['samples'][key] = {
+                    'buckets': [0] * len(metric['buckets']),
+                    'sum': 0.0,
+                    'count': 0
+                }
+            for i, bound in enumerate(metric['buckets']):
+                if value <= bound:
+                    sample['buckets'][i] += 1
+            sample['sum'] += value
+            sample['count'] += 1
+
+    def add_collector(self, collect):
+        """collect() returns a list of (name, help, labels dict, value) gauge samples"""
+        self._collectors.append(collect)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, metric in self._metrics.items():
+                full_name = f"{self.namespace}_{name}"
+                lines.append(f"# HELP {full_name} {metric['help']}")
+                lines.append(f"# TYPE {full_name} {metric['kind']}")
+                for key, sample in sorted(metric['samples'].items()):
+                    if metric['kind'] == 'counter':
+                        lines.append(f"{full_name}{_format_labels(key)} {_format_value(sample)}")
+                        continue
+                    bounds = list(metric['buckets']) + [float('inf')]
+                    counts = sample['buckets'] + [sample['count']]
+                    for bound, count in zip(bounds, counts):
+                        lines.append(
+                            f"{full_name}_bucket{_format_labels(key, [('le', _format_value(float(bound)))])} {count}"
+                        )
+                    lines.append(f"{full_name}_sum{_format_labels(key)} {_format_value(sample['sum'])}")
+                    lines.append(f"{full_name}_count{_format_labels(key)} {sample['count']}")
+
+        gauges = {}
+        for collect in self._collectors:
+            try:
+                for name, help_text, labels, value in collect():
+                    gauges.setdefault(name, (help_text, []))[1].append((labels, value))
+            except Exception as e:
+                print(f"Error collecting metrics: {str(e)}")
+        for name, (help_text, samples) in gauges.items():
+            full_name = f"{self.namespace}_{name}"
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} gauge")
+            for labels, value in samples:
+                lines.append(f"{full_name}{_format_labels(_label_key(labels))} {_format_value(value)}")
+
+        return '\n'.join(lines) + '\n'
+
+
+class StageTimings:
+    """Durations of the stages of one request or job, safe to add to from worker threads"""
+
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            count, total = self._stages.get(stage, (0, 0.0))
+            self._stages[stage] = (count + 1, total + seconds)
+
+    def to_dict(self):
+        """Per stage: number of spans and their total duration in milliseconds"""
+        with self._lock:
+            return {
+                stage: {'count': count, 'total_ms': round(total * 1000, 2)}
+                for stage, (count, total) in self._stages.items()
+            }
+
+    def server_timing(self):
+        """Value of a Server-Timing header"""
+        return ', '.join(
+            f"{stage.replace(' ', '_')};dur={timing['total_ms']}"
+            for stage, timing in self.to_dict().items()
+        )
+
+
+metrics = MetricsRegistry()
+metrics.histogram('stage_duration_seconds', 'Duration of processing stages')
+metrics.histogram('http_request_duration_seconds', 'Duration of HTTP requests')
+metrics.counter('chunks_total', 'Chunks split from uploaded documents')
+metrics.counter('pages_total', 'PDF pages parsed')
+metrics.counter('retrieved_chunks_total', 'Chunks returned by retrievals')
+metrics.counter('retrievals_total', 'Retrievals by path (lexical, hybrid, vector)')
+metrics.counter('llm_calls_total', 'LLM calls')
+metrics.counter('llm_tokens_total', 'LLM tokens reported by the provider')
+metrics.counter('errors_total', 'Failed stages')
+metrics.counter('embedding_requests_total', 'Embedding server requests by outcome (ok, retried, failed)')
+
+# StageTimings of the request being handled, when it asked for a breakdown
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+def start_request_timings():
+    """Collect stage timings for the current request, returns a token for end_request_timings"""
+    return _request_timings.set(StageTimings())
+
+
+def end_request_timings(token):
+    _request_timings.reset(token)
+
+
+def current_timings():
+    return _request_timings.get()
+
+
+def record_stage(stage, seconds, timings=None):
+    """Record a finished stage in the metrics and in timings (default: the current request's)"""
+    metrics.observe('stage_duration_seconds', seconds, stage=stage)
+    if timings is None:
+        timings = current_timings()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+@contextmanager
+def span(stage, timings=None):
+    """Time the enclosed block as one span of stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        metrics.inc('errors_total', stage=stage)
+        raise
+    finally:
+        record_stage(stage, time.perf_counter() - start, timings)
+
+
+class StageCallbackHandler(BaseCallbackHandler):
+    """
+    LangChain callbacks timing the retrievals and LLM calls inside a chain.
+
+    Spans are recorded as '<operation>.retrieval' and '<operation>.llm'. The
+    timings to add to are captured when the handler is created, because chains
+    may run parts of their work on other threads.
+    """
+
+    # Cheap enough to run on the event loop of async chain calls instead of an executor
+    run_inline = True
+
+    def __init__(self, operation, timings=None):
+        self.operation = operation
+        self.timings = timings if timings is not None else current_timings()
+        self._starts = {}
+
+    def _start(self, run_id):
+        self._starts[run_id] = time.perf_counter()
+
+    def _end(self, run_id, stage):
+        start = self._starts.pop(run_id, None)
+        if start is not None:
+            record_stage(f"{self.operation}.{stage}", time.perf_counter() - start, self.timings)
+
+    def _error(self, run_id, stage):
+        self._starts.pop(run_id, None)
+        metrics.inc('errors_total', stage=f"{self.operation}.{stage}")
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id, 'retrieval')
+        metrics.inc('retrieved_chunks_total', len(documents), operation=self.operation)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._error(run_id, 'retrieval')
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id, 'llm')
+        metrics.inc('llm_calls_total', operation=self.operation)
+
+        usage = (response.llm_output or {}).get('token_usage') or {}
+        prompt_tokens = usage.get('prompt_tokens', 0)
+        completion_tokens = usage.get('completion_tokens', 0)
+        if not usage:
+            for generation in (response.generations[0] if response.generations else []):
+                metadata = getattr(getattr(generation, 'message', None), 'usage_metadata', None) or {}
+                prompt_tokens += metadata.get('input_tokens', 0)
+                completion_tokens += metadata.get('output_tokens', 0)
+        if prompt_tokens:
+            metrics.inc('llm_tokens_total', prompt_tokens, operation=self.operation, kind='prompt')
+        if completion_tokens:
+            metrics.inc('llm_tokens_total', completion_tokens, operation=self.operation, kind='completion')
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._error(run_id, 'llm')
+
+
+def chain_config(operation, timings=None):
+    """RunnableConfig that times the retrievals and LLM calls of a chain call"""
+    return {'callbacks': [StageCallbackHandler(operation, timings)]}
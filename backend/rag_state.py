@@ -0,0 +1,148 @@
+import threading
+from collections import OrderedDict
+
+
+class LoadedDocument:
+    """
+    A document's vector store together with the retriever and chains built over it.
+
+    qa_chain retrieves with the question as is; follow-up questions are made
+    standalone before they are passed to it. version identifies the saved
+    index the store was built from; it changes whenever the document is
+    re-indexed.
+    """
+
+    def __init__(self, doc_id, store, retriever, qa_chain, version=None):
+        self.doc_id = doc_id
+        self.store = store
+        self.retriever = retriever
+        self.qa_chain = qa_chain
+        self.version = version
+
+
+class DocumentCache:
+    """
+    Bounded LRU of per-document indexes resident in memory.
+
+    Indexes are loaded on first use with load_document(doc_id) and the least
+    recently used ones are dropped once more than max_resident are loaded.
+    Dropping an index only frees memory, it is reloaded from disk on next use.
+    """
+
+    def __init__(self, load_document, max_resident=16):
+        self.load_document = load_document
+        self.max_resident = max_resident
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, doc_id):
+        with self._lock:
+            if doc_id in self._documents:
+                self._documents.move_to_end(doc_id)
+                return self._documents[doc_id]
+
+        # Load outside the lock so a slow load does not block other documents
+        document = self.load_document(doc_id)
+        return self.put(doc_id, document)
+
+    def put(self, doc_id, document):
+        with self._lock:
+            if doc_id in self._documents:
+                # Another thread loaded it first, keep a single resident copy
+                self._documents.move_to_end(doc_id)
+                return self._documents[doc_id]
+            self._documents[doc_id] = document
+            while len(self._documents) > self.max_resident:
+                self._documents.popitem(last=False)
+            return document
+
+    def is_resident(self, doc_id):
+        with self._lock:
+            return doc_id in self._documents
+
+    def evict(self, doc_id):
+        with self._lock:
+            self._documents.pop(doc_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+
+
+class Session:
+    """
+    Conversation state of one client: the document it works on and its chat history.
+
+    The chain is resolved through the DocumentCache on every request, so a
+    session never pins an evicted index in memory. Chains hold no conversation
+    state (history is passed on each call), which makes them safe to share
+    between sessions looking at the same document.
+    """
+
+    def __init__(self, session_id, memory):
+        self.session_id = session_id
+        self.doc_id = None
+        # Ingest job of the document while its index is being built
+        self.ingest_job_id = None
+        self.document_info = {
+            "filename": None,
+            "document_type": None,
+            "doc_id": None
+        }
+        self.memory = memory
+        self.lock = threading.RLock()
+
+    def bind_document(self, doc_id, filename, ingest_job_id=None):
+        """Switch the session to a document, starting a fresh conversation"""
+        with self.lock:
+            self.doc_id = doc_id
+            self.ingest_job_id = ingest_job_id
+            self.document_info = {
+                "filename": filename,
+                "document_type": None,
+                "doc_id": doc_id
+            }
+            self.memory.clear()
+
+    def unbind_document(self, doc_id):
+        """Detach the session from doc_id, unless it has switched to another document meanwhile"""
+        with self.lock:
+            if self.doc_id == doc_id:
+                self.bind_document(None, None)
+
+    def clear_history(self):
+        self.memory.clear()
+
+
+class SessionRegistry:
+    """Bounded LRU of sessions keyed by session ID, each with a memory from memory_factory()"""
+
+    def __init__(self, memory_factory, max_sessions=1000):
+        self.memory_factory = memory_factory
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        """Return the session for session_id, creating it on first use"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = Session(session_id, self.memory_factory())
+                self._sessions[session_id] = session
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def release_document(self, doc_id):
+        """Detach every session from a document that is being removed"""
+        with self._lock:
+            affected = [s for s in self._sessions.values() if s.doc_id == doc_id]
+        for session in affected:
+            session.bind_document(None, None)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
@@ -0,0 +1,462 @@
+"""
+Vectorized CFR scoring over stored evaluations.
+
+Every analysis records its raw section scores and suggestion statistics in a
+columnar ScoreTable, so changed section weights, suggestion-factor constants
+or rating thresholds can be applied to the whole corpus without calling the
+LLM again:
+
+    python scoring.py import batch_results/quarter-3
+    python scoring.py rank --weights inter_se_priorities=0.3,outcome_impact=0.3 --top 20
+    python scoring.py rank --param quantity_weight=0.8 --param detail_weight=0.2 -o ranks.json
+
+The vectorized functions reproduce calculate_overall_score,
+adjust_scores_by_suggestions, analyze_enhancement_suggestions and
+get_rating_label in app.py exactly for the default parameters.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+SECTION_WEIGHTS = {
+    'vision': 0.05,  # 5%
+    'mission': 0.05,  # 5%
+    'objectives': 0.05,  # 5%
+    'inter_se_priorities': 0.40,  # 40%
+    'trend_values': 0.15,  # 15%
+    'success_indicators_description': 0.05,  # 5%
+    'other_department_requirements': 0.05,  # 5%
+    'outcome_impact': 0.20   # 20%
+}
+
+RATING_THRESHOLDS = {
+    'excellent': 100,
+    'very_good': 90,
+    'good': 80,
+    'fair': 70,
+    'poor': 60
+}
+
+# Constants of the suggestion factor (analyze_enhancement_suggestions)
+SUGGESTION_FACTOR_PARAMS = {
+    'detail_weight': 0.4,
+    'quantity_weight': 0.6,
+    'max_penalty': 0.2,
+    'words_scale': 100,
+    'count_scale': 10,
+    'min_factor': 0.8
+}
+
+MIN_SCORE = 60
+MAX_SCORE = 100
+
+SCORE_TABLE_PATH = os.getenv("SCORE_TABLE_PATH", "./scores/score_table.npz")
+
+
+def suggestion_features(suggestions):
+    """(non-empty suggestion count, total words) as used by the suggestion factor"""
+    if not suggestions:
+        return 0, 0
+    count = len([s for s in suggestions if isinstance(s, str) and s.strip()])
+    words = sum(len(s.split()) for s in suggestions if isinstance(s, str))
+    return count, words
+
+
+class ScoreTable:
+    """
+    Raw section scores of analyzed documents, one row per document.
+
+    Columns are NumPy arrays: scores (documents x sections, NaN where the
+    evaluation had no score), suggestion counts and word totals, document IDs,
+    filenames and analysis times. The table is kept in memory and saved as a
+    .npz file.
+    """
+
+    def __init__(self, path=None, sections=tuple(SECTION_WEIGHTS)):
+        self.path = path
+        self.sections = list(sections)
+        self.doc_ids = np.empty(0, dtype=object)
+        self.filenames = np.empty(0, dtype=object)
+        self.scores = np.empty((0, len(self.sections)))
+        self.suggestion_counts = np.empty(0, dtype=np.int64)
+        self.suggestion_words = np.empty(0, dtype=np.int64)
+        self.analyzed_at = np.empty(0)
+        self._rows = {}
+        self._lock = threading.RLock()
+        if path and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._rows
+
+    @staticmethod
+    def row_from_result(doc_id, filename, result):
+        """
+        Table row of an analysis result, None when it has no evaluation.
+
+        Uses the validated scores before the suggestion adjustment, which the
+        result keeps as evaluation.original_scores.
+        """
+        evaluation = result.get('evaluation') or {}
+        scores = evaluation.get('original_scores')
+        if scores is None:
+            sections = evaluation.get('section_scores')
+            if not sections:
+                return None
+            scores = {name: data.get('score') for name, data in sections.items() if isinstance(data, dict)}
+        count, words = suggestion_features(result.get('enhancement_suggestions'))
+        return {
+            'doc_id': doc_id,
+            'filename': filename or '',
+            'scores': scores,
+            'suggestion_count': count,
+            'suggestion_words': words,
+            'analyzed_at': time.time()
+        }
+
+    def upsert_many(self, rows):
+        """Insert or replace rows (dicts from row_from_result) in one pass"""
+        with self._lock:
+            new_rows = {}
+            for row in rows:
+                new_rows[row['doc_id']] = row
+
+            replaced = [(self._rows[doc_id], row) for doc_id, row in new_rows.items() if doc_id in self._rows]
+            added = [row for doc_id, row in new_rows.items() if doc_id not in self._rows]
+
+            for index, row in replaced:
+                self.filenames[index] = row['filename']
+                self.scores[index] = self._score_vector(row['scores'])
+                self.suggestion_counts[index] = row['suggestion_count']
+                self.suggestion_words[index] = row['suggestion_words']
+                self.analyzed_at[index] = row['analyzed_at']
+
+            if added:
+                start = len(self.doc_ids)
+                self.doc_ids = np.concatenate([self.doc_ids, np.array([r['doc_id'] for r in added], dtype=object)])
+                self.filenames = np.concatenate([self.filenames, np.array([r['filename'] for r in added], dtype=object)])
+                self.scores = np.vstack([self.scores, np.array([self._score_vector(r['scores']) for r in added])])
+                self.suggestion_counts = np.concatenate([
+                    self.suggestion_counts, np.array([r['suggestion_count'] for r in added], dtype=np.int64)
+                ])
+                self.suggestion_words = np.concatenate([
+                    self.suggestion_words, np.array([r['suggestion_words'] for r in added], dtype=np.int64)
+                ])
+                self.analyzed_at = np.concatenate([self.analyzed_at, np.array([r['analyzed_at'] for r in added])])
+                for offset, row in enumerate(added):
+                    self._rows[row['doc_id']] = start + offset
+
+    def record(self, doc_id, filename, result):
+        """Store the scores of one analysis result and save the table; False if it had none"""
+        row = self.row_from_result(doc_id, filename, result)
+        if row is None:
+            return False
+        with self._lock:
+            self.upsert_many([row])
+            if self.path:
+                self.save()
+        return True
+
+    def remove(self, doc_id):
+        with self._lock:
+            index = self._rows.pop(doc_id, None)
+            if index is None:
+                return False
+            keep = np.arange(len(self.doc_ids)) != index
+            for column in ('doc_ids', 'filenames', 'scores', 'suggestion_counts', 'suggestion_words', 'analyzed_at'):
+                setattr(self, column, getattr(self, column)[keep])
+            self._rows = {doc_id: i for i, doc_id in enumerate(self.doc_ids.tolist())}
+            if self.path:
+                self.save()
+            return True
+
+    def clear(self):
+        with self._lock:
+            keep = np.zeros(len(self.doc_ids), dtype=bool)
+            for column in ('doc_ids', 'filenames', 'scores', 'suggestion_counts', 'suggestion_words', 'analyzed_at'):
+                setattr(self, column, getattr(self, column)[keep])
+            self._rows = {}
+            if self.path:
+                self.save()
+
+    def _score_vector(self, scores):
+        vector = np.full(len(self.sections), np.nan)
+        for i, section in enumerate(self.sections):
+            value = scores.get(section)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                vector[i] = value
+        return vector
+
+    def save(self):
+        """Atomically write the table to path"""
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.savez(
+                    f,
+                    sections=np.array(self.sections, dtype=str),
+                    doc_ids=self.doc_ids.astype(str),
+                    filenames=self.filenames.astype(str),
+                    scores=self.scores,
+                    suggestion_counts=self.suggestion_counts,
+                    suggestion_words=self.suggestion_words,
+                    analyzed_at=self.analyzed_at
+                )
+            os.replace(tmp_path, self.path)
+
+    def load(self):
+        """Read the table from path, mapping stored score columns onto the current sections"""
+        with self._lock:
+            with np.load(self.path, allow_pickle=False) as data:
+                stored_sections = data['sections'].tolist()
+                stored_scores = data['scores']
+                self.doc_ids = data['doc_ids'].astype(object)
+                self.filenames = data['filenames'].astype(object)
+                self.suggestion_counts = data['suggestion_counts']
+                self.suggestion_words = data['suggestion_words']
+                self.analyzed_at = data['analyzed_at']
+
+            self.scores = np.full((len(self.doc_ids), len(self.sections)), np.nan)
+            for i, section in enumerate(self.sections):
+                if section in stored_sections:
+                    self.scores[:, i] = stored_scores[:, stored_sections.index(section)]
+            self._rows = {doc_id: i for i, doc_id in enumerate(self.doc_ids.tolist())}
+
+
+def suggestion_factors(counts, words, params=None):
+    """Vectorized analyze_enhancement_suggestions over suggestion counts and word totals"""
+    p = {**SUGGESTION_FACTOR_PARAMS, **(params or {})}
+    counts = np.asarray(counts, dtype=float)
+    words = np.asarray(words, dtype=float)
+
+    avg_words = words / np.maximum(1, counts)
+    detail_factor = 1.0 - np.minimum(p['max_penalty'], avg_words / p['words_scale'])
+    quantity_factor = 1.0 - np.minimum(p['max_penalty'], counts / p['count_scale'])
+    combined = detail_factor * p['detail_weight'] + quantity_factor * p['quantity_weight']
+    factors = np.clip(combined, p['min_factor'], 1.0)
+    # No suggestions means no negative impact
+    return np.where(counts == 0, 1.0, factors)
+
+
+def adjust_scores(scores, factors):
+    """
+    Vectorized adjust_scores_by_suggestions.
+
+    Returns:
+        tuple: (rounded adjusted scores, unrounded adjusted scores), NaN stays NaN
+    """
+    adjusted = np.clip(scores * np.asarray(factors)[:, None], MIN_SCORE, MAX_SCORE)
+    return np.round(adjusted), adjusted
+
+
+def overall_scores(section_scores, sections, weights=None):
+    """
+    Vectorized calculate_overall_score.
+
+    Sections are summed in the order of weights, one column at a time, so the
+    floating point result (and with it the rounding) matches the scalar code.
+    Missing (NaN) sections contribute nothing.
+    """
+    weights = SECTION_WEIGHTS if weights is None else weights
+    weighted_sum = np.zeros(len(section_scores))
+    for section, weight in weights.items():
+        if section not in sections:
+            continue
+        column = np.clip(section_scores[:, sections.index(section)], MIN_SCORE, MAX_SCORE)
+        weighted_sum = np.where(np.isnan(column), weighted_sum, weighted_sum + column * weight)
+    return np.round(weighted_sum)
+
+
+def rating_labels(scores, thresholds=None):
+    """Vectorized get_rating_label"""
+    t = {**RATING_THRESHOLDS, **(thresholds or {})}
+    scores = np.asarray(scores)
+    return np.select(
+        [scores >= t['excellent'], scores >= t['very_good'], scores >= t['good'], scores >= t['fair']],
+        ["Excellent", "Very Good", "Good", "Fair"],
+        default="Poor"
+    )
+
+
+def competition_rank(scores):
+    """Rank 1 for the highest score, tied scores share the best rank ("1224" ranking)"""
+    scores = np.asarray(scores, dtype=float)
+    return 1 + np.searchsorted(np.sort(-scores), -scores, side='left')
+
+
+def rescore(table, weights=None, params=None, thresholds=None):
+    """
+    Score every document of the table in one pass.
+
+    Args:
+        table (ScoreTable): Stored raw scores
+        weights (dict): Section weights replacing SECTION_WEIGHTS (unknown sections are rejected)
+        params (dict): Overrides of SUGGESTION_FACTOR_PARAMS
+        thresholds (dict): Overrides of RATING_THRESHOLDS
+
+    Returns:
+        dict: Arrays per document: factor, section_scores, overall, rating and rank
+    """
+    weights = SECTION_WEIGHTS if weights is None else weights
+    unknown = set(weights) - set(table.sections)
+    if unknown:
+        raise ValueError(f"Unknown sections: {', '.join(sorted(unknown))}")
+    unknown = set(params or {}) - set(SUGGESTION_FACTOR_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown suggestion factor parameters: {', '.join(sorted(unknown))}")
+    unknown = set(thresholds or {}) - set(RATING_THRESHOLDS)
+    if unknown:
+        raise ValueError(f"Unknown rating thresholds: {', '.join(sorted(unknown))}")
+
+    with table._lock:
+        scores = table.scores.copy()
+        counts = table.suggestion_counts.copy()
+        words = table.suggestion_words.copy()
+
+    factors = suggestion_factors(counts, words, params)
+    section_scores, _ = adjust_scores(np.clip(scores, MIN_SCORE, MAX_SCORE), factors)
+    overall = overall_scores(section_scores, table.sections, weights)
+    return {
+        'factor': factors,
+        'section_scores': section_scores,
+        'overall': overall,
+        'rating': rating_labels(overall, thresholds),
+        'rank': competition_rank(overall)
+    }
+
+
+def ranking(table, weights=None, params=None, thresholds=None, top=None):
+    """
+    What-if ranking of the corpus, compared with the current scoring.
+
+    Returns:
+        list: One dict per document ordered by rank, with the baseline score
+            and rank under the current weights and constants
+    """
+    scored = rescore(table, weights, params, thresholds)
+    baseline = rescore(table)
+    order = np.lexsort((table.doc_ids.astype(str), scored['rank']))
+    if top is not None:
+        order = order[:top]
+
+    return [{
+        'rank': int(scored['rank'][i]),
+        'doc_id': str(table.doc_ids[i]),
+        'filename': str(table.filenames[i]),
+        'overall_score': int(scored['overall'][i]),
+        'overall_rating': str(scored['rating'][i]),
+        'suggestion_impact_factor': round(float(scored['factor'][i]), 2),
+        'baseline_score': int(baseline['overall'][i]),
+        'baseline_rank': int(baseline['rank'][i]),
+        'score_change': int(scored['overall'][i] - baseline['overall'][i]),
+        'rank_change': int(baseline['rank'][i] - scored['rank'][i])
+    } for i in order]
+
+
+def import_results(table, paths):
+    """Add analysis result JSON files (batch or test.py output) to the table"""
+    rows = []
+    skipped = 0
+    for path in paths:
+        files = [os.path.join(path, f) for f in sorted(os.listdir(path)) if f.endswith('.json')] \
+            if os.path.isdir(path) else [path]
+        for file_path in files:
+            try:
+                with open(file_path) as f:
+                    result = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Error reading {file_path}: {str(e)}")
+                skipped += 1
+                continue
+
+            name = os.path.splitext(os.path.basename(file_path))[0]
+            row = ScoreTable.row_from_result(
+                result.get('doc_id') or name,
+                result.get('filename') or name,
+                result
+            )
+            if row is None:
+                skipped += 1
+                continue
+            rows.append(row)
+
+    table.upsert_many(rows)
+    return len(rows), skipped
+
+
+def parse_assignments(values):
+    """{'name': float} from 'name=value' items, comma separated or repeated"""
+    parsed = {}
+    for value in values or []:
+        for item in value.split(','):
+            if not item.strip():
+                continue
+            name, _, number = item.partition('=')
+            try:
+                parsed[name.strip()] = float(number)
+            except ValueError:
+                raise SystemExit(f"Invalid value in '{item}', expected name=number")
+    return parsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score and rank stored CFR evaluations")
+    parser.add_argument("command", choices=["import", "rank"])
+    parser.add_argument("paths", nargs="*", help="import: result JSON files or directories")
+    parser.add_argument("--table", default=SCORE_TABLE_PATH, help="Score table file")
+    parser.add_argument("--weights", "-w", action="append", help="rank: section=weight overrides")
+    parser.add_argument("--param", "-p", action="append", help="rank: suggestion factor constant overrides")
+    parser.add_argument("--threshold", action="append", help="rank: rating threshold overrides")
+    parser.add_argument("--normalize", action="store_true", help="rank: scale the weights to sum to 1")
+    parser.add_argument("--top", type=int, help="rank: only print the first N")
+    parser.add_argument("--output", "-o", help="rank: save the ranking as JSON")
+    args = parser.parse_args()
+
+    table = ScoreTable(args.table)
+
+    if args.command == "import":
+        if not args.paths:
+            raise SystemExit("Give result files or directories to import")
+        imported, skipped = import_results(table, args.paths)
+        table.save()
+        print(f"Imported {imported} evaluations ({skipped} skipped), {len(table)} documents in {args.table}")
+        return
+
+    if not len(table):
+        raise SystemExit(f"No evaluations in {args.table}")
+    weights = {**SECTION_WEIGHTS, **parse_assignments(args.weights)}
+    if args.normalize:
+        total = sum(weights.values())
+        weights = {section: weight / total for section, weight in weights.items()}
+
+    start = time.perf_counter()
+    try:
+        ranked = ranking(table, weights, parse_assignments(args.param), parse_assignments(args.threshold), args.top)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    elapsed = time.perf_counter() - start
+
+    print(f"{'rank':>4} {'score':>5} {'was':>5} {'moved':>5}  {'rating':<10} filename")
+    for row in ranked:
+        print(f"{row['rank']:>4} {row['overall_score']:>5} {row['baseline_score']:>5} "
+              f"{row['rank_change']:>+5}  {row['overall_rating']:<10} {row['filename']}")
+    print(f"\nRe-scored {len(table)} documents in {elapsed * 1000:.1f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'weights': weights, 'documents': len(table), 'ranking': ranked}, f, indent=2)
+        print(f"Ranking saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
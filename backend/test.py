@@ -3,11 +3,17 @@ import os
 import time
 import json
 import argparse
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # URL of your Flask application
 BASE_URL = "http://localhost:5000"
 
-def upload_pdf(pdf_path):
+def session_headers(session_id):
+    """Headers selecting a server-side session, empty for the default session"""
+    return {'X-Session-ID': session_id} if session_id else {}
+
+def upload_pdf(pdf_path, session_id=None):
     """Upload a PDF file to the RAG application"""
     print(f"\n=== Uploading PDF: {pdf_path} ===")
     
@@ -19,23 +25,61 @@ def upload_pdf(pdf_path):
     files = {'file': (os.path.basename(pdf_path), open(pdf_path, 'rb'), 'application/pdf')}
     
     # Make the request
-    response = requests.post(f"{BASE_URL}/upload", files=files)
+    response = requests.post(f"{BASE_URL}/upload", files=files, headers=session_headers(session_id))
     
-    # Check if upload was successful
-    if response.status_code == 200:
-        result = response.json()
-        print(f"Upload successful! Filename: {result.get('filename')}, Chunks created: {result.get('chunks')}")
-        return result.get('filename')
-    else:
+    # Check if upload was accepted
+    if response.status_code not in (200, 202):
         print(f"Upload failed with status code {response.status_code}: {response.text}")
         return None
 
-def analyze_document():
+    result = response.json()
+    print(f"{result.get('message')} (job {result.get('job_id')})")
+
+    # Ingestion runs in the background, wait until the job finishes
+    job = wait_for_job(result['job_id'])
+    if job is None or job['stage'] != 'done':
+        error = job.get('error') if job else 'unknown error'
+        print(f"Processing failed: {error}")
+        return None
+
+    print(f"Upload successful! Filename: {job.get('filename')}, Chunks created: {job['result'].get('chunks')}")
+    return job.get('filename')
+
+def wait_for_job(job_id, poll_interval=1.0, timeout=1800):
+    """Poll the ingest job until it is done or failed"""
+    deadline = time.time() + timeout
+    last_progress = None
+    while time.time() < deadline:
+        response = requests.get(f"{BASE_URL}/jobs/{job_id}")
+        if response.status_code != 200:
+            print(f"Failed to get job status: {response.status_code}")
+            return None
+
+        job = response.json()
+        if 'files_total' in job:
+            done = job['files_done'] + job['files_skipped'] + job['files_failed']
+            progress = f"{job['stage']}: {done}/{job['files_total']} files"
+        elif job.get('chunks_total'):
+            progress = f"{job['stage']}: {job['chunks_embedded']}/{job['chunks_total']} chunks embedded"
+        else:
+            progress = job['stage']
+        if progress != last_progress:
+            print(f"  {progress}")
+            last_progress = progress
+
+        if job['stage'] in ('done', 'failed'):
+            return job
+        time.sleep(poll_interval)
+
+    print(f"Timed out waiting for job {job_id}")
+    return None
+
+def analyze_document(session_id=None):
     """Get complete document analysis using the analyze_document endpoint"""
     print("\n=== Analyzing Document ===")
     
     # Make the request to the analyze_document endpoint
-    response = requests.post(f"{BASE_URL}/analyze_document")
+    response = requests.post(f"{BASE_URL}/analyze_document", headers=session_headers(session_id))
     
     # Check if analysis was successful
     if response.status_code == 200:
@@ -57,6 +101,73 @@ def get_document_list():
         print(f"Failed to get document list: {response.status_code}")
         return []
 
+def result_path(output_dir, pdf_name):
+    """Where the analysis of a PDF is saved"""
+    return os.path.join(output_dir, f"{os.path.splitext(pdf_name)[0]}_analysis.json")
+
+def analyze_pdf_file(pdf_path, output_dir):
+    """Upload and analyze one PDF in its own session and save the result"""
+    session_id = f"batch-{uuid.uuid4().hex}"
+    if not upload_pdf(pdf_path, session_id):
+        raise RuntimeError("upload or processing failed")
+
+    response = requests.post(f"{BASE_URL}/analyze_document", headers=session_headers(session_id))
+    if response.status_code != 200:
+        raise RuntimeError(f"analysis failed with status code {response.status_code}: {response.text}")
+
+    output_file = result_path(output_dir, os.path.basename(pdf_path))
+    with open(f"{output_file}.tmp", 'w') as f:
+        json.dump(response.json(), f, indent=2)
+    os.replace(f"{output_file}.tmp", output_file)
+    return output_file
+
+def analyze_directory(directory, output_dir, concurrency):
+    """
+    Upload and analyze every PDF in a directory, concurrency files at a time.
+
+    Files that already have a result in output_dir are skipped, so an
+    interrupted run can be resumed by starting it again.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    pdf_names = sorted(f for f in os.listdir(directory) if f.lower().endswith('.pdf'))
+    pending = [name for name in pdf_names if not os.path.exists(result_path(output_dir, name))]
+    print(f"\n=== Batch: {len(pdf_names)} PDFs, {len(pdf_names) - len(pending)} already analyzed ===")
+
+    start = time.time()
+    failed = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {
+            pool.submit(analyze_pdf_file, os.path.join(directory, name), output_dir): name
+            for name in pending
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                print(f"Saved {future.result()}")
+            except Exception as e:
+                failed += 1
+                print(f"Failed {name}: {e}")
+
+    elapsed = time.time() - start
+    analyzed = len(pending) - failed
+    rate = analyzed / elapsed * 60 if elapsed > 0 else 0.0
+    print(f"\nAnalyzed {analyzed}, failed {failed}, skipped {len(pdf_names) - len(pending)} "
+          f"in {elapsed:.1f}s ({rate:.2f} documents/minute)")
+
+def batch_analyze_on_server(directory, concurrency):
+    """Run the batch on the server with /batch_analyze (directory relative to its BATCH_ROOT)"""
+    response = requests.post(f"{BASE_URL}/batch_analyze", json={
+        'directory': directory,
+        'concurrency': concurrency
+    })
+    if response.status_code != 202:
+        print(f"Batch failed with status code {response.status_code}: {response.text}")
+        return
+
+    job = wait_for_job(response.json()['job_id'])
+    if job is not None:
+        print(json.dumps(job, indent=2))
+
 def reset_system():
     """Reset the database"""
     response = requests.post(f"{BASE_URL}/reset")
@@ -68,7 +179,20 @@ def main():
     parser.add_argument("--analyze", "-a", action="store_true", help="Analyze the most recently uploaded document")
     parser.add_argument("--list", "-l", action="store_true", help="List all uploaded documents")
     parser.add_argument("--reset", "-r", action="store_true", help="Reset the system")
+    parser.add_argument("--dir", "-d", help="Analyze every PDF in this directory, skipping ones with results")
+    parser.add_argument("--out", "-o", default="analysis_results", help="Directory for --dir results")
+    parser.add_argument("--concurrency", "-c", type=int, default=4, help="PDFs processed at once with --dir")
+    parser.add_argument("--remote", action="store_true",
+                        help="Run --dir on the server via /batch_analyze (path relative to its BATCH_ROOT)")
     args = parser.parse_args()
+
+    # Batch mode
+    if args.dir:
+        if args.remote:
+            batch_analyze_on_server(args.dir, args.concurrency)
+        else:
+            analyze_directory(args.dir, args.out, args.concurrency)
+        return
     
     # List documents if requested
     if args.list:
@@ -96,10 +220,6 @@ def main():
         if not file_uploaded:
             print("Failed to upload or process the document. Exiting.")
             return
-        
-        # Allow some time for processing
-        print("Processing document...")
-        time.sleep(2)
     
     # Analyze document if requested or if a file was just uploaded
     if args.analyze or file_uploaded:
@@ -134,7 +254,7 @@ def main():
         print(f"\nResults saved to {output_file}")
     
     # If no arguments provided, run in interactive mode
-    if not any([args.file, args.analyze, args.list, args.reset]):
+    if not any([args.file, args.analyze, args.list, args.reset, args.dir]):
         # Path to the PDF file
         pdf_path = input("Enter the path to the PDF file: ").strip()
         if not pdf_path:
@@ -143,4 +263,11 @@ def main():
         
         # Upload the PDF
         filename = upload_pdf(pdf_path)
-        if
\ No newline at end of file
+        if filename:
+            result = analyze_document()
+            print("\n=== Structured Output ===")
+            print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+CHUNK_SIZE = 1024 * 1024
+PARTIAL_PREFIX = ".upload-"
+PARTIAL_SUFFIX = ".part"
+
+# Characters that are unsafe in file names on common file systems
+_UNSAFE_CHARS = re.compile(r'[\x00-\x1f<>:"/\\|?*]')
+
+
+def hash_file(path):
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def clean_filename(filename, fallback):
+    """
+    Plain file name from a client supplied one.
+
+    Directories, unsafe characters and leading dots are dropped; non-ASCII
+    names (e.g. Devanagari titles) are kept. fallback is used when nothing
+    is left.
+    """
+    name = os.path.basename((filename or '').replace('\\', '/'))
+    name = _UNSAFE_CHARS.sub('_', name).strip().lstrip('.')
+    return name[:255] or fallback
+
+
+class HashingUploadFile:
+    """
+    Writable target of one uploaded file, hashed and size checked as it streams in.
+
+    Chunks are written straight to a temporary file next to the final upload
+    location while their SHA-256 is computed, so no copy of the upload is kept
+    in memory and it never has to be read again to be identified. Exceeding
+    max_bytes aborts the request with 413. commit() moves the file into place;
+    closing an uncommitted file removes it.
+    """
+
+    def __init__(self, directory, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._digest = hashlib.sha256()
+        fd, self.path = tempfile.mkstemp(prefix=PARTIAL_PREFIX, suffix=PARTIAL_SUFFIX, dir=directory)
+        self._file = os.fdopen(fd, 'w+b')
+        self._committed = False
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            self.close()
+            raise RequestEntityTooLarge(f"Uploads are limited to {self.max_bytes // (1024 * 1024)} MB")
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+    def read(self, *args):
+        return self._file.read(*args)
+
+    def readline(self, *args):
+        return self._file.readline(*args)
+
+    def seek(self, *args):
+        return self._file.seek(*args)
+
+    def tell(self):
+        return self._file.tell()
+
+    def flush(self):
+        self._file.flush()
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def commit(self, path):
+        """Move the complete upload to path, replacing an existing file"""
+        self._file.close()
+        os.replace(self.path, path)
+        self._committed = True
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        if not self._committed and os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def upload_request_class(directory, max_bytes):
+    """Flask request class streaming uploaded files into HashingUploadFile targets in directory"""
+
+    class UploadRequest(Request):
+        def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+            return HashingUploadFile(directory, max_bytes)
+
+    return UploadRequest
+
+
+def remove_partial_uploads(directory):
+    """Delete temporary files of uploads interrupted by a crash"""
+    for name in os.listdir(directory):
+        if name.startswith(PARTIAL_PREFIX) and name.endswith(PARTIAL_SUFFIX):
+            try:
+                os.unlink(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+def link_file(source, target):
+    """
+    Make target a hard link to source (a copy where links are not supported),
+    replacing an existing target atomically.
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix=PARTIAL_PREFIX, suffix=PARTIAL_SUFFIX, dir=os.path.dirname(target) or '.')
+    os.close(fd)
+    os.unlink(tmp_path)
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, target)
+
+
+class FileHashes:
+    """SHA-256 of served files, recomputed only when their size or mtime changes"""
+
+    def __init__(self):
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _stat_key(path):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def remember(self, path, digest):
+        """Record the hash of a file that was just written"""
+        with self._lock:
+            self._hashes[path] = (self._stat_key(path), digest)
+
+    def get(self, path):
+        key = self._stat_key(path)
+        with self._lock:
+            cached = self._hashes.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        digest = hash_file(path)
+        with self._lock:
+            self._hashes[path] = (key, digest)
+        return digest
@@ -21,13 +21,40 @@ export const uploadPDF = async (file) => {
       throw new Error(errorData.error || 'Upload failed');
     }
 
-    return response.json();
+    // Ingestion runs as a background job on the server
+    const data = await response.json();
+    const job = await waitForJob(data.job_id);
+    return { ...data, ...job.result, job };
   } catch (error) {
     console.error('Error uploading PDF:', error);
     throw error;
   }
 };
 
+/**
+ * Poll an ingest job until it is done or failed
+ * @param {string} jobId - ID returned by /upload
+ * @param {number} interval - Polling interval in milliseconds
+ * @returns {Promise<Object>} - The finished job
+ */
+export const waitForJob = async (jobId, interval = 1000) => {
+  for (;;) {
+    const response = await fetch(`${BASE_URL}/jobs/${jobId}`);
+    if (!response.ok) {
+      throw new Error('Failed to get upload status');
+    }
+
+    const job = await response.json();
+    if (job.stage === 'done') {
+      return job;
+    }
+    if (job.stage === 'failed') {
+      throw new Error(job.error || 'Processing failed');
+    }
+    await new Promise((resolve) => setTimeout(resolve, interval));
+  }
+};
+
 /**
  * Analyze the uploaded document
  * @returns {Promise<Object>} - Document analysis resultsx  x